@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+from protocol import PRUNE_IDLE_SECS, REQUEST_QUEUE_SIZE, ServerException, CommandHandler, GameRegistry
+from internals import Board, load_move_tables
+from bitboard import BitBoard
+import logging as log
+
+
+LOOPS = ['auto', 'asyncio', 'uvloop']
+
+
+def new_event_loop(name='auto'):
+    """Returns a new event loop of the named kind. The auto loop is uvloop when it is installed, otherwise the
+    standard asyncio loop."""
+    if name in ('auto', 'uvloop'):
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError:
+            if name == 'uvloop':
+                raise ServerException('uvloop is not installed')
+    return asyncio.new_event_loop()
+
+
+class ConnectionProtocol(CommandHandler, asyncio.Protocol):
+
+    """Handles one connection from asyncio callbacks. The requests of each read are dispatched together and what
+    they send is written to the transport at once, which sends what the socket does not take when it is writable."""
+
+    def __init__(self, server):
+        self.init_commands()
+        self.server = server
+        self.transport = None
+        self.buf = ''
+        self.outbound = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client = ':'.join(map(str, transport.get_extra_info('peername')[:2]))
+        log.debug('%s connected', self.client)
+
+    def data_received(self, data):
+        lines = (self.buf + data).split('\n')
+        self.buf = lines.pop()
+        self.handle_lines(lines)
+        if not self.servicing:
+            self.transport.close()
+
+    def eof_received(self):
+        """Runs a last request the client sent without a terminator before closing its side."""
+        if self.buf:
+            lines, self.buf = [self.buf], ''
+            self.handle_lines(lines)
+
+    def connection_lost(self, exc):
+        log.debug('%s finishing', self.client)
+        self.cleanup()
+
+    def send_raw(self, data):
+        """Sends data that is already terminated, such as a cached status line."""
+        log.debug('%s <= %s', self.client, data.rstrip())
+        if self.batching:
+            self.outbound.append(data)
+        else:
+            self.transport.write(data)
+
+    def flush(self):
+        if self.outbound:
+            data, self.outbound = ''.join(self.outbound), []
+            self.transport.write(data)
+
+    def cleanup(self):
+        if self.game:
+            log.debug('%s leaving game', self.client)
+            self.game.leave(self)
+            self.game = None
+
+    def _quit(self, *args):
+        """Handler for the QUIT command, terminates the connection with client once the result is sent."""
+        self.servicing = False
+        self.cleanup()
+
+
+class Server(GameRegistry):
+
+    """A network server running on an asyncio event loop, or any loop with the same interface such as uvloop."""
+
+    def __init__(self, log_level=log.INFO, ip='0.0.0.0', port=5000, prune_inactive=PRUNE_IDLE_SECS,
+                 board_factory=Board, time_control=None, loop=None):
+        log.basicConfig(level=log_level)
+        self.init_games(prune_inactive, board_factory, time_control)
+        self.loop = loop or new_event_loop()
+        self._server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: ConnectionProtocol(self), ip, port, reuse_address=True, backlog=REQUEST_QUEUE_SIZE))
+        self.server_address = self._server.sockets[0].getsockname()
+        self.host, self.port = self.server_address[:2]
+        self._timer_handle = None
+        self.timers.wakeup = self._arm_timers
+
+    def _arm_timers(self):
+        """Schedules the next advance of the game timers on the loop, replacing any scheduled before."""
+        if self._timer_handle:
+            self._timer_handle.cancel()
+        timeout = self.timers.next_timeout()
+        self._timer_handle = None if timeout is None else self.loop.call_later(timeout, self._run_timers)
+
+    def _run_timers(self):
+        self._timer_handle = None
+        self.timers.advance()
+        self._arm_timers()
+
+    def serve_forever(self):
+        log.info('started server on %s:%s using %s', self.host, self.port, type(self.loop).__name__)
+        self._arm_timers()
+        try:
+            self.loop.run_forever()
+        finally:
+            if self._timer_handle:
+                self._timer_handle.cancel()
+            self._server.close()
+            self.loop.run_until_complete(self._server.wait_closed())
+            self.loop.close()
+
+    def shutdown(self):
+        """Stops the loop. Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+if __name__ == '__main__':
+
+    import atexit
+    from argparse import ArgumentParser
+    from threaded_server import ServerPublisher
+
+    def parse_arguments():
+        arg_p = ArgumentParser(description='A network-based checkers server')
+        arg_p.add_argument('--interface', help='interface to bind to', default='0.0.0.0')
+        arg_p.add_argument('--port', help='port to bind to', type=int, default='0')
+        arg_p.add_argument('--log-level', help='diagnostic logging level', choices=['DEBUG', 'INFO'], default='INFO')
+        arg_p.add_argument('--prune-inactive', help='prune games after n seconds inactive', type=int,
+                           default=PRUNE_IDLE_SECS)
+        arg_p.add_argument('--time-control', help='seconds each player has for all their moves', type=float)
+        arg_p.add_argument('--zeroconf', help='register as a zeroconf service', action='store_true', default=False)
+        arg_p.add_argument('--bitboard', help='use the bitboard game engine', action='store_true', default=False)
+        arg_p.add_argument('--move-tables', help='load precomputed move tables from a data file')
+        arg_p.add_argument('--loop', help='event loop implementation', choices=LOOPS, default='auto')
+        return arg_p.parse_args()
+
+    def publish_server(server):
+        server_publisher = ServerPublisher()
+        server_publisher.publish(server.host, server.port)
+        atexit.register(server_publisher.shutdown)
+
+    args = parse_arguments()
+
+    if args.move_tables:
+        load_move_tables(args.move_tables)
+
+    try:
+        server = Server(ip=args.interface, port=args.port, log_level=log.getLevelName(args.log_level),
+                        prune_inactive=args.prune_inactive, board_factory=BitBoard if args.bitboard else Board,
+                        time_control=args.time_control,
+                        loop=new_event_loop(args.loop))
+        if args.zeroconf:
+            publish_server(server)
+        server.serve_forever()
+    except Exception as e:
+        log.exception(e)
@@ -0,0 +1,260 @@
+import numpy as np
+from internals import BLACK, RED, EMPTY, players, piece_chars, char_pieces, Board, CheckersException
+from bitboard import layout
+
+
+NO_PLAYER = -1  # Player index for boards without a winner or without a move to make
+
+_ONE = np.uint64(1)
+
+
+class BatchLayout(object):
+
+    """Per dimension tables for BatchBoards: bitboard.Layout shifts and edge masks as NumPy scalars, and the target
+    and captured square of a step or jump in each direction from each square."""
+
+    def __init__(self, dim):
+        self.layout = bits = layout(dim)
+        self.size = bits.size
+        self.full = np.uint64(bits.full)
+        self.bits = np.array([1 << square for square in xrange(self.size)], dtype=np.uint64)
+        self.directions = bits.directions
+        # Index of the player whose men move in each direction
+        self.direction_player = [0 if d in bits.forward[BLACK] else 1 for d in self.directions]
+        self.king_rows = np.array([bits.king_rows[BLACK], bits.king_rows[RED]], dtype=np.uint64)
+        self.reverse = [self._shift_masks(bits.reverse[d]) for d in self.directions]
+
+        self.step_target = np.full((len(self.directions), self.size), -1, dtype=np.int16)
+        self.jump_target = np.full((len(self.directions), self.size), -1, dtype=np.int16)
+        self.jump_over = np.full((len(self.directions), self.size), -1, dtype=np.int16)
+        for d, (dx, dy) in enumerate(self.directions):
+            for square, (x, y) in enumerate(bits.positions):
+                over, target = bits.squares.get((x + dx, y + dy)), bits.squares.get((x + 2 * dx, y + 2 * dy))
+                if over is not None:
+                    self.step_target[d, square] = over
+                    if target is not None:
+                        self.jump_target[d, square], self.jump_over[d, square] = target, over
+
+    @staticmethod
+    def _shift_masks(s):
+        shift_even, mask_even, shift_odd, mask_odd = s
+        return shift_even, np.uint64(mask_even), shift_odd, np.uint64(mask_odd)
+
+
+_batch_layouts = {}
+
+
+def batch_layout(dim):
+    """Returns the shared BatchLayout for the given dimension, creating it on first use."""
+    if dim not in _batch_layouts:
+        _batch_layouts[dim] = BatchLayout(dim)
+    return _batch_layouts[dim]
+
+
+def _shift(bb, amount):
+    return bb << np.uint64(amount) if amount > 0 else bb >> np.uint64(-amount)
+
+
+def step(bb, s):
+    """Shifts every square of every mask in bb one diagonal step, dropping squares that would leave the board."""
+    shift_even, mask_even, shift_odd, mask_odd = s
+    return _shift(bb & mask_even, shift_even) | _shift(bb & mask_odd, shift_odd)
+
+
+def popcount(bb):
+    """Returns the number of squares set in each mask."""
+    bb = bb - ((bb >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    bb = (bb & np.uint64(0x3333333333333333)) + ((bb >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    bb = (bb + (bb >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return ((bb * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+class BatchBoards(object):
+
+    """Many games kept as NumPy arrays of bit masks over the usable squares, one element per game, so that legal
+    moves, moves and winners are computed for all games at once. The rules are those of internals.Board, moves are
+    single steps as taken by Board.move and players are given by their index in internals.players. A move is the
+    square of the moving piece and the index of its direction in the layout; it is a capture when the game has
+    any capture available, as captures are forced."""
+
+    def __init__(self, count, dim=8):
+        self.dim = dim
+        self._layout = batch_layout(dim)
+        self.black = np.zeros(count, dtype=np.uint64)
+        self.red = np.zeros(count, dtype=np.uint64)
+        self.kings = np.zeros(count, dtype=np.uint64)
+        self.turn = np.zeros(count, dtype=np.int8)
+        self.last_jump = np.full(count, -1, dtype=np.int16)
+        board = Board(dim)
+        for player, x, y in board.start_positions():
+            bit = np.uint64(1 << self._layout.layout.squares[(x, y)])
+            if player == BLACK:
+                self.black |= bit
+            else:
+                self.red |= bit
+
+    @staticmethod
+    def from_boards(boards):
+        """Returns a batch holding copies of the given internals.Board positions."""
+        batch = BatchBoards(len(boards), boards[0].dim)
+        batch.black[:] = batch.red[:] = batch.kings[:] = 0
+        for index, board in enumerate(boards):
+            batch.load_encoded(index, board.encode())
+            batch.turn[index] = players.index(board.turn)
+            if board.last_jump_target:
+                batch.last_jump[index] = batch._layout.layout.squares[board.last_jump_target]
+        return batch
+
+    def __len__(self):
+        return len(self.turn)
+
+    def load_encoded(self, index, encoded):
+        """Replaces the pieces of one game with those in the form returned by Board.encode."""
+        black = red = kings = 0
+        for square, c in enumerate(encoded):
+            kind = char_pieces.get(c)
+            if kind is not None:
+                if kind[0] == BLACK:
+                    black |= 1 << square
+                else:
+                    red |= 1 << square
+                if kind[1]:
+                    kings |= 1 << square
+        self.black[index], self.red[index], self.kings[index] = black, red, kings
+        self.last_jump[index] = -1
+
+    def encode(self, index):
+        """Returns one game in the form returned by Board.encode."""
+        black, red, kings = int(self.black[index]), int(self.red[index]), int(self.kings[index])
+        cells = [EMPTY] * self._layout.size
+        for square in xrange(self._layout.size):
+            bit = 1 << square
+            if (black | red) & bit:
+                cells[square] = piece_chars[(BLACK if black & bit else RED, bool(kings & bit))]
+        return ''.join(cells)
+
+    def board(self, index):
+        """Returns an internals.Board with the position of one game."""
+        board = Board.from_encoded(self.encode(index), self.dim)
+        board.turn = players[self.turn[index]]
+        if self.last_jump[index] >= 0:
+            board.last_jump_target = self._layout.layout.positions[self.last_jump[index]]
+        return board
+
+    def winners(self):
+        """Returns the index of the winning player of each game, or NO_PLAYER."""
+        black, red = self.black != 0, self.red != 0
+        return np.where(black & ~red, 0, np.where(red & ~black, 1, NO_PLAYER)).astype(np.int8)
+
+    def _masks(self, own, opponent, player):
+        """Returns, per direction, masks of the pieces in own that can step and that can jump, for games where own
+        belongs to the player with the given index. Steps are not cleared when a jump is available."""
+        lay = self._layout
+        empty = ~(own | opponent) & lay.full
+        men, kings = own & ~self.kings, own & self.kings
+        steps, jumps = [], []
+        for d, back in enumerate(lay.reverse):
+            pieces = kings | np.where(player == lay.direction_player[d], men, np.uint64(0))
+            landing = step(empty, back)
+            steps.append(pieces & landing)
+            jumps.append(pieces & step(opponent & landing, back))
+        return steps, jumps
+
+    def _sides(self):
+        black_turn = self.turn == 0
+        own = np.where(black_turn, self.black, self.red)
+        opponent = np.where(black_turn, self.red, self.black)
+        return own, opponent
+
+    def move_masks(self):
+        """Returns two arrays of shape (directions, games): masks of the squares of the pieces of the player to move
+        that can step and that can jump in each direction. Steps are empty in games with a capture available."""
+        own, opponent = self._sides()
+        steps, jumps = self._masks(own, opponent, self.turn)
+        steps, jumps = np.array(steps), np.array(jumps)
+        steps[:, np.bitwise_or.reduce(jumps, axis=0) != 0] = 0
+        return steps, jumps
+
+    def moves(self, index):
+        """Returns the legal single step moves of one game as (source, target) positions."""
+        steps, jumps = self.move_masks()
+        lay = self._layout
+        result = []
+        for masks, targets in [(steps, lay.step_target), (jumps, lay.jump_target)]:
+            for d in xrange(len(lay.directions)):
+                mask = int(masks[d, index])
+                for square in xrange(lay.size):
+                    if mask >> square & 1:
+                        result.append((lay.layout.positions[square], lay.layout.positions[targets[d, square]]))
+        return result
+
+    def random_moves(self, random_state):
+        """Returns (sources, directions) arrays with a uniformly chosen legal move for each game, or -1 for games
+        without a move, using a numpy.random.RandomState."""
+        steps, jumps = self.move_masks()
+        masks = np.where(np.bitwise_or.reduce(jumps, axis=0) != 0, jumps, steps)
+        counts = popcount(masks).sum(axis=0)
+        remaining = (random_state.random_sample(len(self)) * counts).astype(np.int64)
+        sources = np.full(len(self), -1, dtype=np.int16)
+        directions = np.full(len(self), -1, dtype=np.int16)
+        for d in xrange(len(self._layout.directions)):
+            for square in xrange(self._layout.size):
+                present = ((masks[d] >> np.uint64(square)) & _ONE).astype(bool) & (sources < 0)
+                chosen = present & (remaining == 0)
+                sources[chosen], directions[chosen] = square, d
+                remaining -= present & ~chosen
+        return sources, directions
+
+    def apply(self, sources, directions):
+        """Makes one move in each game given its source square and direction, skipping games whose source is
+        negative. Raises a CheckersException if any move is not legal."""
+        lay = self._layout
+        active = sources >= 0
+        if not active.any():
+            return
+        steps, jumps = self.move_masks()
+        capture = np.bitwise_or.reduce(jumps, axis=0) != 0
+        src, d = sources.clip(0), directions.clip(0)
+        source_bit = lay.bits[src]
+        allowed = np.where(capture, jumps[d, np.arange(len(self))], steps[d, np.arange(len(self))])
+        invalid = active & ((allowed & source_bit) == 0)
+        if invalid.any():
+            raise CheckersException('invalid moves in games %s' % ' '.join(map(str, np.flatnonzero(invalid))))
+
+        target = np.where(capture, lay.jump_target[d, src], lay.step_target[d, src])
+        target_bit = np.where(active, lay.bits[target.clip(0)], np.uint64(0))
+        source_bit = np.where(active, source_bit, np.uint64(0))
+        captured = active & capture
+        captured_bit = np.where(captured, lay.bits[lay.jump_over[d, src].clip(0)], np.uint64(0))
+        moved = source_bit | target_bit
+        black_turn = self.turn == 0
+
+        self.black ^= np.where(black_turn, moved, np.uint64(0))
+        self.red ^= np.where(black_turn, np.uint64(0), moved)
+        self.kings ^= np.where(self.kings & source_bit, moved, np.uint64(0))
+        self.black &= ~np.where(black_turn, np.uint64(0), captured_bit)
+        self.red &= ~np.where(black_turn, captured_bit, np.uint64(0))
+        self.kings &= ~captured_bit
+        self.last_jump = np.where(captured, target, np.where(active, -1, self.last_jump)).astype(np.int16)
+
+        # Turn passes unless the capturing piece can capture again or the opponent has no move, before kinging
+        own, opponent = self._sides()
+        own_jumps = self._masks(own, opponent, self.turn)[1]
+        again = captured & ((np.bitwise_or.reduce(own_jumps, axis=0) & target_bit) != 0)
+        opponent_steps, opponent_jumps = self._masks(opponent, own, 1 - self.turn)
+        blocked = (np.bitwise_or.reduce(opponent_steps + opponent_jumps, axis=0)) == 0
+        self.kings |= target_bit & lay.king_rows[self.turn]
+        self.turn = np.where(active & ~again & ~blocked, 1 - self.turn, self.turn).astype(np.int8)
+
+    def play_random(self, random_state, max_moves=300):
+        """Plays random moves in every game until each is won, has no move or has had max_moves moves. Returns the
+        number of moves made in each game."""
+        lengths = np.zeros(len(self), dtype=np.int64)
+        for ply in xrange(max_moves):
+            sources, directions = self.random_moves(random_state)
+            sources[self.winners() != NO_PLAYER] = -1
+            if (sources < 0).all():
+                break
+            self.apply(sources, directions)
+            lengths += sources >= 0
+        return lengths
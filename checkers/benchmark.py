@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+import json
+import os
+import sys
+from time import time
+from timeit import Timer
+from internals import RED, BLACK, Board, new_game, perft
+import logging as log
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'benchmark-data', 'baseline.json')
+DEFAULT_TOLERANCE = 0.5
+
+# (name, board or None for the starting position, player to move, expected perft counts from depth 1)
+PERFT_POSITIONS = [
+    ('start', None, BLACK, [7, 49, 302, 1469, 7361, 36768]),
+    ('middle', '*b*b*b*b|b***b*b*|*b*****b|**r*****|********|r*r*r*b*|*r*r****|r*r*r*r*', BLACK,
+     [1, 1, 9, 49, 412, 2418]),
+    ('multi-jump', '********|****b***|***r****|********|*r*r****|********|********|********', BLACK,
+     [2, 4, 6, 10, 20, 40]),
+    ('kings', '*B******|********|***r****|****R***|***b****|********|*****B**|****r***', RED,
+     [2, 9, 44, 148, 794, 3082, 17827]),
+]
+
+
+def position(board_str, turn):
+    """Returns a board with the given position, or the starting position if board_str is None."""
+    if board_str is None:
+        board = new_game()
+    else:
+        board = Board()
+        board.load_str(board_str)
+    board.turn = turn
+    return board
+
+
+def _timed(function, *args):
+    start = time()
+    function(*args)
+    return time() - start
+
+
+def run_perft(max_depth=None, repeat=3):
+    """Checks the perft counts of each position and times the deepest one, best of repeat runs. Returns the results
+    and a list of mismatched counts."""
+    results, errors = {}, []
+    for name, board_str, turn, expected in PERFT_POSITIONS:
+        board = position(board_str, turn)
+        expected = expected[:max_depth] if max_depth else expected
+        for depth, count in enumerate(expected, 1):
+            nodes = perft(board, depth)
+            if nodes != count:
+                errors.append('perft %s %s: %s nodes, expected %s' % (name, depth, nodes, count))
+        elapsed = min(_timed(perft, board, len(expected)) for run in xrange(repeat))
+        results['perft %s %s' % (name, len(expected))] = {'seconds': elapsed, 'nodes': nodes,
+                                                           'nps': int(nodes / elapsed) if elapsed else 0}
+    return results, errors
+
+
+def micro_benchmarks():
+    """Returns (name, setup) pairs, where setup returns the function to time."""
+
+    def construct():
+        return Board
+
+    def validate_moves():
+        board = new_game()
+        pairs = [(source, target) for source in sorted(board.usable_positions())
+                 for target in sorted(board.usable_positions())][:64]
+
+        def validate():
+            for source, target in pairs:
+                board._valid_move(source, target)
+        return validate
+
+    def possible_jump():
+        board = position(PERFT_POSITIONS[1][1], BLACK)
+
+        def check():
+            board._possible_jump(BLACK)
+            board._possible_jump(RED)
+        return check
+
+    def legal_moves():
+        board = new_game()
+        return lambda: list(board.legal_moves())
+
+    def push_pop():
+        board = new_game()
+
+        def move():
+            board.push(((1, 2), (0, 3)))
+            board.pop()
+        return move
+
+    def represent():
+        board = new_game()
+        return lambda: repr(board)
+
+    def load():
+        board, board_str = Board(), repr(new_game())
+        return lambda: board.load_str(board_str)
+
+    return [('Board()', construct), ('move validation x64', validate_moves), ('_possible_jump', possible_jump),
+            ('legal_moves', legal_moves), ('push/pop', push_pop), ('__repr__', represent), ('load_str', load)]
+
+
+def run_micro(repeat=5, min_time=0.1):
+    """Times each micro-benchmark and returns the best seconds per call."""
+    results = {}
+    for name, setup in micro_benchmarks():
+        timer = Timer(setup())
+        number = 1
+        while timer.timeit(number) < min_time:
+            number *= 10
+        results[name] = {'seconds': min(timer.repeat(repeat, number)) / number}
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns descriptions of the results slower than the baseline by more than the tolerance."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name in baseline and baseline[name]['seconds']:
+            ratio = result['seconds'] / baseline[name]['seconds']
+            if ratio > 1 + tolerance:
+                regressions.append('%s: %.3gs against %.3gs in baseline, %.0f%% slower' % (
+                    name, result['seconds'], baseline[name]['seconds'], (ratio - 1) * 100))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+
+    def parse_arguments():
+        arg_p = ArgumentParser(description='Benchmarks the rules engine and compares the results with a baseline')
+        arg_p.add_argument('--output', help='file to write the results to as JSON')
+        arg_p.add_argument('--baseline', help='JSON results to compare with', default=DEFAULT_BASELINE)
+        arg_p.add_argument('--tolerance', help='fraction slower than the baseline that counts as a regression',
+                           type=float, default=DEFAULT_TOLERANCE)
+        arg_p.add_argument('--update-baseline', help='write the results as the new baseline', action='store_true',
+                           default=False)
+        arg_p.add_argument('--perft-depth', help='limit the perft depth for a quicker run', type=int)
+        return arg_p.parse_args()
+
+    args = parse_arguments()
+    log.basicConfig(level=log.INFO)
+    results, errors = run_perft(args.perft_depth)
+    results.update(run_micro())
+    for name, result in sorted(results.items()):
+        extra = '  %(nodes)s nodes, %(nps)s nodes/sec' % result if 'nodes' in result else ''
+        print '%-22s %14.2fus%s' % (name, result['seconds'] * 1e6, extra)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            errors += compare(results, json.load(baseline_file), args.tolerance)
+    for error in errors:
+        log.error(error)
+    sys.exit(1 if errors else 0)
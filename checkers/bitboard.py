@@ -0,0 +1,356 @@
+from sys import getsizeof
+from internals import RED, BLACK, EMPTY, players, opponent, piece_chars, char_pieces, Piece, Snapshot, \
+    CheckersException, InvalidMoveException, InvalidPlacementException
+
+
+class Layout:
+
+    """Square numbering, shift amounts and edge masks for a board dimension. Usable squares are numbered row by row,
+    so square (x, y) has bit y * (dim / 2) + x / 2."""
+
+    # (dx, dy) for each diagonal direction
+    directions = [(-1, 1), (1, 1), (-1, -1), (1, -1)]
+    forward = {BLACK: [(-1, 1), (1, 1)], RED: [(-1, -1), (1, -1)]}
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.half = dim / 2
+        self.size = dim * self.half
+        self.full = (1 << self.size) - 1
+        self.positions = [(2 * (i % self.half) + (i / self.half + 1) % 2, i / self.half) for i in xrange(self.size)]
+        self.squares = dict((pos, i) for i, pos in enumerate(self.positions))
+
+        # Each direction is (even row shift, even row source mask, odd row shift, odd row source mask)
+        self.steps = {}
+        for dx, dy in self.directions:
+            step = [0, 0, 0, 0]
+            for i, (x, y) in enumerate(self.positions):
+                target = self.squares.get((x + dx, y + dy))
+                if target is not None:
+                    parity = 2 * (y % 2)
+                    step[parity] = target - i
+                    step[parity + 1] |= 1 << i
+            self.steps[(dx, dy)] = tuple(step)
+
+        self.reverse = dict((d, self.steps[(-d[0], -d[1])]) for d in self.directions)
+        self.man_steps = dict((player, [self.steps[d] for d in self.forward[player]]) for player in players)
+        self.man_reverse = dict((player, [self.reverse[d] for d in self.forward[player]]) for player in players)
+        self.king_steps = [self.steps[d] for d in self.directions]
+        self.king_reverse = [self.reverse[d] for d in self.directions]
+
+        self.king_rows = {BLACK: self.row_mask(dim - 1), RED: self.row_mask(0)}
+
+    def row_mask(self, y):
+        return ((1 << self.half) - 1) << (y * self.half)
+
+
+_layouts = {}
+
+
+def layout(dim):
+    """Returns the shared Layout for the given dimension, creating it on first use."""
+    if dim not in _layouts:
+        _layouts[dim] = Layout(dim)
+    return _layouts[dim]
+
+
+def step(bb, s):
+    """Shifts every square in bb one diagonal step, dropping squares that would leave the board."""
+    shift_even, mask_even, shift_odd, mask_odd = s
+    even, odd = bb & mask_even, bb & mask_odd
+    even = even << shift_even if shift_even > 0 else even >> -shift_even
+    odd = odd << shift_odd if shift_odd > 0 else odd >> -shift_odd
+    return even | odd
+
+
+class BitBoard(object):
+
+    """Checkers game state kept as bit masks over the usable squares. It implements the same rules and public methods
+    as internals.Board, so it can be used by the servers in its place."""
+
+    __slots__ = ('dim', '_neutral_rows', '_layout', '_pieces', '_kings', 'last_jump_target', 'turn')
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self._neutral_rows = 2
+        self._layout = layout(dim)
+        self._pieces = {BLACK: 0, RED: 0}
+        self._kings = 0
+        self.last_jump_target = None
+        self.turn = BLACK
+
+    @staticmethod
+    def from_str(board_str):
+        """Returns an initialized board from a string representation."""
+        lines = filter(lambda l: len(l), board_str.split('\n'))
+        board = BitBoard(len(lines[0]))
+        board.load_str(board_str, split_on='\n')
+        return board
+
+    @staticmethod
+    def from_encoded(encoded, dim=8):
+        """Returns a board initialized from the form returned by encode."""
+        board = BitBoard(dim)
+        board.load_encoded(encoded)
+        return board
+
+    def load_str(self, board_str, split_on='|'):
+        """Replaces the pieces on the board with those in a string representation."""
+        lines = filter(lambda l: len(l), board_str.split(split_on))
+        if len(lines[0]) != self.dim:
+            raise CheckersException('can not load string of dim %s into board of dim %s' % (len(lines[0]), self.dim))
+        if len(lines[0]) != len(lines) or any(len(line) != self.dim for line in lines):
+            raise CheckersException('board dimension mismatch: %s x %s' % (len(lines[0]), len(lines)))
+        chars = [lines[y][x] for x, y in self._layout.positions]
+        if sum(1 for c in chars if c in char_pieces) != sum(line.count(c) for line in lines for c in char_pieces):
+            raise InvalidPlacementException('can not place pieces on unusable squares')
+        self._load_squares(chars)
+
+    def encode(self):
+        """Returns the board in compact form, one character per usable square in square order."""
+        black, red, kings = self._pieces[BLACK], self._pieces[RED], self._kings
+        cells = [EMPTY] * self._layout.size
+        for square in xrange(self._layout.size):
+            bit = 1 << square
+            if (black | red) & bit:
+                cells[square] = piece_chars[(BLACK if black & bit else RED, bool(kings & bit))]
+        return ''.join(cells)
+
+    def snapshot(self):
+        """Returns an immutable Snapshot of the board, unaffected by later changes to it."""
+        return Snapshot(self.dim, self.encode(), self.turn, self.last_jump_target)
+
+    def load_encoded(self, encoded):
+        """Replaces the pieces on the board with those in the form returned by encode."""
+        if len(encoded) != self._layout.size:
+            raise CheckersException('can not load %s squares into board of dim %s' % (len(encoded), self.dim))
+        self._load_squares(encoded)
+
+    def _load_squares(self, chars):
+        """Replaces the pieces on the board with one per character, given by square number."""
+        self.clear()
+        for square, c in enumerate(chars):
+            kind = char_pieces.get(c)
+            if kind is not None:
+                self._pieces[kind[0]] |= 1 << square
+                if kind[1]:
+                    self._kings |= 1 << square
+
+    def add_piece(self, piece, location):
+        """Adds a new Piece to this board. Raises a CheckersException if placement is invalid."""
+        if not isinstance(piece, Piece):
+            raise CheckersException('can only add Pieces')
+        if not self._valid_placement(piece, location):
+            raise InvalidPlacementException('can not place piece at %s' % location)
+        self[location] = piece
+
+    def _valid_placement(self, piece, location):
+        """Returns true if the specified piece can be placed at the specified location."""
+        return location in self._layout.squares and not location in self
+
+    def start_positions(self):
+        """Returns a list of (player,x,y) tuples for start positions"""
+        black_positions = [(BLACK, x, y) for (x, y) in self._layout.positions if y < self._player_rows()]
+        red_positions = [(RED, x, y) for (x, y) in self._layout.positions if y >= self.dim - self._player_rows()]
+        return black_positions + red_positions
+
+    def usable_positions(self):
+        """Returns the positions on the board that a piece can occupy."""
+        return set(self._layout.positions)
+
+    def _player_rows(self):
+        """Returns the number of rows a player controls at game start"""
+        return (self.dim - self._neutral_rows) / 2
+
+    def _piece(self, square):
+        """Returns a new Piece describing the occupant of the given square, or None if it is empty."""
+        bit = 1 << square
+        for player in players:
+            if self._pieces[player] & bit:
+                piece = Piece(player)
+                piece.king = bool(self._kings & bit)
+                piece.location = self._layout.positions[square]
+                return piece
+        return None
+
+    def __iter__(self):
+        """Allows iteration over the entire set of pieces as Piece objects"""
+        for square in xrange(self._layout.size):
+            piece = self._piece(square)
+            if piece:
+                yield piece
+
+    def __getitem__(self, loc):
+        """Returns a Piece describing the occupant of the position specified as a tuple (x,y)"""
+        square = self._layout.squares.get(loc)
+        piece = self._piece(square) if square is not None else None
+        if not piece:
+            raise KeyError(loc)
+        return piece
+
+    def __contains__(self, loc):
+        """Returns whether there is a piece at the specified location"""
+        square = self._layout.squares.get(loc)
+        return square is not None and bool((self._pieces[BLACK] | self._pieces[RED]) & (1 << square))
+
+    def __setitem__(self, loc, piece):
+        """Sets the occupant of the position specified by the tuple (x,y) to match the specified piece."""
+        if piece.player not in players:
+            raise CheckersException('Piece does not belong to a player')
+        bit = 1 << self._layout.squares[loc]
+        self._pieces[opponent[piece.player]] &= ~bit
+        self._pieces[piece.player] |= bit
+        if piece.king:
+            self._kings |= bit
+        else:
+            self._kings &= ~bit
+
+    def clear(self):
+        self._pieces[BLACK] = self._pieces[RED] = self._kings = 0
+
+    def memory_usage(self):
+        """Returns the approximate number of bytes held by this board, not counting the shared layout."""
+        return getsizeof(self) + getsizeof(self._pieces) + sum(getsizeof(mask) for mask in self._pieces.itervalues()) \
+            + getsizeof(self._kings)
+
+    def can_jump(self):
+        """Returns whether the player to move has a capture, and so must make one."""
+        return self.turn in players and bool(self._jumpers(self.turn))
+
+    def pieces(self, player):
+        """Returns a generator for Pieces describing those of one player."""
+        mask = self._pieces[player]
+        for square in xrange(self._layout.size):
+            if mask >> square & 1:
+                yield self._piece(square)
+
+    def piece_count(self, player):
+        """Returns the number of pieces one player has on the board."""
+        return bin(self._pieces[player]).count('1')
+
+    def winner(self):
+        """Returns the player that has won the game or None if no winner."""
+        black, red = self._pieces[BLACK], self._pieces[RED]
+        if black and not red:
+            return BLACK
+        elif red and not black:
+            return RED
+        else:
+            return None
+
+    def _jumpers(self, player):
+        """Returns the mask of the player's pieces that can capture."""
+        pieces, empty = self._pieces[player], ~(self._pieces[BLACK] | self._pieces[RED]) & self._layout.full
+        targets = self._pieces[opponent[player]]
+        men, kings = pieces & ~self._kings, pieces & self._kings
+        result = 0
+        for back in self._layout.man_reverse[player]:
+            result |= men & step(targets & step(empty, back), back)
+        if kings:
+            for back in self._layout.king_reverse:
+                result |= kings & step(targets & step(empty, back), back)
+        return result
+
+    def _movers(self, player):
+        """Returns the mask of the player's pieces that have a non-capturing move."""
+        pieces, empty = self._pieces[player], ~(self._pieces[BLACK] | self._pieces[RED]) & self._layout.full
+        men, kings = pieces & ~self._kings, pieces & self._kings
+        result = 0
+        for back in self._layout.man_reverse[player]:
+            result |= men & step(empty, back)
+        if kings:
+            for back in self._layout.king_reverse:
+                result |= kings & step(empty, back)
+        return result
+
+    def _can_jump_from(self, source_bit, player):
+        """Returns whether the piece of the player on the given square can capture."""
+        empty = ~(self._pieces[BLACK] | self._pieces[RED]) & self._layout.full
+        targets = self._pieces[opponent[player]]
+        steps = self._layout.king_steps if self._kings & source_bit else self._layout.man_steps[player]
+        for s in steps:
+            if step(step(source_bit, s) & targets, s) & empty:
+                return True
+        return False
+
+    def _check_move(self, source_bit, target_bit, player):
+        """Returns None if the move is invalid, 0 for a valid non-capturing move or the captured square's bit."""
+        if target_bit & (self._pieces[BLACK] | self._pieces[RED]):
+            return None
+        steps = self._layout.king_steps if self._kings & source_bit else self._layout.man_steps[player]
+        for s in steps:
+            over = step(source_bit, s)
+            if over == target_bit:
+                return None if self._jumpers(player) else 0
+            if over & self._pieces[opponent[player]] and step(over, s) == target_bit:
+                return over
+        return None
+
+    def _valid_move(self, source, target):
+        """Returns whether the move from source to target is a valid move."""
+        squares = self._layout.squares
+        if source not in self or target not in squares:
+            return False
+        source_bit = 1 << squares[source]
+        player = BLACK if self._pieces[BLACK] & source_bit else RED
+        return self._check_move(source_bit, 1 << squares[target], player) is not None
+
+    def _possible_move(self, player):
+        """Returns whether the player has any possible move."""
+        return bool(self._movers(player) or self._jumpers(player))
+
+    def _perform_move(self, source_bit, target_bit, captured_bit, player):
+        """Moves the piece, removes any captured piece, updates the turn and kings the piece. Returns a Piece
+        describing the captured piece, or None if not a capture."""
+        result = None
+        self._pieces[player] ^= source_bit | target_bit
+        if self._kings & source_bit:
+            self._kings ^= source_bit | target_bit
+        if captured_bit:
+            result = self._piece(captured_bit.bit_length() - 1)
+            self._pieces[opponent[player]] &= ~captured_bit
+            self._kings &= ~captured_bit
+            self.last_jump_target = self._layout.positions[target_bit.bit_length() - 1]
+        else:
+            self.last_jump_target = None
+        if (not (captured_bit and self._can_jump_from(target_bit, player))) \
+                and self._possible_move(opponent[player]):
+            self.turn = opponent[player]
+        if target_bit & self._layout.king_rows[player]:  # Only king after figuring out turn
+            self._kings |= target_bit
+        return result
+
+    def move(self, source, target):
+        """Moves the piece at source position to target and returns None or the captured piece. It throws a
+        InvalidMoveError if the move is not valid."""
+        squares = self._layout.squares
+        if source not in squares or target not in squares:
+            raise InvalidMoveException("invalid move from %s to %s" % (source, target))
+        source_bit, target_bit = 1 << squares[source], 1 << squares[target]
+        player = self.turn
+        captured_bit = None
+        if player in players and self._pieces[player] & source_bit:
+            captured_bit = self._check_move(source_bit, target_bit, player)
+        if captured_bit is None:
+            raise InvalidMoveException("invalid move from %s to %s" % (source, target))
+        return self._perform_move(source_bit, target_bit, captured_bit, player)
+
+    def _rows(self):
+        """Returns the board as a list of row strings."""
+        cells = ['*'] * (self.dim * self.dim)
+        black, red, kings = self._pieces[BLACK], self._pieces[RED], self._kings
+        for i, (x, y) in enumerate(self._layout.positions):
+            bit = 1 << i
+            if black & bit:
+                cells[y * self.dim + x] = 'B' if kings & bit else 'b'
+            elif red & bit:
+                cells[y * self.dim + x] = 'R' if kings & bit else 'r'
+        return [''.join(cells[y * self.dim:(y + 1) * self.dim]) for y in xrange(self.dim)]
+
+    def __repr__(self):
+        """Returns the board in computer readable form."""
+        return '|'.join(self._rows())
+
+    def __str__(self):
+        """Returns the board in human readable form."""
+        return '\n'.join(self._rows())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+import os
+import struct
+from mmap import mmap, ACCESS_READ
+from internals import RED, BLACK, CheckersException, new_game
+import logging as log
+
+
+MAGIC = 'CKBK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')  # Magic, version, board dimension, number of records
+RECORD = struct.Struct('<QBBI')  # Zobrist hash, source square, target square, weight
+DEFAULT_MAX_PLIES = 24
+MAX_WEIGHT = (1 << 32) - 1
+
+
+def read_script(lines):
+    """Returns the single step moves of MOVE lines, as in game-data/moves-*, as ((x, y), (x, y)) pairs."""
+    moves = []
+    for line in lines:
+        fields = line.split()
+        if fields:
+            if len(fields) != 5 or fields[0] != 'MOVE':
+                raise CheckersException('invalid move line %r' % line.strip())
+            x1, y1, x2, y2 = map(int, fields[1:])
+            moves.append(((x1, y1), (x2, y2)))
+    return moves
+
+
+def interleave(scripts, dim=8):
+    """Returns the moves of a game recorded as one MOVE script per player, in the order they are played, following
+    the turn through multi-jumps."""
+    board = new_game(dim)
+    remaining = dict((player, list(reversed(moves))) for player, moves in scripts.items())
+    moves = []
+    while remaining.get(board.turn) and not board.winner():
+        move = remaining[board.turn].pop()
+        board.move(*move)
+        moves.append(move)
+    return moves
+
+
+class BookBuilder(object):
+
+    """Counts the moves played from each position in the opening of a set of games, keyed by the position's Zobrist
+    hash, and writes them as a book file. Only the first step of each turn, the step after one that passed the turn,
+    is counted; the rest of a multi-jump is found again from the legal moves when the book is read."""
+
+    def __init__(self, dim=8, max_plies=DEFAULT_MAX_PLIES):
+        self.dim = dim
+        self.max_plies = max_plies
+        self.weights = {}
+        self.games = 0
+
+    def add_game(self, moves):
+        """Replays the single step moves of one game from the starting position, counting those within max_plies
+        turns. Raises a CheckersException if a move is not legal."""
+        board = new_game(self.dim)
+        square_of = board._tables.square_of
+        plies, turn_start = 0, True
+        for source, target in moves:
+            if turn_start:
+                if plies >= self.max_plies:
+                    break
+                key = (board.zobrist_hash(), square_of[source], square_of[target])
+                self.weights[key] = self.weights.get(key, 0) + 1
+                plies += 1
+            turn = board.turn
+            board.move(source, target)
+            turn_start = board.turn != turn
+        self.games += 1
+
+    def add_scripts(self, scripts):
+        """Adds a game recorded as one MOVE script per player."""
+        self.add_game(interleave(scripts, self.dim))
+
+    def write(self, path):
+        """Writes the book sorted by hash, so it can be searched without being loaded."""
+        records = sorted(self.weights.items())
+        with open(path, 'wb') as book_file:
+            book_file.write(HEADER.pack(MAGIC, VERSION, self.dim, len(records)))
+            for (key, source, target), weight in records:
+                book_file.write(RECORD.pack(key, source, target, min(weight, MAX_WEIGHT)))
+        log.info('wrote %s moves from %s games to %s', len(records), self.games, path)
+
+
+class OpeningBook(object):
+
+    """A book file read through mmap and searched by binary search on the position hash, so opening a book does no
+    parsing and its pages are shared by every process using it."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as book_file:
+            self._map = mmap(book_file.fileno(), 0, access=ACCESS_READ)
+        magic, version, self.dim, self.size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise CheckersException('%s is not a version %s opening book' % (path, VERSION))
+        if len(self._map) != HEADER.size + self.size * RECORD.size:
+            raise CheckersException('%s is truncated' % path)
+
+    def __len__(self):
+        return self.size
+
+    def _key(self, index):
+        return struct.unpack_from('<Q', self._map, HEADER.size + index * RECORD.size)[0]
+
+    def lookup(self, key):
+        """Returns the (source square, target square, weight) records stored for a position hash."""
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        records = []
+        while low < self.size:
+            record_key, source, target, weight = RECORD.unpack_from(self._map, HEADER.size + low * RECORD.size)
+            if record_key != key:
+                break
+            records.append((source, target, weight))
+            low += 1
+        return records
+
+    def moves(self, board):
+        """Returns the book moves for the player to move as ((source, target), weight) pairs, most played first."""
+        if board.dim != self.dim:
+            return []
+        positions = board._tables.positions
+        records = self.lookup(board.zobrist_hash())
+        return [((positions[source], positions[target]), weight)
+                for source, target, weight in sorted(records, key=lambda record: -record[2])]
+
+    def choose(self, board):
+        """Returns the legal move path for the most played book move, or None if the position is not in the book."""
+        legal = list(board.legal_moves())
+        for step, weight in self.moves(board):
+            for move in legal:
+                if tuple(move[:2]) == step:
+                    return move
+        return None
+
+    def close(self):
+        self._map.close()
+
+
+def build(path, game_files, dim=8, max_plies=DEFAULT_MAX_PLIES):
+    """Writes a book from game files, each holding the MOVE lines of one game in the order played, and from pairs of
+    moves-black and moves-red scripts in directories."""
+    builder = BookBuilder(dim, max_plies)
+    for name in game_files:
+        if os.path.isdir(name):
+            scripts = {}
+            for player in [BLACK, RED]:
+                with open(os.path.join(name, 'moves-%s' % player), 'r') as move_file:
+                    scripts[player] = read_script(move_file)
+            builder.add_scripts(scripts)
+        else:
+            with open(name, 'r') as game_file:
+                builder.add_game(read_script(game_file))
+    builder.write(path)
+    return builder
+
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+
+    def parse_arguments():
+        arg_p = ArgumentParser(description='Builds a checkers opening book from recorded games')
+        arg_p.add_argument('games', help='files of MOVE lines in the order played, or directories holding '
+                           'moves-black and moves-red scripts', nargs='+')
+        arg_p.add_argument('--output', help='book file to write', default='opening.book')
+        arg_p.add_argument('--plies', help='number of turns from the start of each game to include', type=int,
+                           default=DEFAULT_MAX_PLIES)
+        arg_p.add_argument('--log-level', help='diagnostic logging level', choices=['DEBUG', 'INFO'], default='INFO')
+        return arg_p.parse_args()
+
+    args = parse_arguments()
+    log.basicConfig(level=log.getLevelName(args.log_level))
+    build(args.output, args.games, max_plies=args.plies)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+from time import time
+from multiprocessing import Pool, cpu_count
+from internals import RED, BLACK, Board
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+from tablebase import Tablebase, DRAW, WIN as TABLE_WIN
+import logging as log
+
+
+WIN = 100000  # Score for having won, reduced by the number of plies it takes
+MAN, KING, ADVANCE = 100, 160, 3  # Piece values and bonus per row advanced by a man
+INFINITY = WIN + 1
+TABLEBASE_WIN = WIN / 2  # Score for a tablebase win, reduced by its distance when known
+WIN_BOUND = TABLEBASE_WIN / 2  # Scores beyond this count plies from the root to a win
+DEFAULT_TIME_BUDGET_MS = 1000
+
+
+class SearchTimeout(Exception):
+
+    """Raised inside the search when the time budget is used up."""
+
+
+def is_capture(move):
+    """Returns whether the move path is a capture."""
+    return abs(move[1][1] - move[0][1]) == 2
+
+
+def to_table(score, ply):
+    """Returns a score found ply plies from the root with wins and losses counted from the node instead, so the
+    transposition table entry holds wherever the position is reached."""
+    if score >= WIN_BOUND:
+        return score + ply
+    if score <= -WIN_BOUND:
+        return score - ply
+    return score
+
+
+def from_table(score, ply):
+    """Returns a score stored by to_table with wins and losses counted from the root again."""
+    if score >= WIN_BOUND:
+        return score - ply
+    if score <= -WIN_BOUND:
+        return score + ply
+    return score
+
+
+class Engine(object):
+
+    """A computer player that searches internals.Board positions with alpha-beta, iterative deepening, a
+    transposition table and move ordering by captures, killer moves and history. Positions covered by an optional
+    tablebase.Tablebase are scored from it instead of searched, and positions in an optional book.OpeningBook are
+    answered from it without searching. Scores are from the point of view of the player to move."""
+
+    def __init__(self, time_budget_ms=DEFAULT_TIME_BUDGET_MS, max_depth=64, table_size=1 << 16, tablebase=None,
+                 book=None):
+        self.time_budget_ms = time_budget_ms
+        self.max_depth = max_depth
+        self.tablebase = tablebase
+        self.book = book
+        self.table = TranspositionTable(table_size)
+        self.history = {}
+        self.killers = {}
+        self.nodes = 0
+        self.depth = 0
+        self.score = 0
+        self.elapsed = 0.0
+        self._deadline = None
+
+    @property
+    def nodes_per_second(self):
+        return int(self.nodes / self.elapsed) if self.elapsed else 0
+
+    def stats(self):
+        """Returns the statistics of the last search."""
+        return {'nodes': self.nodes, 'depth': self.depth, 'score': self.score, 'elapsed_ms': int(self.elapsed * 1000),
+                'nps': self.nodes_per_second}
+
+    def evaluate(self, board):
+        """Returns the static score of the board for the player to move."""
+        score = 0
+        last_row = board.dim - 1
+        for piece in board:
+            if piece.king:
+                value = KING
+            elif piece.player == BLACK:
+                value = MAN + ADVANCE * piece.location[1]
+            else:
+                value = MAN + ADVANCE * (last_row - piece.location[1])
+            score += value if piece.player == BLACK else -value
+        return score if board.turn == BLACK else -score
+
+    def search(self, board, time_budget_ms=None):
+        """Returns the best move found for the player to move within the time budget, or None if there are no legal
+        moves. The board is left as it was given."""
+        moves = list(board.legal_moves())
+        book_move = self.book.choose(board) if self.book and len(moves) > 1 else None
+        if len(moves) > 1 and not book_move:
+            return self.search_moves(board, moves, time_budget_ms)
+        self.nodes = self.depth = self.score = 0
+        self.elapsed = 0.0
+        return book_move or (moves[0] if moves else None)
+
+    def search_moves(self, board, moves, time_budget_ms=None):
+        """Returns the best of the given root moves found within the time budget. The score of the move is left in
+        score."""
+        budget = self.time_budget_ms if time_budget_ms is None else time_budget_ms
+        start = time()
+        self._deadline = start + budget / 1000.0
+        self.nodes = self.depth = self.score = 0
+        self.killers.clear()
+        self.table.new_search()
+        root_ply = board.ply
+        moves = list(moves)
+        best = moves[0]
+        for depth in xrange(1, self.max_depth + 1):
+            try:
+                self.score, best = self._search_root(board, moves, depth)
+                self.depth = depth
+            except SearchTimeout:
+                while board.ply > root_ply:
+                    board.pop()
+                break
+            if abs(self.score) >= WIN - self.max_depth:
+                break
+            moves.remove(best)
+            moves.insert(0, best)
+        self.elapsed = time() - start
+        log.debug('searched %(nodes)s nodes to depth %(depth)s in %(elapsed_ms)sms (%(nps)s nps), score %(score)s',
+                  self.stats())
+        return best
+
+    def _search_root(self, board, moves, depth):
+        """Searches the root moves, best first, and returns the best (score, move)."""
+        alpha, best = -INFINITY, None
+        for move in moves:
+            score = self._child_score(board, move, depth, alpha, INFINITY, 0)
+            if best is None or score > alpha:
+                alpha, best = score, move
+        self.table.put(board.zobrist_hash(), depth, to_table(alpha, 0), EXACT, best)
+        return alpha, best
+
+    def _child_score(self, board, move, depth, alpha, beta, ply):
+        """Returns the score of move for the player making it. The same player may move again after a move when the
+        opponent is blocked, so the window is only negated when the turn changes."""
+        player = board.turn
+        board.push(move)
+        if board.turn == player:
+            score = self._negamax(board, depth - 1, alpha, beta, ply + 1)
+        else:
+            score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+        board.pop()
+        return score
+
+    def _ordered_moves(self, board, table_move, ply):
+        """Returns legal moves with the table move first, then longer captures, then killer moves and then moves
+        ordered by history score."""
+        moves = list(board.legal_moves())
+        if len(moves) > 1:
+            killers = self.killers.get(ply, ())
+            history = self.history
+
+            def priority(move):
+                if move == table_move:
+                    return 1 << 30
+                if is_capture(move):
+                    return (1 << 20) + len(move)
+                if move in killers:
+                    return 1 << 19
+                return history.get(move, 0)
+
+            moves.sort(key=priority, reverse=True)
+        return moves
+
+    def _negamax(self, board, depth, alpha, beta, ply):
+        self.nodes += 1
+        if not self.nodes & 1023 and time() > self._deadline:
+            raise SearchTimeout()
+
+        winner = board.winner()
+        if winner:
+            return WIN - ply if winner == board.turn else ply - WIN
+
+        if self.tablebase:
+            result = self.tablebase.probe(board)
+            if result is not None:
+                if result == DRAW:
+                    return 0
+                score = TABLEBASE_WIN - ply - (self.tablebase.distance(board) or 0)
+                return score if result == TABLE_WIN else -score
+
+        key = board.zobrist_hash()
+        table_move = None
+        entry = self.table.get(key)
+        if entry:
+            entry_depth, value, flag, table_move = entry
+            value = from_table(value, ply)
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                elif flag == LOWER:
+                    alpha = max(alpha, value)
+                elif flag == UPPER:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        # Captures are forced, so positions with one pending are searched past the horizon
+        if depth <= 0 and not board.can_jump():
+            return self.evaluate(board)
+
+        moves = self._ordered_moves(board, table_move, ply)
+        if not moves:
+            return 0
+
+        original_alpha, best, best_move = alpha, -INFINITY, None
+        for move in moves:
+            score = self._child_score(board, move, depth, alpha, beta, ply)
+            if score > best:
+                best, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not is_capture(move):
+                            self._update_heuristics(move, depth, ply)
+                        break
+
+        if best <= original_alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.put(key, depth, to_table(best, ply), flag, best_move)
+        return best
+
+    def _update_heuristics(self, move, depth, ply):
+        """Records a quiet move that caused a cutoff as a killer for the ply and raises its history score."""
+        killers = self.killers.setdefault(ply, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+        self.history[move] = self.history.get(move, 0) + depth * depth
+
+
+_worker_engine = None
+
+
+def _init_worker(max_depth, table_size, tablebase_dir):
+    global _worker_engine
+    tablebase = Tablebase(tablebase_dir) if tablebase_dir else None
+    _worker_engine = Engine(max_depth=max_depth, table_size=table_size, tablebase=tablebase)
+
+
+def _search_worker(task):
+    """Searches a share of the root moves in a worker process. The board arrives in the form returned by
+    Board.encode, so no Board or Piece objects cross the process boundary."""
+    encoded, turn, moves, time_budget_ms = task
+    board = Board()
+    board.load_encoded(encoded)
+    board.turn = turn
+    move = _worker_engine.search_moves(board, moves, time_budget_ms)
+    return _worker_engine.score, move, _worker_engine.nodes, _worker_engine.depth
+
+
+class ParallelEngine(Engine):
+
+    """An Engine that splits the root moves across a pool of worker processes, each searching its share with the
+    whole time budget. Each worker keeps its own transposition table between searches and maps the tablebase files,
+    if any, itself."""
+
+    def __init__(self, time_budget_ms=DEFAULT_TIME_BUDGET_MS, max_depth=64, table_size=1 << 16, tablebase=None,
+                 processes=None, book=None):
+        Engine.__init__(self, time_budget_ms=time_budget_ms, max_depth=max_depth, table_size=table_size,
+                        tablebase=tablebase, book=book)
+        self.processes = processes or cpu_count()
+        self._pool = None
+
+    def search_moves(self, board, moves, time_budget_ms=None):
+        budget = self.time_budget_ms if time_budget_ms is None else time_budget_ms
+        start = time()
+        if not self._pool:
+            tablebase_dir = self.tablebase.directory if self.tablebase else None
+            self._pool = Pool(self.processes, _init_worker, (self.max_depth, self.table.mask + 1, tablebase_dir))
+        shares = [moves[i::self.processes] for i in xrange(min(self.processes, len(moves)))]
+        encoded = board.encode()
+        results = self._pool.map(_search_worker, [(encoded, board.turn, share, budget) for share in shares], 1)
+        self.score, best = max((score, move) for score, move, nodes, depth in results)
+        self.nodes = sum(nodes for score, move, nodes, depth in results)
+        self.depth = min(depth for score, move, nodes, depth in results)
+        self.elapsed = time() - start
+        log.debug('searched %(nodes)s nodes to depth %(depth)s in %(elapsed_ms)sms (%(nps)s nps), score %(score)s',
+                  self.stats())
+        return best
+
+    def close(self):
+        """Shuts down the worker processes."""
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+    from internals import Board, Piece
+    from book import OpeningBook
+
+    def parse_arguments():
+        arg_p = ArgumentParser(description='Searches a checkers position and reports engine throughput')
+        arg_p.add_argument('--board', help='board to search, in the form sent by STATUS BOARD')
+        arg_p.add_argument('--turn', help='player to move', choices=[BLACK, RED], default=BLACK)
+        arg_p.add_argument('--time', help='time budget in milliseconds', type=int, default=DEFAULT_TIME_BUDGET_MS)
+        arg_p.add_argument('--processes', help='search with this many worker processes', type=int, default=0)
+        arg_p.add_argument('--tablebase', help='directory of endgame tables to probe')
+        arg_p.add_argument('--book', help='opening book file to answer from')
+        return arg_p.parse_args()
+
+    args = parse_arguments()
+    board = Board()
+    if args.board:
+        board.load_str(args.board)
+    else:
+        for player, x, y in board.start_positions():
+            board.add_piece(Piece(player), (x, y))
+    board.turn = args.turn
+    tablebase = Tablebase(args.tablebase) if args.tablebase else None
+    book = OpeningBook(args.book) if args.book else None
+    if args.processes:
+        engine = ParallelEngine(time_budget_ms=args.time, tablebase=tablebase, processes=args.processes, book=book)
+    else:
+        engine = Engine(time_budget_ms=args.time, tablebase=tablebase, book=book)
+    move = engine.search(board)
+    if args.processes:
+        engine.close()
+    print 'best move: %s' % ' '.join('%s %s' % loc for loc in move) if move else 'no legal moves'
+    print 'depth %(depth)s, score %(score)s, %(nodes)s nodes in %(elapsed_ms)sms, %(nps)s nodes/sec' % engine.stats()
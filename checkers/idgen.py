@@ -1,9 +1,10 @@
+from os.path import join, dirname
 from random import choice
 
-with open('name-data/nouns.txt', 'r') as nfile:
+with open(join(dirname(__file__), 'name-data', 'nouns.txt'), 'r') as nfile:
     nouns = map(str.strip, nfile.readlines())
 
-with open('name-data/adjectives.txt', 'r') as afile:
+with open(join(dirname(__file__), 'name-data', 'adjectives.txt'), 'r') as afile:
     adjectives = map(str.strip, afile.readlines())
 
 
@@ -1,3 +1,6 @@
+import marshal
+from random import Random
+from sys import getsizeof
 
 RED = "red"
 BLACK = "black"
@@ -5,6 +8,169 @@ BLACK = "black"
 players = [BLACK, RED]
 opponent = {BLACK: RED, RED: BLACK}
 
+EMPTY = '*'
+piece_chars = {(BLACK, False): 'b', (BLACK, True): 'B', (RED, False): 'r', (RED, True): 'R'}
+char_pieces = dict((c, kind) for kind, c in piece_chars.items())
+
+
+class FrozenDict(dict):
+
+    """A dict that can not be modified once built."""
+
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('%s can not be modified' % type(self).__name__)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def _freeze(value):
+    """Returns a copy of value with every dict, list and set in it replaced by a FrozenDict, tuple or frozenset."""
+    if isinstance(value, dict):
+        return FrozenDict((key, _freeze(item)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
+def _thaw(value):
+    """Returns a copy of value with every FrozenDict in it replaced by a dict, which marshal can write."""
+    if isinstance(value, dict):
+        return dict((key, _thaw(item)) for key, item in value.iteritems())
+    if isinstance(value, tuple):
+        return tuple(_thaw(item) for item in value)
+    return value
+
+
+class MoveTables(object):
+
+    """Usable positions, moves, jumps, captures and Zobrist keys for one board dimension. They are computed once and
+    shared by every Board of that dimension, and built from tuples, frozensets and FrozenDicts so no board can change
+    them for the others. Besides the tables keyed by (x, y) positions, squares are numbered row by row and the
+    square_* tables index by square number."""
+
+    fields = ['usable_positions', 'moves', 'king_moves', 'jumps', 'king_jumps', 'captures', 'positions', 'square_of',
+              'square_moves', 'square_king_moves', 'square_jumps', 'square_king_jumps', 'square_affected',
+              'square_keys', 'turn_keys', 'text_index', 'blank_text']
+
+    def __init__(self, dim, data=None):
+        self.dim = dim
+        if not data:
+            data = self._compute()
+        for field in self.fields:
+            setattr(self, field, _freeze(data[field]))
+
+    def _compute(self):
+        dim = self.dim
+        self.usable_positions = frozenset([(x, y) for y in xrange(0, dim) for x in xrange((y + 1) % 2, dim, 2)])
+        self.moves = {BLACK: {}, RED: {}}
+        self.king_moves = {}
+        self.jumps = {BLACK: {}, RED: {}}
+        self.king_jumps = {}
+        self.captures = {}
+
+        for pos in self.usable_positions:
+
+            pos_x, pos_y = pos
+
+            # compute valid moves, jumps and captures for normal pieces by player
+            for player, mov_off_y, jmp_off_y in [(BLACK, 1, 2), (RED, -1, -2)]:
+                moves, jumps = set(), set()
+                for mov_off_x, jmp_off_x in [(-1, -2), (1, 2)]:
+                    mov_loc, jmp_loc = (pos_x + mov_off_x, pos_y + mov_off_y), (pos_x + jmp_off_x, pos_y + jmp_off_y)
+                    if mov_loc in self.usable_positions:
+                        moves.add(mov_loc)
+                    if jmp_loc in self.usable_positions:
+                        jumps.add(jmp_loc)
+                        self.captures[(pos, jmp_loc)] = mov_loc
+                self.moves[player][pos], self.jumps[player][pos] = frozenset(moves), frozenset(jumps)
+
+            self.king_moves[pos] = self.moves[BLACK][pos] | self.moves[RED][pos]
+            self.king_jumps[pos] = self.jumps[BLACK][pos] | self.jumps[RED][pos]
+
+        # The same tables by square number
+        self.positions = tuple(sorted(self.usable_positions, key=lambda (x, y): (y, x)))
+        self.square_of = dict((pos, square) for square, pos in enumerate(self.positions))
+        square_of = self.square_of
+
+        def squares(targets):
+            return tuple(sorted(square_of[target] for target in targets))
+
+        def square_jumps(pos, targets):
+            return tuple(sorted((square_of[target], square_of[self.captures[(pos, target)]]) for target in targets))
+
+        self.square_moves = dict((player, tuple(squares(self.moves[player][pos]) for pos in self.positions))
+                                 for player in players)
+        self.square_king_moves = tuple(squares(self.king_moves[pos]) for pos in self.positions)
+        self.square_jumps = dict((player, tuple(square_jumps(pos, self.jumps[player][pos]) for pos in self.positions))
+                                 for player in players)
+        self.square_king_jumps = tuple(square_jumps(pos, self.king_jumps[pos]) for pos in self.positions)
+
+        # Squares whose possible moves depend on the occupant of each square
+        self.square_affected = tuple(frozenset((square_of[pos],) + squares(self.king_moves[pos])
+                                               + squares(self.king_jumps[pos])) for pos in self.positions)
+
+        # Zobrist keys by (player, king) and square come from a fixed seed so hashes are stable across processes
+        rand = Random(dim)
+        keys = dict(((player, king), []) for player in players for king in (False, True))
+        for pos in self.positions:
+            for player in players:
+                for king in (False, True):
+                    keys[(player, king)].append(rand.getrandbits(64))
+        self.square_keys = dict((kind, tuple(kind_keys)) for kind, kind_keys in keys.items())
+        self.turn_keys = {BLACK: 0, RED: rand.getrandbits(64)}
+
+        # Offset of each square in the '|' separated string form, and that string for an empty board
+        self.text_index = tuple(y * (dim + 1) + x for x, y in self.positions)
+        self.blank_text = '|'.join([EMPTY * dim] * dim)
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+    def save(self, filename):
+        """Writes the tables to a data file that load_move_tables can read."""
+        with open(filename, 'wb') as data_file:
+            marshal.dump(dict([('dim', self.dim)] + [(field, _thaw(getattr(self, field))) for field in self.fields]),
+                         data_file)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as data_file:
+            data = marshal.load(data_file)
+        return MoveTables(data['dim'], data)
+
+
+def _bit_squares(mask):
+    """Returns a list of the square numbers set in a bitmask."""
+    squares = []
+    while mask:
+        low = mask & -mask
+        squares.append(low.bit_length() - 1)
+        mask ^= low
+    return squares
+
+
+_move_tables = {}
+
+
+def move_tables(dim):
+    """Returns the shared MoveTables for the given dimension, computing them on first use."""
+    if dim not in _move_tables:
+        _move_tables[dim] = MoveTables(dim)
+    return _move_tables[dim]
+
+
+def load_move_tables(filename):
+    """Loads prebuilt MoveTables from a data file and shares them with every Board of their dimension created
+    afterwards."""
+    tables = MoveTables.load(filename)
+    _move_tables[tables.dim] = tables
+    return tables
+
 
 class CheckersException(Exception):
 
@@ -30,7 +196,9 @@ class InvalidPlacementException(CheckersException):
         CheckersException.__init__(self, message)
 
 
-class Piece():
+class Piece(object):
+
+    __slots__ = ('player', 'king', 'board', 'location')
 
     def __init__(self, player):
         if player not in [BLACK, RED]:
@@ -61,80 +229,176 @@ class Piece():
         return p
 
 
-class Board:
+class Snapshot(object):
+
+    """An immutable copy of a board's state, held in the compact form returned by Board.encode. It answers the same
+    read-only questions as a Board, so it can be read without holding whatever lock guards the live board."""
+
+    __slots__ = ('dim', 'encoded', 'turn', 'last_jump_target')
+
+    def __init__(self, dim, encoded, turn, last_jump_target=None):
+        for name, value in zip(self.__slots__, (dim, encoded, turn, last_jump_target)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('snapshots can not be modified')
+
+    def _key(self):
+        return self.dim, self.encoded, self.turn, self.last_jump_target
+
+    def __eq__(self, other):
+        return isinstance(other, Snapshot) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __contains__(self, loc):
+        """Returns whether there is a piece at the specified location"""
+        square = move_tables(self.dim).square_of.get(loc)
+        return square is not None and self.encoded[square] != EMPTY
+
+    def __getitem__(self, loc):
+        """Returns a new Piece describing the occupant of the position specified as a tuple (x,y)"""
+        square = move_tables(self.dim).square_of.get(loc)
+        if square is None or self.encoded[square] == EMPTY:
+            raise KeyError(loc)
+        return self._piece(square)
+
+    def __iter__(self):
+        """Allows iteration over the pieces as new Piece objects"""
+        for square, c in enumerate(self.encoded):
+            if c != EMPTY:
+                yield self._piece(square)
+
+    def _piece(self, square):
+        player, king = char_pieces[self.encoded[square]]
+        piece = Piece(player)
+        piece.king = king
+        piece.location = move_tables(self.dim).positions[square]
+        return piece
+
+    def winner(self):
+        """Returns the player that has won the game or None if no winner."""
+        black = 'b' in self.encoded or 'B' in self.encoded
+        red = 'r' in self.encoded or 'R' in self.encoded
+        if black and not red:
+            return BLACK
+        elif red and not black:
+            return RED
+        else:
+            return None
+
+    def to_board(self):
+        """Returns a new Board with the snapshot's state, for readers that need to make moves."""
+        board = Board.from_encoded(self.encoded, self.dim)
+        board.turn, board.last_jump_target = self.turn, self.last_jump_target
+        return board
+
+    def __repr__(self):
+        """Returns the board in computer readable form."""
+        tables = move_tables(self.dim)
+        cells = list(tables.blank_text)
+        for square, c in enumerate(self.encoded):
+            if c != EMPTY:
+                cells[tables.text_index[square]] = c
+        return ''.join(cells)
+
+    def __str__(self):
+        """Returns the board in human readable form."""
+        return repr(self).replace('|', '\n')
+
+
+class Board(object):
+
+    __slots__ = ('dim', '_neutral_rows', '_tables', '_squares', '_player_pieces', 'turn', 'last_jump_target', '_undo',
+                 '_jumpers', '_movers', '_hash')
 
     def __init__(self, dim=8):
         """Create initial game state for normal checkers game."""
         self.dim = dim
         self._neutral_rows = 2
-        self._usable_positions = set([(x, y) for y in xrange(0, self.dim) for x in xrange((y + 1) % 2, self.dim, 2)])
 
-        # Pre-compute valid moves
-        self._moves = {BLACK: {}, RED: {}}
-        self._king_moves = {}
-        self._jumps = {BLACK: {}, RED: {}}
-        self._king_jumps = {}
-        self._captures = {}
-        self._init_moves()
+        # Pre-computed valid moves, shared by all boards of the same dimension
+        self._tables = move_tables(dim)
 
-        # Mutable data
+        # Mutable data, the piece on each square is kept in a list indexed by square number
+        self._squares = [None] * len(self._tables.positions)
         self._player_pieces = {BLACK: set(), RED: set()}
-        self._loc_pieces = {}
         self.turn = BLACK
+        self.last_jump_target = None
+        self._undo = []
+
+        # Bitmasks of the squares of pieces able to capture or make a non-capturing move, kept current by
+        # _refresh_around
+        self._jumpers = {BLACK: 0, RED: 0}
+        self._movers = {BLACK: 0, RED: 0}
+
+        # Zobrist hash of the pieces on the board, the player to move is folded in by zobrist_hash
+        self._hash = 0
 
     @staticmethod
     def from_str(board_str):
         """Returns an initialized board from a string representation."""
         lines = filter(lambda l: len(l), board_str.split('\n'))
-        dim = len(lines[0])
-        if len(lines[0]) != len(lines):
-            raise CheckersException('board dimension mismatch: %s x %s' % len(lines[0]), len(lines))
+        board = Board(len(lines[0]))
+        board.load_str(board_str, split_on='\n')
+        return board
+
+    @staticmethod
+    def from_encoded(encoded, dim=8):
+        """Returns a board initialized from the form returned by encode."""
         board = Board(dim)
-        for row, line in enumerate(lines):
-            for col, c in enumerate(line):
-                piece = Piece.from_repr(c)
-                if piece:
-                    board.add_piece(piece, (col, row))
+        board.load_encoded(encoded)
         return board
 
     def load_str(self, board_str, split_on='|'):
-        self.clear()
+        """Replaces the pieces on the board with those in a string representation."""
         lines = filter(lambda l: len(l), board_str.split(split_on))
         if len(lines[0]) != self.dim:
-            raise CheckersException('can not load string of dim %s into board of dim %s' % len(lines[0]), self.dim)
-        if len(lines[0]) != len(lines):
-            raise CheckersException('board dimension mismatch: %s x %s' % len(lines[0]), len(lines))
-        for row, line in enumerate(lines):
-            for col, c in enumerate(line):
-                piece = Piece.from_repr(c)
-                if piece:
-                    self.add_piece(piece, (col, row))
-
-    def _init_moves(self):
-
-        for pos in self.usable_positions():
-
-            pos_x, pos_y = pos
-
-            # Initialize sets for position
-            for player in [RED, BLACK]:
-                self._moves[player][pos] = set()
-                self._jumps[player][pos] = set()
-            self._king_moves[pos] = set()
-            self._king_jumps[pos] = set()
-
-            # compute valid moves, jumps and captures for normal pieces by player
-            for player, mov_off_y, jmp_off_y in [(BLACK, 1, 2), (RED, -1, -2)]:
-                for mov_off_x, jmp_off_x in [(-1, -2), (1, 2)]:
-                    mov_loc, jmp_loc = (pos_x + mov_off_x, pos_y + mov_off_y), (pos_x + jmp_off_x, pos_y + jmp_off_y)
-                    if mov_loc in self.usable_positions():
-                        self._moves[player][pos].add(mov_loc)
-                    if jmp_loc in self.usable_positions():
-                        self._jumps[player][pos].add(jmp_loc)
-                        self._captures[(pos, jmp_loc)] = mov_loc
-
-            self._king_moves[pos] = self._moves[BLACK][pos] | self._moves[RED][pos]
-            self._king_jumps[pos] = self._jumps[BLACK][pos] | self._jumps[RED][pos]
+            raise CheckersException('can not load string of dim %s into board of dim %s' % (len(lines[0]), self.dim))
+        if len(lines[0]) != len(lines) or any(len(line) != self.dim for line in lines):
+            raise CheckersException('board dimension mismatch: %s x %s' % (len(lines[0]), len(lines)))
+        text = '|'.join(lines)
+        chars = [text[i] for i in self._tables.text_index]
+        if sum(1 for c in chars if c in char_pieces) != sum(text.count(c) for c in char_pieces):
+            raise InvalidPlacementException('can not place pieces on unusable squares')
+        self._load_squares(chars)
+
+    def encode(self):
+        """Returns the board in compact form, one character per usable square in square order."""
+        return ''.join([EMPTY if piece is None else piece_chars[(piece.player, piece.king)]
+                        for piece in self._squares])
+
+    def snapshot(self):
+        """Returns an immutable Snapshot of the board, unaffected by later changes to it."""
+        return Snapshot(self.dim, self.encode(), self.turn, self.last_jump_target)
+
+    def load_encoded(self, encoded):
+        """Replaces the pieces on the board with those in the form returned by encode."""
+        if len(encoded) != len(self._squares):
+            raise CheckersException('can not load %s squares into board of dim %s' % (len(encoded), self.dim))
+        self._load_squares(encoded)
+
+    def _load_squares(self, chars):
+        """Replaces the pieces on the board with one per character, given by square number, without validating their
+        placement. The move index is rebuilt once all pieces are placed."""
+        self.clear()
+        squares, positions, keys = self._squares, self._tables.positions, self._tables.square_keys
+        for square, c in enumerate(chars):
+            kind = char_pieces.get(c)
+            if kind is not None:
+                piece = Piece(kind[0])
+                piece.king = kind[1]
+                piece.board = self
+                piece.location = positions[square]
+                squares[square] = piece
+                self._player_pieces[kind[0]].add(piece)
+                self._hash ^= keys[kind][square]
+        for square in xrange(len(squares)):
+            self._refresh(square)
 
     def add_piece(self, piece, location):
         """Adds a new Piece to this board. Raises a CheckersException if placement is invalid."""
@@ -146,17 +410,18 @@ class Board:
 
     def _valid_placement(self, piece, location):
         """Returns true if the specified piece can be placed at the specified location."""
-        return location in self._usable_positions and not location in self
+        return location in self._tables.usable_positions and not location in self
 
     def start_positions(self):
         """Returns a list of (player,x,y) tuples for start positions"""
-        black_positions = [(BLACK, x, y) for (x, y) in self._usable_positions if y < self._player_rows()]
-        red_positions = [(RED, x, y) for (x, y) in self._usable_positions if y >= self.dim - self._player_rows()]
+        usable, rows = self._tables.usable_positions, self._player_rows()
+        black_positions = [(BLACK, x, y) for (x, y) in usable if y < rows]
+        red_positions = [(RED, x, y) for (x, y) in usable if y >= self.dim - rows]
         return black_positions + red_positions
 
     def usable_positions(self):
         """Returns a generator for positions on the board that a piece can occupy."""
-        return self._usable_positions
+        return self._tables.usable_positions
 
     def _player_rows(self):
         """Returns the number of rows a player controls at game start"""
@@ -170,31 +435,116 @@ class Board:
 
     def __getitem__(self, loc):
         """Returns the piece occupying the position specified as a tuple (x,y)"""
-        return self._loc_pieces[loc]
+        piece = self._squares[self._tables.square_of[loc]]
+        if piece is None:
+            raise KeyError(loc)
+        return piece
 
     def __contains__(self, loc):
         """Returns whether there is a piece at the specified location"""
-        return loc in self._loc_pieces
+        square = self._tables.square_of.get(loc)
+        return square is not None and self._squares[square] is not None
 
     def __setitem__(self, loc, piece):
         """Sets the piece occupying the position specified by the tuple (x,y)
         to the specified player"""
         if piece.player not in players:
             raise CheckersException('Piece does not belong to a player')
-        if piece in self._player_pieces:
-            self._player_pieces.pop(piece)
-        if piece in self._loc_pieces.values():
-            loc, piece = [item for item in self._loc_pieces.items() if item[0] == piece]
-            self._loc_pieces.pop(loc)
+        tables = self._tables
+        square_of, keys = tables.square_of, tables.square_keys
+        square = square_of[loc]
+        if piece.board is self and piece.location is not None:
+            previous = square_of[piece.location]
+            if self._squares[previous] is piece:
+                self._squares[previous] = None
+                self._hash ^= keys[(piece.player, piece.king)][previous]
+                self._refresh_around(previous)
+        replaced = self._squares[square]
+        if replaced is not None:
+            self._player_pieces[replaced.player].discard(replaced)
+            self._hash ^= keys[(replaced.player, replaced.king)][square]
         piece.board = self
-        piece.location = loc
-        self._loc_pieces[loc] = piece
+        piece.location = tables.positions[square]
+        self._squares[square] = piece
         self._player_pieces[piece.player].add(piece)
+        self._hash ^= keys[(piece.player, piece.king)][square]
+        self._refresh_around(square)
 
     def clear(self):
         for player in players:
             self._player_pieces[player].clear()
-        self._loc_pieces.clear()
+            self._jumpers[player] = self._movers[player] = 0
+        self._squares[:] = [None] * len(self._squares)
+        self._hash = 0
+        del self._undo[:]
+
+    def memory_usage(self):
+        """Returns the approximate number of bytes held by this board, not counting the shared move tables."""
+        size = getsizeof(self) + getsizeof(self._squares) + getsizeof(self._undo) + getsizeof(self._hash)
+        for index in [self._player_pieces, self._jumpers, self._movers]:
+            size += getsizeof(index) + sum(getsizeof(value) for value in index.itervalues())
+        return size + sum(getsizeof(piece) for piece in self)
+
+    def zobrist_hash(self):
+        """Returns a 64-bit hash identifying the pieces on the board and the player to move."""
+        return self._hash ^ self._tables.turn_keys.get(self.turn, 0)
+
+    def _refresh(self, square):
+        """Recomputes whether the piece on square, if any, can capture or make a non-capturing move."""
+        jumpers, movers = self._jumpers, self._movers
+        bit = 1 << square
+        for player in players:
+            jumpers[player] &= ~bit
+            movers[player] &= ~bit
+        squares = self._squares
+        piece = squares[square]
+        if piece is None:
+            return
+        player = piece.player
+        tables = self._tables
+        if piece.king:
+            moves, jumps = tables.square_king_moves[square], tables.square_king_jumps[square]
+        else:
+            moves, jumps = tables.square_moves[player][square], tables.square_jumps[player][square]
+        for target, capture in jumps:
+            if squares[target] is None:
+                captured = squares[capture]
+                if captured is not None and captured.player != player:
+                    jumpers[player] |= bit
+                    break
+        for target in moves:
+            if squares[target] is None:
+                movers[player] |= bit
+                break
+
+    def _refresh_around(self, *squares):
+        """Refreshes the move index for every piece that could be affected by a change on the given squares."""
+        affected, square_affected = set(), self._tables.square_affected
+        for square in squares:
+            affected |= square_affected[square]
+        for square in affected:
+            self._refresh(square)
+
+    def _indexed(self, index, source):
+        """Returns whether the piece at source, which must be occupied, is set in the given move index."""
+        return bool(index[self[source].player] >> self._tables.square_of[source] & 1)
+
+    @property
+    def ply(self):
+        """The number of moves made by push and not yet taken back."""
+        return len(self._undo)
+
+    def can_jump(self):
+        """Returns whether the player to move has a capture, and so must make one."""
+        return bool(self._jumpers.get(self.turn))
+
+    def pieces(self, player):
+        """Returns a generator for the pieces of one player."""
+        return iter(self._player_pieces[player])
+
+    def piece_count(self, player):
+        """Returns the number of pieces one player has on the board."""
+        return len(self._player_pieces[player])
 
     def winner(self):
         """Returns the player that has won the game or None if no winner."""
@@ -214,10 +564,7 @@ class Board:
 
         piece = self[source]
         player = piece.player
-        moves = self._moves[player]
-
-        if piece.king:
-            moves = self._king_moves
+        moves = self._tables.king_moves if piece.king else self._tables.moves[player]
 
         return (not self._possible_jump(player) and target in moves[source]) or self._valid_jump(source, target)
 
@@ -230,14 +577,12 @@ class Board:
 
         piece = self[source]
         player = piece.player
+        tables = self._tables
 
-        jumps = self._jumps[player]
-
-        if piece.king:
-            jumps = self._king_jumps
+        jumps = tables.king_jumps if piece.king else tables.jumps[player]
 
-        if target in jumps[source] and move in self._captures:
-            capture = self._captures[move]
+        if target in jumps[source] and move in tables.captures:
+            capture = tables.captures[move]
             if capture in self and self[capture].player == opponent[player]:
                 return True
 
@@ -247,55 +592,74 @@ class Board:
         """Returns whether there is a valid jump from a given location."""
         if not source in self:
             return False
-
-        piece = self[source]
-
-        if piece.king:
-            jump_targets = self._king_jumps[source]
-        else:
-            jump_targets = self._jumps[piece.player][source]
-
-        for target in jump_targets:
-            if self._valid_jump(source, target):
-                return True
-        return False
+        return self._indexed(self._jumpers, source)
 
     def _possible_jump(self, player):
         """Returns whether the player has a possible jump."""
-        for p in self._player_pieces[player]:
-            if self._possible_jump_from(p.location):
-                return True
-        return False
+        return bool(self._jumpers[player])
 
     def _possible_move_from(self, source):
         """Returns whether there is any valid move (jump or move) from a given location."""
         if not source in self:
             return False
-
-        piece = self[source]
-
-        if piece.king:
-            move_targets = self._king_moves[source]
-        else:
-            move_targets = self._moves[piece.player][source]
-
-        for target in move_targets:
-            if self._valid_move(source, target):
-                return True
-        return self._possible_jump_from(source)
+        player = self[source].player
+        return self._indexed(self._jumpers, source) or (self._indexed(self._movers, source)
+                                                        and not self._jumpers[player])
 
     def _possible_move(self, player):
         """Returns whether the player has any possible move."""
-        for p in self._player_pieces[player]:
-            if self._possible_move_from(p.location):
-                return True
-        return False
+        return bool(self._jumpers[player] or self._movers[player])
+
+    def legal_moves(self):
+        """Returns a generator for the legal moves of the player to move. Each move is a tuple of positions, starting
+        with the moving piece's location and followed by every square it lands on, so multi-jumps are yielded as one
+        complete path. When any capture is possible only captures are yielded."""
+        if self.turn not in players:
+            return
+        tables, squares = self._tables, self._squares
+        positions = tables.positions
+        jumpers = self._jumpers[self.turn]
+        if jumpers:
+            for source in _bit_squares(jumpers):
+                for path in self._jump_paths((source,), squares[source], set()):
+                    yield tuple([positions[square] for square in path])
+        else:
+            for source in _bit_squares(self._movers[self.turn]):
+                piece = squares[source]
+                targets = tables.square_king_moves[source] if piece.king else tables.square_moves[piece.player][source]
+                for target in targets:
+                    if squares[target] is None:
+                        yield (positions[source], positions[target])
+
+    def _jump_paths(self, path, piece, captured):
+        """Returns a generator for the complete jump sequences extending path, given as square numbers. The moving
+        piece has left its original square and the pieces on the squares in captured have already been removed."""
+        squares, tables = self._squares, self._tables
+        source = path[-1]
+        jumps = tables.square_king_jumps[source] if piece.king else tables.square_jumps[piece.player][source]
+        extended = False
+        for target, capture in jumps:
+            if capture in captured or squares[capture] is None or squares[capture].player == piece.player:
+                continue
+            if squares[target] is not None and target != path[0] and target not in captured:
+                continue
+            extended = True
+            captured.add(capture)
+            for full_path in self._jump_paths(path + (target,), piece, captured):
+                yield full_path
+            captured.remove(capture)
+        if not extended and len(path) > 1:
+            yield path
 
     def _king_piece(self, piece):
         """Kings the given piece based on its player and location on board."""
         if not piece.king and (piece.player == RED and piece.location[1] == 0
                                or piece.player == BLACK and piece.location[1] == self.dim - 1):
             piece.king = True
+            keys = self._tables.square_keys
+            square = self._tables.square_of[piece.location]
+            self._hash ^= keys[(piece.player, False)][square] ^ keys[(piece.player, True)][square]
+            self._refresh(square)
 
     def _update_turn(self):
         """Update the turn if no more jumps are required and it is possible for opponent to play."""
@@ -307,28 +671,67 @@ class Board:
         """Remove the captured piece and return location, or None if not a capture. Should have already validated as
         valid move with _valid_move before calling this."""
         result = None
-        piece = self[source]
+        squares, tables = self._squares, self._tables
+        square_of, positions = tables.square_of, tables.positions
+        source_square, target_square = square_of[source], square_of[target]
+        piece = squares[source_square]
         player = piece.player
-        moves, jumps = self._moves[player], self._jumps[player]
-        if piece.king:
-            moves, jumps = self._king_moves, self._king_jumps
+        jumps = tables.king_jumps if piece.king else tables.jumps[player]
         if target in jumps[source]:  # Handle a capture
-            capture = self._captures[(source, target)]
-            captured_piece = self[capture]
+            capture = square_of[tables.captures[(source, target)]]
+            captured_piece = squares[capture]
             self._player_pieces[captured_piece.player].remove(captured_piece)  # Remove piece from player
-            self._loc_pieces.pop(capture)  # Remove captured piece from board
+            squares[capture] = None  # Remove captured piece from board
+            self._hash ^= tables.square_keys[(captured_piece.player, captured_piece.king)][capture]
             result = captured_piece
-            self.last_jump_target = target
+            self.last_jump_target = positions[target_square]
         else:
+            capture = None
             self.last_jump_target = None
         # Move piece to target destination
-        self._loc_pieces.pop(source, None)  # Remove piece from original location
-        self._loc_pieces[target] = piece
-        piece.location = target
+        squares[source_square] = None
+        squares[target_square] = piece
+        piece.location = positions[target_square]
+        keys = tables.square_keys[(player, piece.king)]
+        self._hash ^= keys[source_square] ^ keys[target_square]
+        if capture is None:
+            self._refresh_around(source_square, target_square)
+        else:
+            self._refresh_around(source_square, target_square, capture)
         self._update_turn()
         self._king_piece(piece)  # Only king after figuring out turn to prevent continued jumping
         return result
 
+    def push(self, move):
+        """Performs a move given as a path of positions, as yielded by legal_moves, so that it can be taken back with
+        pop. The move is not validated."""
+        piece = self[move[0]]
+        undo = (move, piece, piece.king, self.turn, self.last_jump_target, self._hash, [])
+        for source, target in zip(move, move[1:]):
+            captured = self._perform_move(source, target)
+            if captured:
+                undo[-1].append(captured)
+        self._undo.append(undo)
+
+    def pop(self):
+        """Takes back the last move performed by push, restoring captured pieces, king promotion, the turn and
+        last_jump_target. Returns the move."""
+        move, piece, king, self.turn, self.last_jump_target, self._hash, captured = self._undo.pop()
+        squares, square_of = self._squares, self._tables.square_of
+        source, target = square_of[move[0]], square_of[move[-1]]
+        squares[target] = None
+        squares[source] = piece
+        piece.location = self._tables.positions[source]
+        piece.king = king
+        changed = [source, target]
+        for captured_piece in captured:
+            square = square_of[captured_piece.location]
+            squares[square] = captured_piece
+            self._player_pieces[captured_piece.player].add(captured_piece)
+            changed.append(square)
+        self._refresh_around(*changed)
+        return move
+
     def move(self, source, target):
         """Moves the piece at source position to target and returns None or the location of a captured piece.
         It throws a InvalidMoveError if the move is not valid."""
@@ -338,21 +741,37 @@ class Board:
 
     def __repr__(self):
         """Returns the board in computer readable form."""
-        return '|'.join([
-            ''.join([
-                repr(self[(x,y)]) if (x,y) in self else '*'
-                for x in xrange(self.dim)
-            ])
-            for y in xrange(self.dim)
-        ])
+        cells = list(self._tables.blank_text)
+        text_index = self._tables.text_index
+        for square, piece in enumerate(self._squares):
+            if piece is not None:
+                cells[text_index[square]] = piece_chars[(piece.player, piece.king)]
+        return ''.join(cells)
 
     def __str__(self):
         """Returns the board in human readable form."""
-        return '\n'.join([
-            ''.join([
-                repr(self[(x,y)]) if (x,y) in self else '*'
-                for x in xrange(self.dim)
-            ])
-            for y in xrange(self.dim)
-        ])
-
+        return repr(self).replace('|', '\n')
+
+
+def new_game(dim=8, board_factory=Board):
+    """Returns a board_factory board of the given dimension with every piece on its starting square."""
+    board = board_factory(dim)
+    for player, x, y in board.start_positions():
+        board.add_piece(Piece(player), (x, y))
+    return board
+
+
+def perft(board, depth):
+    """Returns the number of move sequences of the given length from the board's position, counting each complete
+    move yielded by legal_moves as one ply. The board is left as it was given."""
+    if depth == 0:
+        return 1
+    moves = list(board.legal_moves())
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
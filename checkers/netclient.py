@@ -1,8 +1,8 @@
 from internals import Board, InvalidMoveException
 from socket import socket, AF_INET, SOCK_STREAM, TCP_NODELAY, IPPROTO_TCP, timeout, error
 from select import select
-from threaded_server import LEAVE, QUIT, SHUTDOWN, NEW, MOVE, JOIN, LIST, SPECTATE, TURN, BOARD
-from threaded_server import WAIT, WINNER, JOINED, LEFT, MOVED, CAPTURED, YOU_ARE, GAME_ID
+from protocol import LEAVE, QUIT, SHUTDOWN, NEW, MOVE, JOIN, LIST, SPECTATE, TURN, BOARD
+from protocol import WAIT, WINNER, JOINED, LEFT, MOVED, CAPTURED, YOU_ARE, GAME_ID, LIST_NEXT, OUT_OF_TIME
 import logging as log
 from StringIO import StringIO
 
@@ -15,6 +15,9 @@ class StatusHandler:
     def handle_winner(self, player):
         pass
 
+    def handle_out_of_time(self, player):
+        pass
+
     def handle_joined(self, player):
         pass
 
@@ -39,6 +42,9 @@ class StatusHandler:
     def handle_list(self, game_list, list_type=None):
         pass
 
+    def handle_list_next(self, cursor, list_type=None):
+        pass
+
 
 class Client:
 
@@ -103,6 +109,8 @@ class Client:
                 line = line[1:]
                 if status == WINNER:
                     self.status_handler.handle_winner(line[0])
+                elif status == OUT_OF_TIME:
+                    self.status_handler.handle_out_of_time(line[0])
                 elif status == JOINED:
                     self.status_handler.handle_joined(line[0])
                 elif status == LEFT:
@@ -126,6 +134,11 @@ class Client:
                     if len(line) and line[0] == SPECTATE:
                         list_type = line.pop(0)
                     self.status_handler.handle_list(line, list_type=list_type)
+                elif status == LIST_NEXT:
+                    list_type = None
+                    if len(line) > 1 and line[0] == SPECTATE:
+                        list_type = line.pop(0)
+                    self.status_handler.handle_list_next(line[0], list_type=list_type)
                 elif status == GAME_ID:
                     self.status_handler.handle_game_id(line[0])
                 did_something = True
@@ -140,10 +153,15 @@ class Client:
     def send_list(self, *args):
         self.send_line(' '.join(map(str, args)))
 
-    def list(self, list_type=None):
+    def list(self, list_type=None, limit=None, cursor=None):
+        """Lists the games, or with a limit a page of them, starting after the cursor from handle_list_next."""
         list_cmd = [LIST]
         if list_type:
             list_cmd.append(list_type)
+        if limit:
+            list_cmd.append(limit)
+            if cursor:
+                list_cmd.append(cursor)
         self.send_list(*list_cmd)
 
     def join(self, game_id):
@@ -189,9 +207,9 @@ class NetBoard(Board):
 
     def connect(self, spectate):
         if spectate:
-            self.client.list(SPECTATE)
+            self.client.list(SPECTATE, limit=1)
         else:
-            self.client.list()
+            self.client.list(limit=1)
 
     def move(self, src, dst):
         if self._valid_move(src, dst):
@@ -0,0 +1,542 @@
+import sys
+from bisect import bisect_right
+from threading import RLock
+from time import time
+from functools import wraps
+from internals import RED, BLACK, Board, Piece, CheckersException, opponent
+from idgen import gen_id
+from timers import TimerWheel
+import logging as log
+
+
+PRUNE_IDLE_SECS = 5 * 60  # 5 Minutes
+REQUEST_QUEUE_SIZE = 1024  # Pending connections, so bursts of clients are not left waiting on SYN retries
+MAX_LIST_LIMIT = 1000  # Games in one page of a LIST
+
+
+LIST, JOIN, NEW, LEAVE, QUIT, MOVE, SHUTDOWN, TURN, BOARD, SPECTATE = 'LIST', 'JOIN', 'NEW', 'LEAVE', 'QUIT', 'MOVE',\
+                                                                      'SHUTDOWN', 'TURN', 'BOARD', 'SPECTATE'
+ERROR, OK, STATUS = 'ERROR', 'OK', 'STATUS'
+JOINED, YOU_ARE, LEFT, MOVED, CAPTURED, KING, WAIT, WINNER, GAME_ID = 'JOINED', 'YOU_ARE', 'LEFT', 'MOVED', 'CAPTURED',\
+                                                                      'KING', 'waiting', 'WINNER', 'GAME_ID'
+OUT_OF_TIME, LIST_NEXT = 'OUT_OF_TIME', 'LIST_NEXT'
+
+COMMANDS = set([LIST, JOIN, NEW, LEAVE, QUIT, MOVE, BOARD, TURN, SHUTDOWN, SPECTATE])
+STATUSES = set([JOINED, LEFT, MOVED, CAPTURED, WINNER, YOU_ARE, BOARD, TURN, LIST, GAME_ID, OUT_OF_TIME, LIST_NEXT])
+
+
+class ServerException(Exception):
+
+    def __init__(*args, **kwargs):
+        Exception.__init__(*args, **kwargs)
+
+
+def cleanup_on_failure(fn):
+    @wraps(fn)
+    def remove_handler(self, *args, **kwargs):
+        try:
+            return fn(self, *args, **kwargs)
+        except Exception as e:
+            self.cleanup()
+            raise e
+    return remove_handler
+
+
+class CommandHandler(object):
+
+    """The commands of the protocol, shared by the connection handlers of every server. Handlers call init_commands
+    when created and handle_lines with the request lines of each read, and provide server, send_raw, flush, cleanup
+    and _quit. While batching is set send_raw only queues, so everything sent for one read goes out in one write."""
+
+    def init_commands(self):
+        self.commands = dict((cmd, getattr(self, "_%s" % cmd.lower())) for cmd in COMMANDS)
+        self.client = None
+        self.player = None
+        self.game = None
+        self.servicing = True
+        self.batching = False
+
+    def send_line(self, line):
+        self.send_raw(line + '\r\n')
+
+    def handle_lines(self, lines):
+        """Runs the requests read together, in order, and sends their results and statuses with one flush. Requests
+        after a QUIT are ignored."""
+        self.batching = True
+        try:
+            for line in lines:
+                if not self.servicing:
+                    break
+                self.send_line(self.dispatch(line.strip()))
+        finally:
+            self.batching = False
+        self.flush()
+
+    def get_command(self, cmd_str):
+        """Returns the handler method corresponding to the given command."""
+        try:
+            return self.commands[cmd_str]
+        except KeyError:
+            raise ServerException('invalid command')
+
+    def dispatch(self, line):
+        """Runs the command on a request line and returns the result line, without its terminator."""
+        log.debug('%s => %s', self.client, line)
+        req = line.split()
+        try:
+            self.get_command(req.pop(0) if req else None)(req)
+            return OK
+        except Exception as error:
+            return ' '.join([ERROR, error.message])
+
+    def _new(self, *args):
+        """Handler for NEW command, creates and joins player to game."""
+        if self.game:
+            raise ServerException('already playing a game')
+        self.game, self.player = self.server.new_game(self)
+
+    def _join(self, req):
+        """Handler for JOIN command, joins player to existing game."""
+        orig_game = None
+        if self.game:
+            orig_game = self.game
+        game_id = req.pop(0)
+        self.game, self.player = self.server.join_game(game_id, self)
+        if orig_game:
+            orig_game.leave(self)
+
+    def _spectate(self, req):
+        """Handler for SPECTATE command, joins spectator to existing game."""
+        orig_game = None
+        if self.game:
+            orig_game = self.game
+        game_id = req.pop(0)
+        self.game = self.server.spectate_game(game_id, self)
+        if orig_game:
+            orig_game.leave(self)
+
+    def _list(self, req):
+        """Handler for LIST command, lists game for play or spectating. Excludes current game. Given a limit, lists
+        at most that many games after the cursor, followed by a LIST_NEXT status with the cursor of the next page
+        when there is one. A limit that is not a number lists every game."""
+        spectate = bool(req) and req[0] == SPECTATE
+        list_type = [SPECTATE] if spectate else []
+        if spectate:
+            req.pop(0)
+        page = self._list_page(req) if req else None
+        if page:
+            games, cursor = self.server.list_games(spectate, page[0], page[1], exclude=self.game)
+        else:
+            games = self.server.get_unfinished_games() if spectate else self.server.get_open_games()
+            games, cursor = [g for g in games if g is not self.game], None
+        self.send_line(' '.join([STATUS, LIST] + list_type + [str(g.id) for g in games]))
+        if cursor is not None:
+            self.send_line(' '.join([STATUS, LIST_NEXT] + list_type + [str(cursor)]))
+
+    @staticmethod
+    def _list_page(req):
+        """Returns the limit and cursor of a paged LIST, or None if the limit is not a number."""
+        try:
+            limit = int(req[0])
+        except ValueError:
+            return None
+        try:
+            cursor = int(req[1]) if len(req) > 1 else 0
+        except ValueError:
+            raise ServerException('invalid list page')
+        if not 0 < limit <= MAX_LIST_LIMIT or cursor < 0:
+            raise ServerException('invalid list page')
+        return limit, cursor
+
+    def _leave(self, *args):
+        """Handler for LEAVE command, removes player or spectator from game."""
+        if not self.game:
+            raise ServerException('not playing a game')
+        self.game.leave(self)
+        self.game = self.player = None
+
+    def _board(self, *args):
+        """Handler for BOARD command, sends player or spectator the board status."""
+        if not self.game:
+            raise ServerException('not playing a game')
+        self.send_raw(self.game.board_line())
+
+    def _move(self, req):
+        """Handler for MOVE command, moves the player's from the specified source to specified destination."""
+        if not self.game:
+            raise ServerException('not playing a game')
+        src, dst = (int(req.pop(0)), int(req.pop(0))), (int(req.pop(0)), int(req.pop(0)))
+        self.game.make_move(src, dst, self.player)
+
+    def _turn(self, *args):
+        """Handler for the TURN command, sends the player or spectator the turn status."""
+        self.send_line('STATUS TURN %s' % self.game.turn)
+
+    def _shutdown(self, *args):
+        """Handler for the SHUTDOWN command, tells server to shutdown after all clients disconnect."""
+        self.server.shutdown()
+
+
+def game_interaction(fn):
+    @wraps(fn)
+    def update_interaction_time(self, *args, **kwargs):
+        result = fn(self, *args, **kwargs)
+        self.last_interaction = time()
+        return result
+    return update_interaction_time
+
+
+class Game(object):
+
+    """A game between two clients, watched by any number of spectators. Given a time control, each player has that
+    many seconds for all of their moves, counted while both seats are filled, and loses on running out."""
+
+    __slots__ = ('id', 'board', 'lock', 'players', 'last_interaction', 'spectators', 'recipients', 'version',
+                 'snapshot', 'lobby', 'timers', 'clocks', 'clock_started', 'clock_timer', 'out_of_time',
+                 '_board_line')
+
+    def __init__(self, board_factory=Board, lobby=None, timers=None, time_control=None):
+        self.id = gen_id()
+        self.lobby = lobby  # Told when seats open or fill and when the game is won
+        self.timers = timers
+        self.clocks = {RED: time_control, BLACK: time_control} if time_control else None  # Seconds left to move
+        self.clock_started = None
+        self.clock_timer = None
+        self.out_of_time = None  # The player who lost on time
+        self.board = board_factory()
+        self.lock = RLock()
+        self.players = {RED: None, BLACK: None}
+        self.last_interaction = time()
+        self.spectators = []
+        self.recipients = ()  # Players and spectators, rebuilt when they change rather than on every status
+        for player, x, y in self.board.start_positions():
+            self.board.add_piece(Piece(player), (x, y))
+        self.snapshot = self.board.snapshot()  # Replaced before version is bumped, so readers need no lock
+        self.version = 0  # Bumped on every move
+        self._board_line = (None, None)
+
+    def memory_usage(self):
+        """Returns the approximate number of bytes held by this game and its board, not counting the clients."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.id) + sys.getsizeof(self.lock)
+        size += sys.getsizeof(self.players) + sys.getsizeof(self.spectators) + sys.getsizeof(self.recipients)
+        size += self.board.memory_usage()
+        return size + sys.getsizeof(self.snapshot) + sys.getsizeof(self.snapshot.encoded)
+
+    def board_line(self):
+        """Returns the terminated STATUS BOARD line for the current board, encoded once per version from the snapshot
+        without taking the lock."""
+        version, line = self._board_line
+        if version != self.version:
+            version = self.version
+            line = ' '.join([STATUS, BOARD, repr(self.snapshot)]) + '\r\n'
+            self._board_line = version, line
+        return line
+
+    def _update_lobby(self):
+        if self.lobby:
+            self.lobby.update(self)
+
+    def _update_recipients(self):
+        self.recipients = tuple(handler for handler in self.players.values() if handler) + tuple(self.spectators)
+
+    @staticmethod
+    def encode_status(*statuses):
+        """Returns the terminated STATUS lines for a batch of statuses, each a list of tokens, as one string."""
+        return ''.join(' '.join([STATUS] + status) + '\r\n' for status in statuses)
+
+    def broadcast(self, data, exclude=None):
+        """Sends the same encoded data to every player and spectator, except the one excluded."""
+        for handler in self.recipients:
+            if handler is not exclude:
+                handler.send_raw(data)
+
+    @game_interaction
+    def join(self, player_handler):
+        with self.lock:
+            if not self.open_seats:
+                raise ServerException('no available seats')
+            open_player = self.open_seats[0]
+            self.players[open_player] = player_handler
+            self._update_recipients()
+            self._update_lobby()
+            turn = self.turn
+            if turn != WAIT:
+                self._start_clock()
+            self.broadcast(self.encode_status([JOINED, open_player], [TURN, turn]), exclude=player_handler)
+            player_handler.send_raw(self.encode_status([GAME_ID, str(self.id)]) + self.board_line() +
+                                    self.encode_status([YOU_ARE, open_player], [TURN, turn]))
+            return open_player
+
+    def spectate(self, handler):
+        with self.lock:
+            if handler not in self.spectators:
+                self.spectators.append(handler)
+                self._update_recipients()
+                handler.send_raw(self.encode_status([GAME_ID, str(self.id)]) + self.board_line() +
+                                 self.encode_status([TURN, self.turn]))
+
+    @game_interaction
+    def leave(self, client):
+        with self.lock:
+            for player, handler in self.players.items():
+                if handler is client:
+                    self.players[player] = None
+                    self._update_recipients()
+                    self._update_lobby()
+                    self._stop_clock()
+                    self.broadcast(self.encode_status([LEFT, player], [TURN, self.turn]), exclude=client)
+            if client in self.spectators:
+                self.spectators.remove(client)
+                self._update_recipients()
+
+    @property
+    def open_seats(self):
+        with self.lock:
+            seats = []
+            for player in [RED, BLACK]:
+                if not self.players[player]:
+                    seats.append(player)
+            return seats
+
+    @property
+    def turn(self):
+        with self.lock:
+            if self.open_seats:
+                return WAIT
+            return self.board.turn
+
+    @property
+    def winner(self):
+        if self.out_of_time:
+            return opponent[self.out_of_time]
+        return self.snapshot.winner()
+
+    def _start_clock(self):
+        """Starts the clock of the player to move, if the game has a time control."""
+        if self.clocks and not self.winner:
+            player = self.board.turn
+            self.clock_started = time()
+            self.clock_timer = self.timers.schedule(max(0.0, self.clocks[player]), self._flag, player)
+
+    def _stop_clock(self):
+        """Stops the running clock, charging the player to move for the time taken."""
+        if self.clock_timer:
+            self.clock_timer.cancel()
+            self.clock_timer = None
+            self.clocks[self.board.turn] -= time() - self.clock_started
+
+    def _flag(self, player):
+        """Called by the timer of a player's clock. The player loses unless the clock was stopped or restarted
+        meanwhile, which replaces the running timer or leaves none."""
+        with self.lock:
+            if self.clock_timer is None or self.clock_timer.active or self.board.turn != player or self.winner:
+                return
+            self._run_out(player)
+
+    def _run_out(self, player):
+        """Ends the game as lost on time by player, whose clock is running."""
+        self.clock_timer.cancel()
+        self.clock_timer = None
+        self.clocks[player] = 0.0
+        self.out_of_time = player
+        self._update_lobby()
+        self.broadcast(self.encode_status([OUT_OF_TIME, player], [WINNER, self.winner]))
+
+    def close(self):
+        """Stops the game's clock, once the game is no longer served."""
+        with self.lock:
+            if self.clock_timer:
+                self.clock_timer.cancel()
+                self.clock_timer = None
+
+    @game_interaction
+    def make_move(self, src, dst, player):
+        with self.lock:
+            if self.open_seats:
+                raise ServerException('waiting for player')
+            if self.winner:
+                raise ServerException('game over')
+            if not src in self.board:
+                raise ServerException('invalid move source')
+            if self.board[src].player != player:
+                raise ServerException('not your piece')
+            if self.clock_timer and self.board.turn == player and time() - self.clock_started >= self.clocks[player]:
+                self._run_out(player)  # Before the timer wheel gets to it
+                raise ServerException('out of time')
+            try:
+                was_king = self.board[src].king
+                captured = self.board.move(src, dst)
+            except CheckersException as ce:
+                raise ServerException(ce.message)
+            if self.clock_timer:
+                self.clock_timer.cancel()
+                self.clock_timer = None
+                self.clocks[player] -= time() - self.clock_started
+            self.snapshot = self.board.snapshot()
+            self.version += 1
+            if self.winner:
+                self._update_lobby()
+            else:
+                self._start_clock()
+            statuses = [[MOVED] + [str(i) for i in src] + [str(i) for i in dst]]
+            if captured:
+                statuses.append([CAPTURED] + [str(i) for i in captured.location])
+            if not was_king and self.board[dst].king:
+                statuses.append([KING] + [str(i) for i in dst])
+            statuses.append([TURN, self.turn])
+            if self.winner:
+                statuses.append([WINNER, self.winner])
+            self.broadcast(self.encode_status(*statuses))
+
+    def __repr__(self):
+        return repr(self.snapshot)
+
+
+class GameIndex(object):
+
+    """Games in the order they were added, each under a sequence number that only grows, so the page after a number
+    is found by bisection and stays in place as other games come and go. A removed game's number is left in the
+    order, and skipped, until removed numbers outnumber the live ones."""
+
+    def __init__(self):
+        self.order = []  # Sequence numbers, ascending
+        self.games = {}  # Sequence number to game
+        self.numbers = {}  # Game to sequence number
+        self.last = 0
+
+    def __len__(self):
+        return len(self.games)
+
+    def add(self, game):
+        if game not in self.numbers:
+            self.last += 1
+            self.numbers[game] = self.last
+            self.games[self.last] = game
+            self.order.append(self.last)
+
+    def remove(self, game):
+        number = self.numbers.pop(game, None)
+        if number is not None:
+            del self.games[number]
+            if len(self.order) > 2 * len(self.games) + 64:
+                self.order = [n for n in self.order if n in self.games]
+
+    def values(self):
+        return [self.games[n] for n in self.order if n in self.games]
+
+    def page(self, limit, after=0, exclude=None):
+        """Returns at most limit games added after the game numbered after, other than exclude, and the number to
+        pass for the next page, or None if there are no more games."""
+        order, games, last = self.order, [], None
+        for i in xrange(bisect_right(order, after), len(order)):
+            game = self.games.get(order[i])
+            if game is not None and game is not exclude:
+                if len(games) == limit:
+                    return games, last
+                games.append(game)
+                last = order[i]
+        return games, None
+
+
+class Lobby(object):
+
+    """Indexes of the open and the unfinished games, kept up to date by the games themselves so that listing them
+    costs only the size of the answer."""
+
+    def __init__(self):
+        self.open = GameIndex()
+        self.unfinished = GameIndex()
+        self.lock = RLock()
+
+    def update(self, game):
+        with self.lock:
+            if game.winner:
+                self.remove(game)
+                return
+            self.unfinished.add(game)
+            if game.open_seats:
+                self.open.add(game)
+            else:
+                self.open.remove(game)
+
+    def remove(self, game):
+        with self.lock:
+            self.open.remove(game)
+            self.unfinished.remove(game)
+
+
+class GameRegistry(object):
+
+    """The games of a server, shared by every server. Servers call init_games before accepting connections."""
+
+    def init_games(self, prune_inactive=PRUNE_IDLE_SECS, board_factory=Board, time_control=None):
+        self.games = {}
+        self.lobby = Lobby()
+        self.timers = TimerWheel()  # Advanced by the server, which sets its wakeup if it runs on another thread
+        self.time_control = time_control
+        self.lock = RLock()
+        self.prune_inactive = prune_inactive
+        self.board_factory = board_factory
+
+    def _expire_idle(self, game):
+        """Called by a game's idle timer. Abandons the game if it has been idle for prune_inactive seconds, otherwise
+        waits for the rest of that time from its last interaction. Interactions do not touch the timer."""
+        with self.lock:
+            if self.games.get(game.id) is not game:
+                return
+            idle = time() - game.last_interaction
+            if idle < self.prune_inactive:
+                self.timers.schedule(self.prune_inactive - idle, self._expire_idle, game)
+                return
+            self.games.pop(game.id)
+            self.lobby.remove(game)
+            game.close()
+            log.debug('abandoning game %s after %s seconds of inactivity', game.id, self.prune_inactive)
+
+    def get_games(self):
+        with self.lock:
+            return [g for g in self.games.values()]
+
+    def memory_per_game(self):
+        """Returns the average number of bytes held by each live game."""
+        games = self.get_games()
+        return sum(game.memory_usage() for game in games) / len(games) if games else 0
+
+    def get_open_games(self):
+        with self.lobby.lock:
+            return self.lobby.open.values()
+
+    def get_unfinished_games(self):
+        with self.lobby.lock:
+            return self.lobby.unfinished.values()
+
+    def list_games(self, spectate, limit, cursor=0, exclude=None):
+        """Returns a page of the unfinished games, or of the open games, other than exclude, and the cursor of the
+        next page."""
+        with self.lobby.lock:
+            return (self.lobby.unfinished if spectate else self.lobby.open).page(limit, cursor, exclude)
+
+    def new_game(self, handler):
+        with self.lock:
+            new_game = Game(self.board_factory, self.lobby, self.timers, self.time_control)
+            while new_game.id in self.games:
+                new_game.id = gen_id()
+            self.games[new_game.id] = new_game
+            self.timers.schedule(self.prune_inactive, self._expire_idle, new_game)
+            return self.join_game(new_game.id, handler)
+
+    def join_game(self, game_id, handler):
+        with self.lock:
+            if game_id in self.games:
+                game = self.games[game_id]
+                player = game.join(handler)
+                return game, player
+            raise ServerException('game not available')
+
+    def spectate_game(self, game_id, handler):
+        with self.lock:
+            if game_id in self.games:
+                game = self.games[game_id]
+                game.spectate(handler)
+                return game
+            raise ServerException('game not available')
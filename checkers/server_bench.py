@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+import errno
+import json
+import os
+import socket
+import subprocess
+import sys
+import select
+from time import time, sleep
+from protocol import NEW, BOARD, OK, ERROR
+import logging as log
+
+
+SERVERS = {'threaded': 'threaded_server.py', 'unthreaded': 'unthreaded_server.py', 'async': 'async_server.py'}
+DEFAULT_CONNECTIONS = 10000
+DEFAULT_ROUNDS = 10
+DEFAULT_TIMEOUT_SECS = 60
+
+
+def raise_file_limit(count):
+    """Raises the soft limit on open files towards count plus some headroom, as far as the hard limit allows."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = count + 64 if hard == resource.RLIM_INFINITY else min(count + 64, hard)
+    if wanted > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+def new_poller():
+    """Returns (poller, read events, error events), preferring epoll so the client scales past select's limit."""
+    if hasattr(select, 'epoll'):
+        return select.epoll(), select.EPOLLIN, select.EPOLLERR | select.EPOLLHUP
+    return select.poll(), select.POLLIN, select.POLLERR | select.POLLHUP
+
+
+class Connection(object):
+
+    """A benchmark client connection that counts the results of its requests and times each one."""
+
+    __slots__ = ('socket', 'buf', 'sent', 'received', 'latencies', 'failed')
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.buf = ''
+        self.sent = []
+        self.received = 0
+        self.latencies = []
+        self.failed = False
+
+    def send(self, line):
+        self.sent.append(time())
+        self.socket.sendall(line + '\r\n')
+
+    def receive(self):
+        """Reads what is available and returns False when the connection has been closed."""
+        try:
+            data = self.socket.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            return False
+        if not data:
+            return False
+        lines = (self.buf + data).split('\n')
+        self.buf = lines.pop()
+        now = time()
+        for line in lines:
+            if line.startswith(OK) or line.startswith(ERROR):
+                self.latencies.append(now - self.sent[self.received])
+                self.received += 1
+        return True
+
+    @property
+    def waiting(self):
+        return not self.failed and self.received < len(self.sent)
+
+
+def connect(host, port, count):
+    """Opens count connections and returns those that succeeded."""
+    connections = []
+    for i in xrange(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+        try:
+            sock.connect((host, port))
+        except socket.error as e:
+            log.debug('connection %s failed: %s', i, e)
+            sock.close()
+            continue
+        sock.setblocking(False)
+        connections.append(Connection(sock))
+    return connections
+
+
+def send_round(connections, line, timeout):
+    """Sends a request on every connection and waits for all the results, marking connections that close or do not
+    answer in time as failed."""
+    poller, read_events, error_events = new_poller()
+    by_fd = {}
+    for connection in connections:
+        if connection.failed:
+            continue
+        try:
+            connection.send(line)
+        except socket.error:
+            connection.failed = True
+            continue
+        by_fd[connection.socket.fileno()] = connection
+        poller.register(connection.socket.fileno(), read_events | error_events)
+    deadline = time() + timeout
+    while by_fd and time() < deadline:
+        for fd, event in poller.poll(1.0):
+            connection = by_fd.get(fd)
+            if connection is None:
+                continue
+            if not connection.receive() or event & error_events:
+                connection.failed = True
+            if not connection.waiting:
+                poller.unregister(fd)
+                del by_fd[fd]
+    for connection in by_fd.values():
+        connection.failed = True
+    poller.close()
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, len(ordered) * p / 100)] if ordered else 0.0
+
+
+def run(host, port, connection_count=DEFAULT_CONNECTIONS, rounds=DEFAULT_ROUNDS, timeout=DEFAULT_TIMEOUT_SECS):
+    """Connects, has every connection start a game, then times rounds of BOARD requests sent on every connection
+    at once. Returns the statistics."""
+    raise_file_limit(connection_count)
+    start = time()
+    connections = connect(host, port, connection_count)
+    connect_secs = time() - start
+    send_round(connections, NEW, timeout)
+    for connection in connections:
+        del connection.latencies[:]
+    start = time()
+    for i in xrange(rounds):
+        send_round(connections, BOARD, timeout)
+    elapsed = time() - start
+    latencies = sorted(latency for connection in connections for latency in connection.latencies)
+    failed = sum(1 for connection in connections if connection.failed)
+    for connection in connections:
+        connection.socket.close()
+    return {'connections': len(connections), 'refused': connection_count - len(connections), 'failed': failed,
+            'connect_secs': connect_secs, 'requests': len(latencies), 'elapsed_secs': elapsed,
+            'requests_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000, 'p99_ms': percentile(latencies, 99) * 1000}
+
+
+def start_server(name, host, port, extra_args=()):
+    """Starts a server in a child process and waits until it accepts connections."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SERVERS[name])
+    process = subprocess.Popen([sys.executable, path, '--interface', host, '--port', str(port)] + list(extra_args))
+    for i in xrange(100):
+        try:
+            socket.create_connection((host, port), 1).close()
+            return process
+        except socket.error:
+            if process.poll() is not None:
+                break
+            sleep(0.1)
+    process.kill()
+    raise RuntimeError('%s server did not start' % name)
+
+
+def stop_server(process):
+    process.terminate()
+    process.wait()
+
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+
+    def parse_arguments():
+        arg_p = ArgumentParser(description='Benchmarks the checkers servers with many concurrent connections')
+        arg_p.add_argument('--servers', help='servers to start and benchmark in turn', nargs='+',
+                           choices=sorted(SERVERS), default=sorted(SERVERS))
+        arg_p.add_argument('--external', help='benchmark a server already running at host and port instead',
+                           action='store_true', default=False)
+        arg_p.add_argument('--host', help='server host', default='127.0.0.1')
+        arg_p.add_argument('--port', help='server port', type=int, default=5123)
+        arg_p.add_argument('--connections', help='number of concurrent connections', type=int,
+                           default=DEFAULT_CONNECTIONS)
+        arg_p.add_argument('--rounds', help='number of requests sent on each connection', type=int,
+                           default=DEFAULT_ROUNDS)
+        arg_p.add_argument('--timeout', help='seconds to wait for the results of a round', type=int,
+                           default=DEFAULT_TIMEOUT_SECS)
+        arg_p.add_argument('--loop', help='event loop for the async server', default='auto')
+        arg_p.add_argument('--output', help='file to write the results to as JSON')
+        arg_p.add_argument('--log-level', help='diagnostic logging level', choices=['DEBUG', 'INFO'], default='INFO')
+        return arg_p.parse_args()
+
+    args = parse_arguments()
+    log.basicConfig(level=log.getLevelName(args.log_level))
+    raise_file_limit(2 * args.connections)
+    results = {}
+    for name in (['external'] if args.external else args.servers):
+        process = None
+        if not args.external:
+            process = start_server(name, args.host, args.port, ['--loop', args.loop] if name == 'async' else [])
+        try:
+            results[name] = run(args.host, args.port, args.connections, args.rounds, args.timeout)
+        finally:
+            if process:
+                stop_server(process)
+        print '%-10s %s' % (name, '%(connections)s connected, %(refused)s refused, %(failed)s failed, connect '
+                            '%(connect_secs).1fs, %(requests_per_sec).0f requests/sec, p50 %(p50_ms).1fms, '
+                            'p99 %(p99_ms).1fms' % results[name])
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
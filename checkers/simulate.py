@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+from os.path import join, dirname
+from random import Random
+from time import time
+from internals import RED, BLACK, Board, Piece, players
+from engine import Engine
+import logging as log
+
+
+DEFAULT_MAX_MOVES = 300
+
+
+class RandomPolicy(object):
+
+    """Plays a uniformly random legal move."""
+
+    def __init__(self, seed=None):
+        self.rand = Random(seed)
+
+    def new_game(self):
+        pass
+
+    def choose(self, board):
+        moves = list(board.legal_moves())
+        return self.rand.choice(moves) if moves else None
+
+
+class ScriptedPolicy(object):
+
+    """Replays a fixed list of single step moves, such as the MOVE lines in game-data/moves-*. Multi-jumps are
+    replayed one step per call."""
+
+    def __init__(self, moves):
+        self.moves = moves
+        self.next = 0
+
+    @staticmethod
+    def load(player, directory=join(dirname(__file__), 'game-data')):
+        with open(join(directory, 'moves-%s' % player), 'r') as move_file:
+            moves = [map(int, line.split()[1:]) for line in move_file if line.strip()]
+        return ScriptedPolicy([((m[0], m[1]), (m[2], m[3])) for m in moves])
+
+    def new_game(self):
+        self.next = 0
+
+    def choose(self, board):
+        if self.next >= len(self.moves):
+            return None
+        self.next += 1
+        return self.moves[self.next - 1]
+
+
+class EnginePolicy(object):
+
+    """Plays the move found by an engine.Engine search."""
+
+    def __init__(self, engine=None):
+        self.engine = engine or Engine()
+
+    def new_game(self):
+        pass
+
+    def choose(self, board):
+        return self.engine.search(board)
+
+
+class Simulator(object):
+
+    """Plays complete games in process on internals.Board, asking each player's policy for moves until the game is
+    won, the player to move has no move or max_moves moves have been played. Moves are made with Board.move, so
+    they are validated as they would be by a server."""
+
+    def __init__(self, policies, max_moves=DEFAULT_MAX_MOVES):
+        self.policies = policies
+        self.max_moves = max_moves
+
+    def play(self):
+        """Plays one game and returns (winner, number of moves)."""
+        board = Board()
+        for player, x, y in board.start_positions():
+            board.add_piece(Piece(player), (x, y))
+        for policy in self.policies.values():
+            policy.new_game()
+        moves = 0
+        while moves < self.max_moves and not board.winner():
+            move = self.policies[board.turn].choose(board)
+            if not move:
+                break
+            for src, dst in zip(move, move[1:]):
+                board.move(src, dst)
+            moves += 1
+        return board.winner(), moves
+
+    def run(self, games):
+        """Plays a number of games and returns their statistics."""
+        lengths = []
+        wins = dict((player, 0) for player in players)
+        start = time()
+        for game in xrange(games):
+            winner, moves = self.play()
+            log.debug('game %s: %s after %s moves', game + 1, winner or 'no winner', moves)
+            lengths.append(moves)
+            if winner:
+                wins[winner] += 1
+        elapsed = time() - start
+        return {'games': games, 'moves': sum(lengths), 'elapsed_ms': int(elapsed * 1000),
+                'games_per_sec': games / elapsed if elapsed else 0.0,
+                'moves_per_sec': sum(lengths) / elapsed if elapsed else 0.0,
+                'wins': wins, 'draws': games - sum(wins.values()), 'lengths': length_distribution(lengths)}
+
+
+def length_distribution(lengths):
+    """Returns the minimum, maximum, mean and percentiles of a list of game lengths."""
+    if not lengths:
+        return {}
+    ordered = sorted(lengths)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, len(ordered) * p / 100)]
+
+    return {'min': ordered[0], 'max': ordered[-1], 'mean': float(sum(ordered)) / len(ordered),
+            'p50': percentile(50), 'p90': percentile(90), 'p99': percentile(99)}
+
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+    from book import OpeningBook
+
+    policy_names = ['random', 'scripted', 'engine']
+
+    def parse_arguments():
+        arg_p = ArgumentParser(description='Plays checkers games in process and reports throughput')
+        arg_p.add_argument('--games', help='number of games to play', type=int, default=100)
+        arg_p.add_argument('--black', help='policy for the black player', choices=policy_names, default='random')
+        arg_p.add_argument('--red', help='policy for the red player', choices=policy_names, default='random')
+        arg_p.add_argument('--seed', help='seed for random policies', type=int)
+        arg_p.add_argument('--max-moves', help='moves after which a game is abandoned', type=int,
+                           default=DEFAULT_MAX_MOVES)
+        arg_p.add_argument('--time', help='engine time budget per move in milliseconds', type=int, default=100)
+        arg_p.add_argument('--book', help='opening book file for engine policies')
+        arg_p.add_argument('--log-level', help='diagnostic logging level', choices=['DEBUG', 'INFO'], default='INFO')
+        return arg_p.parse_args()
+
+    def new_policy(name, player):
+        if name == 'scripted':
+            return ScriptedPolicy.load(player)
+        elif name == 'engine':
+            return EnginePolicy(Engine(time_budget_ms=args.time, book=OpeningBook(args.book) if args.book else None))
+        return RandomPolicy(None if args.seed is None else args.seed + players.index(player))
+
+    args = parse_arguments()
+    log.basicConfig(level=log.getLevelName(args.log_level))
+    simulator = Simulator({BLACK: new_policy(args.black, BLACK), RED: new_policy(args.red, RED)},
+                          max_moves=args.max_moves)
+    results = simulator.run(args.games)
+    print '%(games)s games, %(moves)s moves in %(elapsed_ms)sms' % results
+    print '%(games_per_sec).1f games/sec, %(moves_per_sec).1f moves/sec' % results
+    print 'black won %s, red won %s, %s unfinished' % (results['wins'][BLACK], results['wins'][RED], results['draws'])
+    if results['lengths']:
+        print 'game length: min %(min)s, mean %(mean).1f, p50 %(p50)s, p90 %(p90)s, p99 %(p99)s, max %(max)s' % \
+            results['lengths']
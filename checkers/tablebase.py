@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+import os
+import re
+from array import array
+from mmap import mmap, ACCESS_READ
+from internals import RED, BLACK, Board, Piece
+import logging as log
+
+
+DRAW, WIN, LOSS, INVALID = 0, 1, 2, 3  # Results for the player to move, packed four to a byte
+MAX_DISTANCE = 255
+
+_binomials = {}
+
+
+def binomial(n, k):
+    """Returns the number of ways to choose k of n items."""
+    if k < 0 or k > n:
+        return 0
+    if (n, k) not in _binomials:
+        result = 1
+        for i in xrange(k):
+            result = result * (n - i) / (i + 1)
+        _binomials[(n, k)] = result
+    return _binomials[(n, k)]
+
+
+def rank(combination):
+    """Returns the position of a sorted combination of distinct non-negative ints in colexicographic order."""
+    return sum(binomial(c, i + 1) for i, c in enumerate(combination))
+
+
+def unrank(r, k):
+    """Returns the sorted combination of k ints at position r in colexicographic order."""
+    combination = []
+    for i in xrange(k, 0, -1):
+        c = i - 1
+        while binomial(c + 1, i) <= r:
+            c += 1
+        combination.append(c)
+        r -= binomial(c, i)
+    combination.reverse()
+    return combination
+
+
+def signatures(max_pieces):
+    """Returns the (black men, black kings, red men, red kings) material signatures with at least one piece each and
+    at most max_pieces in total, ordered so that every table comes after the tables its positions can lead to."""
+    result = []
+    for total in xrange(2, max_pieces + 1):
+        for bm in xrange(total + 1):
+            for bk in xrange(total - bm + 1):
+                for rm in xrange(total - bm - bk + 1):
+                    rk = total - bm - bk - rm
+                    if bm + bk and rm + rk:
+                        result.append((bm, bk, rm, rk))
+    return sorted(result, key=lambda sig: (sum(sig), sig[0] + sig[2]))
+
+
+def table_name(signature):
+    return 'b%d%dr%d%d' % signature
+
+
+TABLE_NAME = re.compile(r'^b(\d)(\d)r(\d)(\d)\.wld$')
+
+
+class Indexer(object):
+
+    """Maps positions with a material signature to dense table indices. Men of each player are ranked among the
+    squares they can stand on, kings among the squares the men leave free, and the player to move is the lowest bit.
+    Indices where black and red men would share a square are invalid and hold INVALID in the table."""
+
+    def __init__(self, signature, dim=8):
+        self.signature = signature
+        self.squares = sorted(Board(dim).usable_positions(), key=lambda (x, y): (y, x))
+        self.square_of = dict((pos, i) for i, pos in enumerate(self.squares))
+        self.men_squares = {BLACK: [i for i, (x, y) in enumerate(self.squares) if y != dim - 1],
+                            RED: [i for i, (x, y) in enumerate(self.squares) if y != 0]}
+        self.men_rank = dict((player, dict((s, i) for i, s in enumerate(squares)))
+                             for player, squares in self.men_squares.items())
+        bm, bk, rm, rk = signature
+        free = len(self.squares) - bm - rm
+        self.sizes = (binomial(len(self.men_squares[BLACK]), bm), binomial(len(self.men_squares[RED]), rm),
+                      binomial(free, bk), binomial(free - bk, rk))
+        self.size = 2 * self.sizes[0] * self.sizes[1] * self.sizes[2] * self.sizes[3]
+
+    def index(self, black_men, black_kings, red_men, red_kings, turn):
+        """Returns the index of a position given the square numbers of each kind of piece."""
+        men = black_men + red_men
+        taken = men + black_kings
+        index = rank(sorted(self.men_rank[BLACK][s] for s in black_men))
+        index = index * self.sizes[1] + rank(sorted(self.men_rank[RED][s] for s in red_men))
+        index = index * self.sizes[2] + rank(sorted(s - sum(1 for t in men if t < s) for s in black_kings))
+        index = index * self.sizes[3] + rank(sorted(s - sum(1 for t in taken if t < s) for s in red_kings))
+        return 2 * index + (turn == RED)
+
+    def position(self, index):
+        """Returns the (black men, black kings, red men, red kings, turn) at an index, or None if it is invalid."""
+        bm, bk, rm, rk = self.signature
+        turn = RED if index & 1 else BLACK
+        index, red_kings = divmod(index / 2, self.sizes[3])
+        index, black_kings = divmod(index, self.sizes[2])
+        black_men, red_men = divmod(index, self.sizes[1])
+        black_men = [self.men_squares[BLACK][i] for i in unrank(black_men, bm)]
+        red_men = [self.men_squares[RED][i] for i in unrank(red_men, rm)]
+        men = set(black_men) | set(red_men)
+        if len(men) < bm + rm:
+            return None
+        free = [s for s in xrange(len(self.squares)) if s not in men]
+        black_kings = [free[i] for i in unrank(black_kings, bk)]
+        free = [s for s in free if s not in set(black_kings)]
+        red_kings = [free[i] for i in unrank(red_kings, rk)]
+        return black_men, black_kings, red_men, red_kings, turn
+
+
+class Tablebase(object):
+
+    """Endgame tables read through mmap, so probing does no parsing and the pages are shared by every process using
+    the same files. Results are for the player to move."""
+
+    def __init__(self, directory, dim=8):
+        self.directory = directory
+        self.dim = dim
+        self.indexers = {}
+        self._tables = {}
+        self._distances = {}
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                match = TABLE_NAME.match(name)
+                if match:
+                    self.max_pieces = max(self.max_pieces, sum(int(count) for count in match.groups()))
+
+    def _path(self, signature, kind):
+        return os.path.join(self.directory, '%s.%s' % (table_name(signature), kind))
+
+    def _map(self, signature, kind, cache):
+        if signature not in cache:
+            path = self._path(signature, kind)
+            if os.path.exists(path):
+                with open(path, 'rb') as table_file:
+                    cache[signature] = mmap(table_file.fileno(), 0, access=ACCESS_READ)
+            else:
+                cache[signature] = None
+        return cache[signature]
+
+    def indexer(self, signature):
+        if signature not in self.indexers:
+            self.indexers[signature] = Indexer(signature, self.dim)
+        return self.indexers[signature]
+
+    def locate(self, board):
+        """Returns the material signature and index of a board's position."""
+        pieces = {(BLACK, False): [], (BLACK, True): [], (RED, False): [], (RED, True): []}
+        for piece in board:
+            pieces[(piece.player, piece.king)].append(piece.location)
+        signature = tuple(len(pieces[kind]) for kind in [(BLACK, False), (BLACK, True), (RED, False), (RED, True)])
+        indexer = self.indexer(signature)
+        squares = [[indexer.square_of[loc] for loc in pieces[kind]]
+                   for kind in [(BLACK, False), (BLACK, True), (RED, False), (RED, True)]]
+        return signature, indexer.index(*(squares + [board.turn]))
+
+    def probe_index(self, signature, index):
+        """Returns the result stored at an index of a table, or None if the table is not available."""
+        table = self._map(signature, 'wld', self._tables)
+        if table is None:
+            return None
+        return (ord(table[index >> 2]) >> ((index & 3) << 1)) & 3
+
+    def distance_index(self, signature, index):
+        """Returns the number of plies to the end of the game stored for an index, or None if not available."""
+        table = self._map(signature, 'dtw', self._distances)
+        if table is None:
+            return None
+        return ord(table[index])
+
+    def probe(self, board):
+        """Returns WIN, LOSS or DRAW for the player to move, or None if the position is not covered."""
+        if board.piece_count(BLACK) + board.piece_count(RED) > self.max_pieces or board.winner():
+            return None
+        return self.probe_index(*self.locate(board))
+
+    def distance(self, board):
+        """Returns the number of plies to the end of the game with best play, or None if not available."""
+        if board.piece_count(BLACK) + board.piece_count(RED) > self.max_pieces or board.winner():
+            return None
+        return self.distance_index(*self.locate(board))
+
+    def close(self):
+        for cache in [self._tables, self._distances]:
+            for table in cache.values():
+                if table is not None:
+                    table.close()
+            cache.clear()
+
+
+def generate(directory, max_pieces, dim=8, distance=False):
+    """Writes tables for every signature with up to max_pieces pieces into directory, skipping tables that exist.
+    Positions are solved one at a time in Python, which is practical up to about four pieces on 8x8. Memory grows
+    by a few bytes per position and per move within its signature, but each further piece multiplies the time."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for signature in signatures(max_pieces):
+        tablebase = Tablebase(directory, dim)
+        if not os.path.exists(tablebase._path(signature, 'wld')):
+            log.info('generating %s', table_name(signature))
+            _generate_table(tablebase, signature, distance)
+        tablebase.close()
+
+
+def _set_result(results, index, result):
+    shift = (index & 3) << 1
+    results[index >> 2] = results[index >> 2] & ~(3 << shift) | result << shift
+
+
+def _generate_table(tablebase, signature, distance):
+    """Solves the positions of one signature. Moves leading to other signatures are looked up in tables that have
+    already been written, and positions within the signature are resolved backwards from them, one ply per pass, so
+    each takes its shortest win, or longest loss, once every position closer to the end is known. Positions left
+    unresolved are draws. Results and distances are built in the layout of the files they are written to, with
+    unresolved positions held as INVALID, which no position a move leads to can be."""
+    indexer = tablebase.indexer(signature)
+    board = Board(tablebase.dim)
+    results = bytearray((indexer.size + 3) / 4)
+    distances = bytearray(indexer.size)
+    # Positions with moves within the signature, the outcome of their other moves, and the moves within it, as child
+    # indices times two plus one when the child has the other player to move
+    pending, wins, losses, draws = array('L'), bytearray(), bytearray(), bytearray()
+    bounds, children = array('L', [0]), array('L')
+
+    for index in xrange(indexer.size):
+        position = indexer.position(index)
+        if position is None:
+            _set_result(results, index, INVALID)
+            continue
+        board.clear()
+        for squares, player, king in zip(position[:4], [BLACK, BLACK, RED, RED], [False, True, False, True]):
+            for square in squares:
+                piece = Piece(player)
+                piece.king = king
+                board[indexer.squares[square]] = piece
+        board.turn = turn = position[4]
+
+        # Outcome of moves to other signatures: shortest win, longest loss and whether a draw is possible
+        win, loss, draw, within = 0, 0, False, len(children)
+        for move in board.legal_moves():
+            board.push(move)
+            if board.winner():
+                win = 1
+            else:
+                child_signature, child = tablebase.locate(board)
+                flip = board.turn != turn
+                if child_signature == signature:
+                    children.append(2 * child + flip)
+                else:
+                    result = tablebase.probe_index(child_signature, child)
+                    plies = min((tablebase.distance_index(child_signature, child) or 0) + 1, MAX_DISTANCE)
+                    if result == DRAW:
+                        draw = True
+                    elif (result == LOSS) != flip:
+                        loss = max(loss, plies)
+                    else:
+                        win = min(win, plies) if win else plies
+            board.pop()
+            if win == 1:
+                break
+
+        if win == 1 or win and len(children) == within:
+            del children[within:]
+            _set_result(results, index, WIN)
+            distances[index] = win
+        elif len(children) > within:
+            _set_result(results, index, INVALID)
+            pending.append(index)
+            wins.append(win)
+            losses.append(loss)
+            draws.append(draw)
+            bounds.append(len(children))
+        elif loss and not draw:
+            _set_result(results, index, LOSS)
+            distances[index] = loss
+
+    # Pass n resolves the positions n plies from the end. Positions resolved by the first pass may be further away,
+    # so passes continue to one past the furthest of them even when one resolves nothing. A position resolved in a
+    # pass is n plies from the end, so reading it later in the same pass cannot resolve another position early
+    horizon = max(max(distances or [0]), max(wins or [0]), max(losses or [0])) + 1
+    unresolved, plies = array('L', xrange(len(pending))), 0
+    while unresolved and plies < horizon:
+        plies += 1
+        remaining = array('L')
+        for i in unresolved:
+            index = pending[i]
+            win, loss, lost = wins[i], losses[i], not draws[i]
+            for j in xrange(bounds[i], bounds[i + 1]):
+                child = children[j] >> 1
+                result = (results[child >> 2] >> ((child & 3) << 1)) & 3
+                if result == INVALID or result == DRAW:
+                    lost = False
+                elif (result == LOSS) != bool(children[j] & 1):
+                    loss = max(loss, distances[child] + 1)
+                else:
+                    win = min(win, distances[child] + 1) if win else distances[child] + 1
+            if win:
+                if win <= plies:
+                    _set_result(results, index, WIN)
+                    distances[index] = min(win, MAX_DISTANCE)
+                    continue
+            elif lost and loss <= plies:
+                _set_result(results, index, LOSS)
+                distances[index] = min(loss, MAX_DISTANCE)
+                continue
+            remaining.append(i)
+        if len(remaining) < len(unresolved):
+            horizon = max(horizon, plies + 1)
+        unresolved = remaining
+
+    for i in unresolved:
+        _set_result(results, pending[i], DRAW)
+
+    with open(tablebase._path(signature, 'wld'), 'wb') as table_file:
+        table_file.write(results)
+    if distance:
+        with open(tablebase._path(signature, 'dtw'), 'wb') as table_file:
+            table_file.write(distances)
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+
+    def parse_arguments():
+        arg_p = ArgumentParser(description='Generates checkers endgame tables')
+        arg_p.add_argument('--pieces', help='maximum number of pieces on the board', type=int, default=4)
+        arg_p.add_argument('--output', help='directory to write tables to', default='tablebase-data')
+        arg_p.add_argument('--distance', help='also write distance to the end of the game', action='store_true',
+                           default=False)
+        arg_p.add_argument('--log-level', help='diagnostic logging level', choices=['DEBUG', 'INFO'], default='INFO')
+        return arg_p.parse_args()
+
+    args = parse_arguments()
+    log.basicConfig(level=log.getLevelName(args.log_level))
+    generate(args.output, args.pieces, distance=args.distance)
@@ -0,0 +1,158 @@
+from heapq import heapify, heappop, heappush
+from math import ceil
+from threading import Event, Lock, Thread
+from time import time
+import logging as log
+
+
+DEFAULT_TICK_SECS = 0.1
+DEFAULT_SLOTS = 1024
+
+
+class Timer(object):
+
+    """A callback due at a deadline, returned by TimerWheel.schedule. Active until it fires or is cancelled."""
+
+    __slots__ = ('deadline', 'tick', 'callback', 'args', 'wheel', 'slot')
+
+    def __init__(self, wheel, deadline, callback, args):
+        self.wheel = wheel
+        self.deadline = deadline
+        self.tick = None
+        self.callback = callback
+        self.args = args
+        self.slot = None
+
+    @property
+    def active(self):
+        return self.slot is not None
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+
+class TimerWheel(object):
+
+    """A hashed timer wheel. Each timer is kept in the slot of the tick at or after its deadline, so cancelling takes
+    constant time, and advancing only looks at the slots of the ticks that have passed. A timer more than one turn of
+    the wheel away stays in its slot and is looked at again each turn until it is due. The ticks that hold timers are
+    also counted and kept in a heap, so the next one is known without looking at the slots: scheduling at a tick no
+    other timer holds costs log(ticks held), and ticks that empty are dropped from the heap as they reach its top.
+
+    The wheel does not run itself. A server advances it from its event loop, waiting at most next_timeout seconds for
+    events, or from a TimerThread. Timers scheduled from other threads than the one waiting call wakeup when they are
+    due before the waiter would otherwise wake."""
+
+    def __init__(self, tick=DEFAULT_TICK_SECS, slots=DEFAULT_SLOTS, clock=time, wakeup=None):
+        self.tick = tick
+        self.clock = clock
+        self.wakeup = wakeup
+        self.slots = [set() for i in xrange(slots)]
+        self.current = int(clock() / tick)  # The first tick not yet advanced past
+        self.ticks = {}  # Number of timers due at each tick that holds any
+        self.heap = []  # The ticks held, and some that have since emptied
+        self.wake_tick = None  # The tick the waiter was last told to wake at
+        self.count = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, delay, callback, *args):
+        """Calls callback with args once delay seconds have passed and returns the Timer."""
+        timer = Timer(self, self.clock() + delay, callback, args)
+        with self.lock:
+            tick = timer.tick = max(int(ceil(timer.deadline / self.tick)), self.current)
+            timer.slot = self.slots[tick % len(self.slots)]
+            timer.slot.add(timer)
+            if tick in self.ticks:
+                self.ticks[tick] += 1
+            else:
+                self.ticks[tick] = 1
+                heappush(self.heap, tick)
+            self.count += 1
+            notify = self.wakeup is not None and (self.wake_tick is None or tick < self.wake_tick)
+            if notify:
+                self.wake_tick = tick
+        if notify:
+            self.wakeup()
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            if timer.slot is not None:
+                timer.slot.discard(timer)
+                timer.slot = None
+                self._release(timer.tick)
+                self.count -= 1
+
+    def _release(self, tick):
+        """Uncounts a timer at tick, rebuilding the heap once most of its ticks have emptied."""
+        self.ticks[tick] -= 1
+        if not self.ticks[tick]:
+            del self.ticks[tick]
+            if len(self.heap) > 2 * len(self.ticks) + 64:
+                self.heap = self.ticks.keys()
+                heapify(self.heap)
+
+    def next_timeout(self, now=None):
+        """Returns the seconds until the wheel next needs advancing, or None while there are no timers."""
+        with self.lock:
+            if not self.count:
+                self.wake_tick = None
+                return None
+            while self.heap[0] not in self.ticks:
+                heappop(self.heap)
+            self.wake_tick = self.heap[0]
+        return max(0.0, self.wake_tick * self.tick - (self.clock() if now is None else now))
+
+    def advance(self, now=None):
+        """Calls the timers that are due, in deadline order, and returns how many there were. A callback that raises
+        is logged, not propagated."""
+        now = self.clock() if now is None else now
+        last = int(now / self.tick + 1e-9)  # So waking at the time next_timeout gave is not a tick short
+        due = []
+        with self.lock:
+            size = len(self.slots)
+            for tick in xrange(self.current, min(last + 1, self.current + size)):
+                slot = self.slots[tick % size]
+                if slot:
+                    expired = [timer for timer in slot if timer.tick <= last]
+                    for timer in expired:
+                        slot.remove(timer)
+                        timer.slot = None
+                        self._release(timer.tick)
+                    due.extend(expired)
+            self.current = max(self.current, last + 1)
+            self.count -= len(due)
+        due.sort(key=lambda timer: timer.deadline)
+        for timer in due:
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                log.exception(e)
+        return len(due)
+
+
+class TimerThread(Thread):
+
+    """Advances a timer wheel from a daemon thread, for servers that have no event loop of their own."""
+
+    def __init__(self, wheel):
+        Thread.__init__(self, name='timers')
+        self.daemon = True
+        self.wheel = wheel
+        self.event = Event()
+        self.running = True
+        wheel.wakeup = self.event.set
+
+    def run(self):
+        while self.running:
+            self.wheel.advance()
+            self.event.wait(self.wheel.next_timeout())
+            self.event.clear()
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+        self.join()
@@ -0,0 +1,48 @@
+EXACT, LOWER, UPPER = 'exact', 'lower', 'upper'
+
+
+class TranspositionTable(object):
+
+    """A fixed size table of search results keyed by Board.zobrist_hash(). Each key maps to a single slot. A stored
+    entry is replaced by a result for the same position, by a result searched at least as deep, or by any result once
+    the entry is left over from an earlier search."""
+
+    def __init__(self, size=1 << 16):
+        slots = 1
+        while slots < size:
+            slots <<= 1
+        self.mask = slots - 1
+        self.generation = 0
+        self._keys = [None] * slots
+        self._entries = [None] * slots
+
+    def new_search(self):
+        """Marks existing entries as stale so they give way to results from the next search."""
+        self.generation += 1
+
+    def get(self, key):
+        """Returns the (depth, value, flag, move) stored for key, or None if it is not in the table."""
+        slot = key & self.mask
+        if self._keys[slot] == key:
+            return self._entries[slot][:4]
+        return None
+
+    def put(self, key, depth, value, flag=EXACT, move=None):
+        """Stores a search result for key if the replacement policy allows it. Returns whether it was stored."""
+        slot = key & self.mask
+        entry = self._entries[slot]
+        if entry is None or self._keys[slot] == key or depth >= entry[0] or entry[4] != self.generation:
+            self._keys[slot] = key
+            self._entries[slot] = (depth, value, flag, move, self.generation)
+            return True
+        return False
+
+    def clear(self):
+        for slot in xrange(len(self._keys)):
+            self._keys[slot] = self._entries[slot] = None
+
+    def __contains__(self, key):
+        return self._keys[key & self.mask] == key
+
+    def __len__(self):
+        return len(self._keys) - self._keys.count(None)
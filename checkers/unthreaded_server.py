@@ -1,52 +1,98 @@
 #!/usr/bin/env python
 
+import errno
 import socket
-import select
-from StringIO import StringIO
-from functools import wraps
-from threaded_server import ServerPublisher, COMMANDS, SPECTATE, OK, ERROR
-from threaded_server import Game, ServerException, PRUNE_IDLE_SECS
+try:
+    import selectors
+except ImportError:
+    import selectors34 as selectors
+from collections import deque
+from threaded_server import ServerPublisher
+from protocol import PRUNE_IDLE_SECS, REQUEST_QUEUE_SIZE, CommandHandler, GameRegistry
+from internals import Board, load_move_tables
+from bitboard import BitBoard
 import logging as log
 from socket import timeout, error
-from time import time
 
 
-def cleanup_on_failure(fn):
-    @wraps(fn)
-    def remove_handler(self, *args, **kwargs):
-        try:
-            return fn(self, *args, **kwargs)
-        except Exception as e:
-            self.cleanup()
-            raise e
-    return remove_handler
-
+class UserHandler(CommandHandler):
 
-class UserHandler(object):
+    """Serves one client. Everything sent is queued and written as far as the socket takes it without blocking, the
+    rest when the socket becomes writable. Once more than high_watermark bytes are queued the client's requests are
+    no longer read until the queue drains below low_watermark, and a client more than outbound_limit bytes behind,
+    such as a spectator that stopped reading, is disconnected. Dropping messages instead would leave it with a
+    wrong view of the game, which is only known from the stream of status messages."""
 
-    rbufsize = -1
-    wbufsize = 0
+    high_watermark = 64 * 1024
+    low_watermark = 16 * 1024
+    outbound_limit = 1024 * 1024
 
     def __init__(self, server, sock):
+        self.init_commands()
         self.server = server
         self.socket = sock
-        self.commands = dict((cmd, getattr(self, "_%s" % cmd.lower())) for cmd in COMMANDS)
-        self.buf = StringIO()
+        self.buf = ''
         self.client = ":".join(map(str, sock.getpeername()))
-        self.player = None
-        self.game = None
-        self.rfile = self.socket.makefile('rb', self.rbufsize)
-        self.wfile = self.socket.makefile('wb', self.wbufsize)
-
-    @cleanup_on_failure
-    def send_line(self, line):
-        self.wfile.write(line + '\r\n')
-        log.debug('%s <= %s', self.client, line)
+        self.outbound = deque()
+        self.outbound_size = 0
+        self.events = selectors.EVENT_READ
+        self.paused = False
+        self.closing = False
+
+    def send_raw(self, data):
+        """Sends data that is already terminated, such as a cached status line."""
+        self.write(data)
+        log.debug('%s <= %s', self.client, data.rstrip())
+
+    def write(self, data):
+        """Queues data, sending it straight away unless this handler's requests are running or earlier data is still
+        waiting for the socket."""
+        if self.closing:
+            return
+        self.outbound.append(data)
+        self.outbound_size += len(data)
+        if self.outbound_size > self.outbound_limit:
+            log.warning('%s disconnected with %s bytes unsent', self.client, self.outbound_size)
+            self.disconnect()
+        elif not self.batching and not self.events & selectors.EVENT_WRITE:
+            self.flush()
+        elif self.outbound_size >= self.high_watermark and not self.paused:
+            self.throttle()
 
-    @cleanup_on_failure
     def flush(self):
-        if not self.wfile.closed:
-            self.wfile.flush()
+        """Sends as much of the queue as the socket takes without blocking and updates the events to wait for."""
+        while self.outbound:
+            data = ''.join(self.outbound) if len(self.outbound) > 1 else self.outbound[0]
+            self.outbound.clear()
+            try:
+                sent = self.socket.send(data)
+            except error as e:
+                self.outbound.append(data)
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                log.debug('%s failed to send: %s', self.client, e)
+                self.cleanup()
+                return
+            self.outbound_size -= sent
+            if sent < len(data):
+                self.outbound.append(data[sent:])
+                break
+        self.throttle()
+
+    def throttle(self):
+        """Pauses or resumes reading requests according to the watermarks."""
+        if self.outbound_size >= self.high_watermark:
+            self.paused = True
+        elif self.outbound_size <= self.low_watermark:
+            self.paused = False
+        self.server.update_events(self)
+
+    def disconnect(self):
+        """Drops the queue and has the server close the connection."""
+        self.closing = True
+        self.outbound.clear()
+        self.outbound_size = 0
+        self.server.remove_handler(self.socket)
 
     def cleanup(self):
         if self.game:
@@ -56,155 +102,76 @@ class UserHandler(object):
         self.server.remove_handler(self.socket)
 
     def close(self):
+        """Leaves the game, if still playing, and makes a last attempt to send what is queued."""
         log.debug("%s closing", self.client)
-        for fd in [self.wfile, self.rfile]:
-            try:
-                fd.close()
-            except Exception as e:
-                log.exception('failed to close file descriptor', e.message)
-
-    def get_command(self, cmd_str):
-        """Returns the handler method corresponding to the given command."""
-        try:
-            return self.commands[cmd_str]
-        except KeyError:
-            raise ServerException('invalid command')
-
-    def _new(self, *args):
-        """Handler for NEW command, creates and joins player to game."""
-        if self.game:
-            raise ServerException('already playing a game')
-        self.game, self.player = self.server.new_game(self)
-
-    def _join(self, req):
-        """Handler for JOIN command, joins player to existing game."""
-        orig_game = None
         if self.game:
-            orig_game = self.game
-        game_id = req.pop(0)
-        self.game, self.player = self.server.join_game(game_id, self)
-        if orig_game:
-            orig_game.leave(self)
-
-    def _spectate(self, req):
-        """Handler for SPECTATE command, joins spectator to existing game."""
-        orig_game = None
-        if self.game:
-            orig_game = self.game
-        game_id = req.pop(0)
-        self.game = self.server.spectate_game(game_id, self)
-        if orig_game:
-            orig_game.leave(self)
-
-    def _list(self, req):
-        """Handler for LIST command, lists game for play or spectating. Excludes current game."""
-        list_type = None
-        status_prefix = 'STATUS LIST '
-        if req:
-            list_type = req.pop(0)
-        if list_type and list_type == SPECTATE:
-            games = self.server.get_unfinished_games()
-            status_prefix += SPECTATE + ' '
-        else:
-            games = self.server.get_open_games()
-        self.send_line(status_prefix + ' '.join(
-            [str(g.id) for g in games if not self.game or self.game is not g]))
-
-    def _leave(self, *args):
-        """Handler for LEAVE command, removes player or spectator from game."""
-        if not self.game:
-            raise ServerException('not playing a game')
-        self.game.leave(self)
-        self.game = self.player = None
-
-    def _board(self, *args):
-        """Handler for BOARD command, sends player or spectator the board status."""
-        if not self.game:
-            raise ServerException('not playing a game')
-        self.send_line('STATUS BOARD %s' % repr(self.game))
-
-    def _move(self, req):
-        """Handler for MOVE command, moves the player's from the specified source to specified destination."""
-        if not self.game:
-            raise ServerException('not playing a game')
-        src, dst = (int(req.pop(0)), int(req.pop(0))), (int(req.pop(0)), int(req.pop(0)))
-        self.game.make_move(src, dst, self.player)
-
-    def _turn(self, *args):
-        """Handler for the TURN command, sends the player or spectator the turn status."""
-        self.send_line('STATUS TURN %s' % self.game.turn)
+            self.game.leave(self)
+            self.game = None
+        if self.outbound:
+            try:
+                self.socket.send(''.join(self.outbound))
+            except error:
+                pass
+        self.closing = True
 
     def _quit(self, *args):
         """Handler for the QUIT command, terminates the connection with client."""
+        self.servicing = False
         self.cleanup()
 
-    def _shutdown(self, *args):
-        """Handler for the SHUTDOWN command, tells server to shutdown after all clients disconnect."""
-        self.server.shutdown()
-
     def _read_lines(self):
-        out_of_data = False
-        while not out_of_data:
+        """Returns the complete lines received and whether the connection was closed."""
+        chunks, closed = [self.buf], False
+        while True:
             try:
                 data = self.socket.recv(4096)
             except (timeout, error) as e:
-                out_of_data = True
-            else:
-                if len(data) == 0:
-                    out_of_data = True
-                else:
-                    self.buf.seek(0, 2)  # Append to end of buffer
-                    self.buf.write(data)
-        self.buf.seek(0)
-        result = self.buf.readlines()
-        if result:
-            self.buf.buf = self.buf.getvalue()[self.buf.pos:]
-            self.buf.len = len(self.buf.buf)
-            self.buf.pos = 0
-        return map(str.strip, result)
+                closed = e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK)
+                break
+            if not data:
+                closed = True
+                break
+            chunks.append(data)
+        lines = ''.join(chunks).split('\n')
+        self.buf = lines.pop()
+        return map(str.strip, lines), closed
 
     def handle(self):
-        """Handles input arriving by parsing and executing complete commands."""
-        req_lines = self._read_lines()
-        if not req_lines:
+        """Handles input arriving by parsing and executing complete commands. A partial line is kept until the rest
+        arrives, or run as it is when the client closes the connection."""
+        req_lines, closed = self._read_lines()
+        if closed and self.buf:
+            req_lines.append(self.buf.strip())
+            self.buf = ''
+        self.handle_lines(req_lines)
+        if closed:
             self.cleanup()
-        for req in req_lines:
-            log.debug('%s => %s', self.client, req)
-            req = req.split()
-            cmd = req.pop(0)
-            try:
-                self.get_command(cmd)(req)
-                result = [OK]
-            except Exception as error:
-                result = [ERROR, error.message]
-            self.send_line(' '.join(result))
-            self.flush()
 
 
-class Server(object):
+class Server(GameRegistry):
 
-    """A non-blocking network server."""
+    """A non-blocking network server. Sockets are watched with selectors.DefaultSelector, epoll on Linux, which
+    carries each client's handler, so the cost of a wakeup depends on the sockets that are ready rather than on the
+    number connected, and there is no limit of 1024 descriptors as with select."""
 
     address_family = socket.AF_INET
 
     socket_type = socket.SOCK_STREAM
 
-    request_queue_size = 5
+    request_queue_size = REQUEST_QUEUE_SIZE
 
     allow_reuse_address = False
 
-    def __init__(self, log_level=log.INFO, ip='0.0.0.0', port=5000, prune_inactive=PRUNE_IDLE_SECS):
+    def __init__(self, log_level=log.INFO, ip='0.0.0.0', port=5000, prune_inactive=PRUNE_IDLE_SECS,
+                 board_factory=Board, time_control=None):
         log.basicConfig(level=log_level)
-        self.games = {}
+        self.init_games(prune_inactive, board_factory, time_control)
         self.allow_reuse_address = True
-        self.prune_inactive = prune_inactive
         self.server_address = (ip, port)
         self.running = True
         self.socket = socket.socket(self.address_family, self.socket_type)
-        self.readable = [self.socket]
-        self.writable = []
-        self.errored = []
-        self.sockets_to_close = []
+        self.selector = selectors.DefaultSelector()
+        self.sockets_to_close = set()
         self.handlers = {}
         self.bind()
         self.activate()
@@ -219,81 +186,68 @@ class Server(object):
     def activate(self):
         """Starts listening on the server's socket."""
         self.socket.listen(self.request_queue_size)
+        self.socket.setblocking(False)
+        self.selector.register(self.socket, selectors.EVENT_READ)
 
     def new_handler(self, sock):
-        self.handlers[sock] = UserHandler(self, sock)
+        handler = self.handlers[sock] = UserHandler(self, sock)
+        self.selector.register(sock, selectors.EVENT_READ, handler)
 
     def remove_handler(self, sock):
         if sock in self.handlers:
-            self.sockets_to_close.append(sock)
-
-    def cleanup(self, sockets=[]):
-        for s in self.sockets_to_close + sockets:
-            self.readable.remove(s)
-            self.errored.remove(s)
-            handler = self.handlers.pop(s)
-            handler.close()
+            self.sockets_to_close.add(sock)
+
+    def update_events(self, handler):
+        """Waits for the socket to become writable while the handler has data queued, and stops reading from it while
+        the handler is paused."""
+        events = (0 if handler.paused else selectors.EVENT_READ) | (selectors.EVENT_WRITE if handler.outbound else 0)
+        if events != handler.events and handler.socket in self.handlers and not handler.closing:
+            self.selector.modify(handler.socket, events, handler)
+            handler.events = events
+
+    def cleanup(self):
+        while self.sockets_to_close:
+            s = self.sockets_to_close.pop()
+            self.selector.unregister(s)
+            self.handlers.pop(s).close()
             s.close()
-        self.sockets_to_close = []
+
+    def accept(self):
+        """Accepts the pending connections."""
+        while True:
+            try:
+                client_socket, client_address = self.socket.accept()
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNABORTED):
+                    log.warning('failed to accept connection: %s', e)
+                return
+            client_socket.setblocking(False)
+            log.debug('%s connected', ":".join(map(str, client_address)))
+            self.new_handler(client_socket)
 
     def start(self):
         """Starts servicing connections."""
         log.info('started server on %s:%s', self.server_address[0], self.server_address[1])
         while self.running:
-            readable, writable, errored = select.select(self.readable, self.writable, self.errored)
-            self.cleanup(errored)
-            for s in readable:
-                if s is self.socket:
-                    client_socket, client_address = self.socket.accept()
-                    client_socket.setblocking(False)
-                    log.debug('%s connected', ":".join(map(str, client_address)))
-                    self.new_handler(client_socket)
-                    self.readable.append(client_socket)
-                    self.errored.append(client_socket)
-                else:
-                    if s in self.handlers:
-                        self.handlers[s].handle()
+            for key, events in self.selector.select(self.timers.next_timeout()):
+                if key.data is None:
+                    self.accept()
+                    continue
+                if events & selectors.EVENT_WRITE and key.fileobj not in self.sockets_to_close:
+                    key.data.flush()
+                if events & selectors.EVENT_READ and key.fileobj not in self.sockets_to_close:
+                    key.data.handle()
+            self.timers.advance()
             self.cleanup()
-
-    def _prune_idle_games(self):
-        now = time()
-        for key, game in self.games.items():
-            if game.last_interaction < now - self.prune_inactive:
-                self.games.pop(key)
-                log.debug('abandoning game %s after %s seconds of inactivity', game.id, self.prune_inactive)
-
-    def get_games(self):
-        self._prune_idle_games()
-        return [g for g in self.games.values()]
-
-    def get_open_games(self):
-        return [g for g in self.get_games() if g.open_seats and not g.winner]
-
-    def get_unfinished_games(self):
-        return [g for g in self.get_games() if not g.winner]
-
-    def new_game(self, handler):
-        new_game = Game()
-        self.games[new_game.id] = new_game
-        return self.join_game(new_game.id, handler)
-
-    def join_game(self, game_id, handler):
-        if game_id in self.games:
-            game = self.games[game_id]
-            player = game.join(handler)
-            return game, player
-        raise ServerException('game not available')
-
-    def spectate_game(self, game_id, handler):
-        if game_id in self.games:
-            game = self.games[game_id]
-            game.spectate(handler)
-            return game
-        raise ServerException('game not available')
+        self.selector.close()
 
     def serve_forever(self):
         self.start()
 
+    def shutdown(self):
+        """Stops servicing connections once the current requests are handled."""
+        self.running = False
+
 
 if __name__ == '__main__':
 
@@ -307,7 +261,10 @@ if __name__ == '__main__':
         arg_p.add_argument('--log-level', help='diagnostic logging level', choices=['DEBUG', 'INFO'], default='INFO')
         arg_p.add_argument('--prune-inactive', help='prune games after n seconds inactive', type=int,
                            default=PRUNE_IDLE_SECS)
+        arg_p.add_argument('--time-control', help='seconds each player has for all their moves', type=float)
         arg_p.add_argument('--zeroconf', help='register as a zeroconf service', action='store_true', default=False)
+        arg_p.add_argument('--bitboard', help='use the bitboard game engine', action='store_true', default=False)
+        arg_p.add_argument('--move-tables', help='load precomputed move tables from a data file')
         return arg_p.parse_args()
 
     def publish_server(server):
@@ -317,9 +274,13 @@ if __name__ == '__main__':
 
     args = parse_arguments()
 
+    if args.move_tables:
+        load_move_tables(args.move_tables)
+
     try:
         server = Server(ip=args.interface, port=args.port, log_level=log.getLevelName(args.log_level),
-                        prune_inactive=args.prune_inactive)
+                        prune_inactive=args.prune_inactive, board_factory=BitBoard if args.bitboard else Board,
+                        time_control=args.time_control)
         if args.zeroconf:
             publish_server(server)
         server.serve_forever()
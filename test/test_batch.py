@@ -0,0 +1,79 @@
+from unittest import TestCase, skipIf
+from checkers.internals import Board, RED, players, CheckersException, new_game
+
+try:
+    import numpy
+    from checkers.batch import BatchBoards, NO_PLAYER
+except ImportError:
+    numpy = None
+
+
+def single_steps(board):
+    return set(path[:2] for path in board.legal_moves())
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class TestBatchBoards(TestCase):
+
+    def test_initial_state(self):
+        batch = BatchBoards(3)
+        for index in xrange(3):
+            self.assertEqual(new_game().encode(), batch.encode(index))
+            self.assertEqual(single_steps(new_game()), set(batch.moves(index)))
+        self.assertEqual([NO_PLAYER] * 3, list(batch.winners()))
+
+    def test_random_games_match_board(self):
+        games = 20
+        batch, boards = BatchBoards(games), [new_game() for game in xrange(games)]
+        random_state = numpy.random.RandomState(42)
+        for ply in xrange(300):
+            winners = batch.winners()
+            moves = [batch.moves(index) for index in xrange(games)]
+            for index, board in enumerate(boards):
+                self.assertEqual((board.encode(), board.turn), (batch.encode(index), players[batch.turn[index]]))
+                self.assertEqual(board.winner(), players[winners[index]] if winners[index] != NO_PLAYER else None)
+                self.assertEqual(single_steps(board), set(moves[index]))
+            sources, directions = batch.random_moves(random_state)
+            sources[winners != NO_PLAYER] = -1
+            if (sources < 0).all():
+                break
+            chosen = [self.chosen(batch, moves[index], sources[index], directions[index]) for index in xrange(games)]
+            batch.apply(sources, directions)
+            for board, move in zip(boards, chosen):
+                if move:
+                    board.move(*move)
+        self.assertTrue(all(board.winner() for board in boards))
+
+    def chosen(self, batch, moves, source, direction):
+        """Returns the positions of a move chosen by random_moves, checking it is one of the legal moves."""
+        if source < 0:
+            return None
+        lay = batch._layout
+        positions = lay.layout.positions
+        candidates = [(positions[source], positions[targets[direction, source]])
+                      for targets in [lay.step_target, lay.jump_target] if targets[direction, source] >= 0]
+        move = [move for move in candidates if move in moves]
+        self.assertEqual(1, len(move))
+        return move[0]
+
+    def test_from_boards(self):
+        board = Board.from_str("********\n********\n***b****\n**r*****\n********\n********\n********\n**R*****")
+        board.turn = RED
+        batch = BatchBoards.from_boards([new_game(), board])
+        self.assertEqual(repr(board), repr(batch.board(1)))
+        self.assertEqual(RED, batch.board(1).turn)
+        self.assertEqual(single_steps(board), set(batch.moves(1)))
+        self.assertEqual(single_steps(new_game()), set(batch.moves(0)))
+
+    def test_invalid_move(self):
+        batch = BatchBoards(2)
+        with self.assertRaises(CheckersException):
+            batch.apply(numpy.array([0, -1]), numpy.array([0, 0]))
+
+    def test_play_random(self):
+        batch = BatchBoards(50)
+        lengths = batch.play_random(numpy.random.RandomState(7), max_moves=400)
+        self.assertTrue((lengths > 0).all())
+        winners = batch.winners()
+        for index in xrange(50):
+            self.assertTrue(winners[index] != NO_PLAYER or lengths[index] == 400 or not batch.moves(index))
@@ -0,0 +1,23 @@
+from unittest import TestCase
+from checkers.benchmark import PERFT_POSITIONS, run_perft, run_micro, compare
+
+
+class TestBenchmark(TestCase):
+
+    def test_perft_positions(self):
+        results, errors = run_perft(max_depth=3, repeat=1)
+        self.assertEqual([], errors)
+        self.assertEqual(len(PERFT_POSITIONS), len(results))
+        self.assertEqual(302, results['perft start 3']['nodes'])
+
+    def test_micro(self):
+        results = run_micro(repeat=1, min_time=0.001)
+        self.assertTrue(all(result['seconds'] > 0 for result in results.values()))
+        self.assertIn('load_str', results)
+
+    def test_compare(self):
+        baseline = {'a': {'seconds': 1.0}, 'b': {'seconds': 1.0}, 'c': {'seconds': 0}}
+        results = {'a': {'seconds': 1.2}, 'b': {'seconds': 2.0}, 'c': {'seconds': 1.0}, 'd': {'seconds': 1.0}}
+        regressions = compare(results, baseline, tolerance=0.25)
+        self.assertEqual(1, len(regressions))
+        self.assertTrue(regressions[0].startswith('b:'))
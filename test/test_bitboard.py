@@ -0,0 +1,91 @@
+from os.path import join, dirname
+from random import Random
+from unittest import TestCase
+import checkers
+from checkers.internals import RED, BLACK, InvalidMoveException, new_game
+from checkers.bitboard import BitBoard
+
+
+def load_moves(player):
+    with open(join(dirname(checkers.__file__), 'game-data', 'moves-%s' % player), 'r') as move_file:
+        moves = [map(int, line.split()[1:]) for line in move_file if line.strip()]
+    return [((m[0], m[1]), (m[2], m[3])) for m in moves]
+
+
+def valid_moves(board):
+    """Returns all single step moves available to the player to move."""
+    return [(p.location, t) for p in board if p.player == board.turn
+            for t in board.usable_positions() if board._valid_move(p.location, t)]
+
+
+class TestBitBoard(TestCase):
+
+    def setUp(self):
+        self.board = new_game()
+        self.bits = new_game(board_factory=BitBoard)
+
+    def assertSameState(self, msg=None):
+        self.assertEqual(repr(self.board), repr(self.bits), msg)
+        self.assertEqual(self.board.turn, self.bits.turn, msg)
+        self.assertEqual(self.board.winner(), self.bits.winner(), msg)
+        self.assertEqual(self.board.can_jump(), self.bits.can_jump(), msg)
+        for player in [BLACK, RED]:
+            self.assertEqual(self.board.piece_count(player), self.bits.piece_count(player), msg)
+            self.assertEqual(sorted(p.location for p in self.board.pieces(player)),
+                             sorted(p.location for p in self.bits.pieces(player)), msg)
+
+    def test_initial_state(self):
+        self.assertSameState()
+        self.assertEqual(str(self.board), str(self.bits))
+        self.assertEqual(sorted(self.board.start_positions()), sorted(self.bits.start_positions()))
+
+    def test_getitem_and_contains(self):
+        self.assertEqual(BLACK, self.bits[(7, 0)].player)
+        self.assertEqual((7, 0), self.bits[(7, 0)].location)
+        self.assertTrue((7, 0) in self.bits)
+        self.assertFalse((0, 0) in self.bits)
+        self.assertFalse((0, 3) in self.bits)
+        with self.assertRaises(KeyError):
+            self.bits[(0, 3)]
+
+    def test_from_str(self):
+        expected = "*b*b*b*b\nb*b*b*b*\n*b*B*b*b\n********\n********\nr*r*R*r*\n*r*r*r*r\nr*r*r*r*"
+        self.assertEqual(expected, str(BitBoard.from_str(expected)))
+        self.assertTrue(BitBoard.from_str(expected)[(3, 2)].king)
+
+    def test_encode(self):
+        self.board.move((1, 2), (0, 3))
+        self.bits.move((1, 2), (0, 3))
+        self.assertEqual(self.board.encode(), self.bits.encode())
+        self.assertEqual(repr(self.board), repr(BitBoard.from_encoded(self.board.encode())))
+        self.assertEqual(self.board.snapshot(), self.bits.snapshot())
+
+    def test_invalid_moves(self):
+        for src, dst in [((0, 5), (1, 4)), ((1, 2), (1, 3)), ((1, 2), (3, 4)), ((0, 3), (1, 4))]:
+            with self.assertRaises(InvalidMoveException):
+                self.bits.move(src, dst)
+
+    def test_scripted_game(self):
+        moves = {RED: load_moves(RED), BLACK: load_moves(BLACK)}
+        while not self.board.winner():
+            src, dst = moves[self.board.turn].pop(0)
+            captured = self.board.move(src, dst)
+            bits_captured = self.bits.move(src, dst)
+            self.assertEqual(captured and captured.location, bits_captured and bits_captured.location)
+            self.assertSameState('after %s -> %s' % (src, dst))
+        self.assertEqual(BLACK, self.bits.winner())
+
+    def test_random_games(self):
+        rand = Random(1234)
+        for game in xrange(5):
+            self.setUp()
+            for ply in xrange(150):
+                moves = valid_moves(self.board)
+                if self.board.winner() or not moves:
+                    break
+                self.assertEqual(set(moves), set(path[:2] for path in self.board.legal_moves()))
+                src, dst = rand.choice(moves)
+                self.assertTrue(self.bits._valid_move(src, dst))
+                self.board.move(src, dst)
+                self.bits.move(src, dst)
+                self.assertSameState('game %s ply %s' % (game, ply))
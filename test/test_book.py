@@ -0,0 +1,108 @@
+from os.path import join, dirname
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from checkers.internals import RED, BLACK, CheckersException, new_game
+from checkers.engine import Engine
+from checkers.book import BookBuilder, OpeningBook, read_script, interleave, build, HEADER, RECORD
+
+GAME_DATA = join(dirname(__file__), '..', 'checkers', 'game-data')
+
+
+def scripts():
+    result = {}
+    for player in [BLACK, RED]:
+        with open(join(GAME_DATA, 'moves-%s' % player)) as move_file:
+            result[player] = read_script(move_file)
+    return result
+
+
+class TestOpeningBook(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.path = join(self.directory, 'test.book')
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_read_script(self):
+        self.assertEqual([((3, 2), (4, 3)), ((4, 3), (6, 5))], read_script(['MOVE 3 2 4 3\n', '\n', 'MOVE 4 3 6 5']))
+        with self.assertRaises(CheckersException):
+            read_script(['MOVE 3 2 4'])
+
+    def test_interleave(self):
+        moves = interleave(scripts())
+        self.assertEqual(len(scripts()[BLACK]) + len(scripts()[RED]), len(moves))
+        board = new_game()
+        for move in moves:
+            board.move(*move)
+        self.assertEqual(BLACK, board.winner())
+
+    def test_lookup(self):
+        builder = BookBuilder(max_plies=6)
+        builder.add_scripts(scripts())
+        builder.add_game([((1, 2), (0, 3)), ((2, 5), (1, 4))])
+        builder.add_game([((1, 2), (0, 3))])
+        builder.write(self.path)
+        book = OpeningBook(self.path)
+        board = new_game()
+        self.assertEqual([(((1, 2), (0, 3)), 2), (((3, 2), (4, 3)), 1)], book.moves(board))
+        self.assertEqual(((1, 2), (0, 3)), book.choose(board))
+        board.move((3, 2), (4, 3))
+        self.assertEqual([(((6, 5), (5, 4)), 1)], book.moves(board))
+        board.move((6, 5), (5, 4))
+        self.assertEqual(((4, 3), (6, 5)), book.choose(board))
+        self.assertEqual([], book.moves(new_game(10)))
+        board = new_game()
+        board.move((1, 2), (2, 3))
+        self.assertIsNone(book.choose(board))
+        book.close()
+
+    def test_reply_to_capture(self):
+        exchange = [((3, 2), (4, 3)), ((6, 5), (5, 4)), ((4, 3), (6, 5)), ((7, 6), (5, 4)), ((2, 1), (3, 2))]
+        builder = BookBuilder(max_plies=5)
+        builder.add_game(exchange)
+        builder.write(self.path)
+        book = OpeningBook(self.path)
+        self.assertEqual(5, len(book))
+        board = new_game()
+        for move in exchange[:3]:
+            board.move(*move)
+        self.assertEqual([(((7, 6), (5, 4)), 1)], book.moves(board))
+        board.move((7, 6), (5, 4))
+        self.assertEqual(((2, 1), (3, 2)), book.choose(board))
+        book.close()
+
+    def test_plies(self):
+        builder = BookBuilder(max_plies=2)
+        builder.add_scripts(scripts())
+        builder.write(self.path)
+        book = OpeningBook(self.path)
+        self.assertEqual(2, len(book))
+        book.close()
+
+    def test_build_and_engine(self):
+        game_path = join(self.directory, 'game')
+        with open(game_path, 'w') as game_file:
+            game_file.write('MOVE 5 2 6 3\nMOVE 2 5 3 4\n')
+        build(self.path, [GAME_DATA, game_path])
+        book = OpeningBook(self.path)
+        engine = Engine(time_budget_ms=10, book=book)
+        board = new_game()
+        self.assertIn(engine.search(board), [((3, 2), (4, 3)), ((5, 2), (6, 3))])
+        self.assertEqual(0, engine.nodes)
+        board.move((5, 2), (6, 3))
+        self.assertEqual(((2, 5), (3, 4)), engine.search(board))
+        book.close()
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as book_file:
+            book_file.write(HEADER.pack('XXXX', 1, 8, 0))
+        with self.assertRaises(CheckersException):
+            OpeningBook(self.path)
+        with open(self.path, 'wb') as book_file:
+            book_file.write(HEADER.pack('CKBK', 1, 8, 2) + '\0' * RECORD.size)
+        with self.assertRaises(CheckersException):
+            OpeningBook(self.path)
+
@@ -0,0 +1,75 @@
+from unittest import TestCase
+from checkers.internals import Board, Piece, BLACK
+from checkers.engine import Engine, ParallelEngine, WIN, is_capture, to_table, from_table
+
+
+class TestEngine(TestCase):
+
+    def setUp(self):
+        self.board = Board()
+        for player, x, y in self.board.start_positions():
+            self.board.add_piece(Piece(player), (x, y))
+
+    def test_is_capture(self):
+        self.assertTrue(is_capture(((1, 2), (3, 4), (5, 6))))
+        self.assertFalse(is_capture(((1, 2), (0, 3))))
+
+    def test_search_leaves_board_unchanged(self):
+        before = repr(self.board), self.board.turn, self.board.zobrist_hash()
+        engine = Engine(time_budget_ms=100)
+        move = engine.search(self.board)
+        self.assertTrue(move in list(self.board.legal_moves()))
+        self.assertEqual(before, (repr(self.board), self.board.turn, self.board.zobrist_hash()))
+        self.assertEqual([], self.board._undo)
+
+    def test_time_budget_and_stats(self):
+        engine = Engine(time_budget_ms=200)
+        engine.search(self.board)
+        stats = engine.stats()
+        self.assertTrue(stats['elapsed_ms'] < 400)
+        self.assertTrue(stats['depth'] >= 1)
+        self.assertTrue(stats['nodes'] > 0)
+        self.assertTrue(stats['nps'] > 0)
+
+    def test_finds_forced_win(self):
+        board = Board.from_str("********\n********\n***b****\nr*******\n***B****\n********\n********\n********")
+        engine = Engine(time_budget_ms=5000, max_depth=6)
+        self.assertEqual(((3, 4), (2, 3)), engine.search(board))
+        self.assertEqual(WIN - 3, engine.score)
+        self.assertEqual(BLACK, board.turn)
+
+    def test_win_distance_from_table(self):
+        """A win found at the root of one search keeps its distance when reached a ply deeper in the next."""
+        board = Board.from_str("********\n********\n***b****\nr*******\n***B****\n********\n********\n********")
+        engine = Engine(time_budget_ms=5000, max_depth=6)
+        board.push(((3, 4), (2, 3)))
+        engine.search_moves(board, list(board.legal_moves()))
+        self.assertEqual(2 - WIN, engine.score)
+        board.pop()
+        engine.search(board)
+        self.assertEqual(WIN - 3, engine.score)
+
+    def test_table_scores(self):
+        for score in [WIN - 7, 7 - WIN, 150, -150]:
+            self.assertEqual(score, from_table(to_table(score, 5), 5))
+        self.assertEqual(WIN - 4, from_table(to_table(WIN - 7, 5), 2))
+        self.assertEqual(150, to_table(150, 5))
+
+    def test_single_move_not_searched(self):
+        board = Board.from_str("********\n********\n***b****\n**r*****\n********\n********\n********\n********")
+        engine = Engine()
+        self.assertEqual(((3, 2), (1, 4)), engine.search(board))
+        self.assertEqual(0, engine.nodes)
+
+    def test_parallel_search(self):
+        engine = ParallelEngine(time_budget_ms=200, processes=2)
+        try:
+            move = engine.search(self.board)
+            self.assertTrue(move in list(self.board.legal_moves()))
+            self.assertTrue(engine.nodes > 0)
+            self.assertTrue(engine.depth >= 1)
+            board = Board.from_str("********\n********\n***b****\nr*******\n***B****\n********\n********\n********")
+            self.assertEqual(((3, 4), (2, 3)), engine.search(board, time_budget_ms=500))
+            self.assertEqual(WIN - 3, engine.score)
+        finally:
+            engine.close()
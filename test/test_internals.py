@@ -1,5 +1,10 @@
+from os.path import join
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
 from unittest import TestCase
-from checkers.internals import Board, Piece, RED, BLACK, players, CheckersException
+from checkers.internals import Board, Piece, MoveTables, RED, BLACK, players, opponent, CheckersException, \
+    InvalidPlacementException, load_move_tables, perft
 
 
 class TestPiece(TestCase):
@@ -72,3 +77,180 @@ class TestBoard(TestCase):
     def test_from_str(self):
         expected = "*b*b*b*b\nb*b*b*b*\n*b*B*b*b\n********\n********\nr*r*R*r*\n*r*r*r*r\nr*r*r*r*"
         self.assertEqual(expected, str(Board.from_str(expected)))
+
+    def test_load_str_invalid(self):
+        with self.assertRaises(CheckersException):
+            Board.from_str("*b*b*b*b\nb*b*b*b*\n*b*b*b*b\n********\n********\nr*r*r*r*\n*r*r*r*r")
+        with self.assertRaises(InvalidPlacementException):
+            self.state.load_str("b*******|********|********|********|********|********|********|********")
+
+    def test_encode(self):
+        self.state.move((1, 2), (0, 3))
+        encoded = self.state.encode()
+        self.assertEqual(len(self.state.usable_positions()), len(encoded))
+        self.assertEqual('bbbbbbbb*bbbb*******rrrrrrrrrrrr', encoded)
+        decoded = Board.from_encoded(encoded)
+        decoded.turn = self.state.turn
+        self.assertEqual(repr(self.state), repr(decoded))
+        self.assertEqual(self.state.zobrist_hash(), decoded.zobrist_hash())
+        self.assertEqual(sorted(self.state.legal_moves()), sorted(decoded.legal_moves()))
+        with self.assertRaises(CheckersException):
+            decoded.load_encoded(encoded[1:])
+
+    def test_snapshot(self):
+        snapshot = self.state.snapshot()
+        before = repr(self.state)
+        self.state.move((1, 2), (0, 3))
+        self.assertEqual(before, repr(snapshot))
+        self.assertEqual(before.replace('|', '\n'), str(snapshot))
+        self.assertEqual(BLACK, snapshot.turn)
+        self.assertTrue((1, 2) in snapshot)
+        self.assertFalse((0, 3) in snapshot)
+        self.assertEqual(BLACK, snapshot[(1, 2)].player)
+        with self.assertRaises(KeyError):
+            snapshot[(0, 3)]
+        self.assertEqual(24, len(list(snapshot)))
+        self.assertIsNone(snapshot.winner())
+        with self.assertRaises(AttributeError):
+            snapshot.turn = RED
+        moved = self.state.snapshot()
+        board = moved.to_board()
+        self.assertEqual((repr(self.state), RED), (repr(board), board.turn))
+        self.assertEqual(self.state.zobrist_hash(), board.zobrist_hash())
+
+    def test_legal_moves_initial(self):
+        moves = sorted(self.state.legal_moves())
+        self.assertEqual(7, len(moves))
+        self.assertTrue(((1, 2), (0, 3)) in moves)
+        self.assertTrue(all(self.state._valid_move(src, dst) for src, dst in moves))
+
+    def test_legal_moves_forced_capture(self):
+        board = Board.from_str("********\n********\n***b****\n**r*****\n********\n********\n********\n********")
+        board.turn = RED
+        self.assertEqual([((2, 3), (4, 1))], list(board.legal_moves()))
+        board = Board.from_str("********\n********\n***b****\n**r*****\n********\n********\n********\n**r*****")
+        self.assertEqual([((3, 2), (1, 4))], list(board.legal_moves()))
+
+    def test_legal_moves_multi_jump(self):
+        board = Board.from_str("********\n****b***\n***r****\n********\n*r*r****\n********\n********\n********")
+        moves = sorted(board.legal_moves())
+        self.assertEqual([((4, 1), (2, 3), (0, 5)), ((4, 1), (2, 3), (4, 5))], moves)
+        path = moves[1]
+        for src, dst in zip(path, path[1:]):
+            self.assertEqual(BLACK, board.turn)
+            board.move(src, dst)
+        self.assertEqual(RED, board.turn)
+        self.assertEqual(1, len(board._player_pieces[RED]))
+
+    def index_locations(self, mask):
+        return set(loc for loc in self.state.usable_positions() if mask >> self.state._tables.square_of[loc] & 1)
+
+    def test_perft(self):
+        self.assertEqual([7, 49, 302, 1469, 7361], [perft(self.state, depth) for depth in xrange(1, 6)])
+        self.assertEqual(1, perft(self.state, 0))
+        self.assertEqual([], self.state._undo)
+        board = Board.from_str("********\n****b***\n***r****\n********\n*r*r****\n********\n********\n********")
+        self.assertEqual(2, perft(board, 1))
+
+    def test_move_index(self):
+        rand = Random(42)
+        for ply in xrange(120):
+            for player in players:
+                pieces = [p.location for p in self.state._player_pieces[player]]
+                jumpers = set(loc for loc in pieces if any(self.state._valid_jump(loc, t)
+                                                           for t in self.state.usable_positions()))
+                tables = self.state._tables
+                movers = set(loc for loc in pieces if any(t not in self.state for t in (
+                    tables.king_moves[loc] if self.state[loc].king else tables.moves[player][loc])))
+                self.assertEqual(jumpers, self.index_locations(self.state._jumpers[player]))
+                self.assertEqual(movers, self.index_locations(self.state._movers[player]))
+            moves = list(self.state.legal_moves())
+            if not moves:
+                break
+            path = rand.choice(moves)
+            for src, dst in zip(path, path[1:]):
+                self.state.move(src, dst)
+
+    def test_zobrist_hash(self):
+        initial = self.state.zobrist_hash()
+        self.assertEqual(initial, Board.from_str(str(self.state)).zobrist_hash())
+        self.state.move((1, 2), (0, 3))
+        self.assertNotEqual(initial, self.state.zobrist_hash())
+        rand = Random(7)
+        for ply in xrange(100):
+            moves = list(self.state.legal_moves())
+            if not moves:
+                break
+            path = rand.choice(moves)
+            for src, dst in zip(path, path[1:]):
+                self.state.move(src, dst)
+            rebuilt = Board.from_str(str(self.state))
+            rebuilt.turn = self.state.turn
+            self.assertEqual(rebuilt.zobrist_hash(), self.state.zobrist_hash())
+        self.state.turn = opponent[self.state.turn]
+        self.assertNotEqual(rebuilt.zobrist_hash(), self.state.zobrist_hash())
+
+    def assertSameBoard(self, expected, board):
+        self.assertEqual(expected[0], repr(board))
+        self.assertEqual(expected[1:], (board.turn, board.last_jump_target, board.zobrist_hash(),
+                                        board._jumpers, board._movers, board._player_pieces))
+
+    def test_push_and_pop(self):
+        rand = Random(3)
+        played = []
+        for ply in xrange(80):
+            moves = list(self.state.legal_moves())
+            if not moves:
+                break
+            before = (repr(self.state), self.state.turn, self.state.last_jump_target, self.state.zobrist_hash(),
+                      dict(self.state._jumpers), dict(self.state._movers),
+                      dict((p, set(s)) for p, s in self.state._player_pieces.items()))
+            for move in moves:
+                self.state.push(move)
+                self.assertEqual(len(played) + 1, self.state.ply)
+                self.assertEqual(move, self.state.pop())
+                self.assertSameBoard(before, self.state)
+            path = rand.choice(moves)
+            self.state.push(path)
+            played.append(before)
+        while played:
+            self.state.pop()
+            self.assertSameBoard(played.pop(), self.state)
+
+    def test_move_tables_shared(self):
+        other = Board()
+        self.assertTrue(other._tables is self.state._tables)
+        self.assertFalse(Board(10)._tables is self.state._tables)
+        self.assertTrue(isinstance(self.state.usable_positions(), frozenset))
+
+    def test_move_tables_immutable(self):
+        for tables in [MoveTables(8), self.state._tables]:
+            with self.assertRaises(TypeError):
+                tables.moves[BLACK][(1, 0)] = frozenset()
+            with self.assertRaises(TypeError):
+                tables.square_of.pop((1, 0))
+            with self.assertRaises(TypeError):
+                tables.square_keys.clear()
+            self.assertTrue(isinstance(tables.square_moves[RED], tuple))
+
+    def test_memory_usage(self):
+        with self.assertRaises(AttributeError):
+            self.state.extra = None
+        with self.assertRaises(AttributeError):
+            Piece(RED).extra = None
+        full = self.state.memory_usage()
+        self.assertTrue(full > Board().memory_usage())
+        self.assertTrue(full < 6144)
+
+    def test_move_tables_save_and_load(self):
+        directory = mkdtemp()
+        try:
+            filename = join(directory, 'tables')
+            MoveTables(8).save(filename)
+            loaded = load_move_tables(filename)
+            self.assertTrue(Board()._tables is loaded)
+            for field in MoveTables.fields:
+                self.assertEqual(getattr(MoveTables(8), field), getattr(loaded, field))
+            self.assertEqual(self.state.zobrist_hash(), Board.from_str(str(self.state)).zobrist_hash())
+        finally:
+            rmtree(directory)
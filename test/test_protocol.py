@@ -0,0 +1,425 @@
+import socket
+from threading import Thread
+from time import time
+from unittest import TestCase, skipIf
+from checkers.internals import RED, BLACK
+from checkers.protocol import CommandHandler, GameRegistry, GameIndex, OK, ERROR
+import checkers.protocol
+
+try:
+    from checkers.async_server import Server as AsyncServer, new_event_loop
+except ImportError:
+    AsyncServer = None
+
+try:
+    from checkers.unthreaded_server import Server as UnthreadedServer, selectors
+    from checkers.threaded_server import Server as ThreadedServer
+except ImportError:
+    UnthreadedServer = ThreadedServer = None
+
+
+class RecordingHandler(CommandHandler):
+
+    def __init__(self, server):
+        self.init_commands()
+        self.server = server
+        self.lines = []
+        self.sent = []
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+    def send_raw(self, data):
+        self.sent.append(data)
+        self.lines.extend(data.rstrip().split('\r\n'))
+
+    def cleanup(self):
+        if self.game:
+            self.game.leave(self)
+            self.game = None
+
+    def _quit(self, *args):
+        self.servicing = False
+
+
+class Registry(GameRegistry):
+
+    def __init__(self):
+        self.init_games()
+
+    def shutdown(self):
+        self.stopped = True
+
+
+class TestCommandHandler(TestCase):
+
+    def setUp(self):
+        self.server = Registry()
+        self.first, self.second = RecordingHandler(self.server), RecordingHandler(self.server)
+
+    def test_new_and_join(self):
+        self.assertEqual(OK, self.first.dispatch('NEW'))
+        game = self.first.game
+        self.assertEqual('STATUS GAME_ID %s' % game.id, self.first.lines[0])
+        self.assertEqual('STATUS LIST %s' % game.id, self.lines_after(self.second, 'LIST')[0])
+        self.assertEqual(OK, self.second.dispatch('JOIN %s' % game.id))
+        self.assertEqual((RED, BLACK), (self.first.player, self.second.player))
+        self.assertIn('STATUS JOINED black', self.first.lines)
+        self.assertEqual(['STATUS TURN black'], self.lines_after(self.first, 'TURN'))
+
+    def test_new_game_ids_are_unique(self):
+        gen_id = checkers.protocol.gen_id
+        checkers.protocol.gen_id = iter(['same', 'same', 'same', 'other']).next
+        try:
+            self.first.dispatch('NEW')
+            self.second.dispatch('NEW')
+        finally:
+            checkers.protocol.gen_id = gen_id
+        self.assertEqual(('same', 'other'), (self.first.game.id, self.second.game.id))
+        self.assertEqual(['STATUS LIST same other'], self.lines_after(RecordingHandler(self.server), 'LIST'))
+
+    def test_move(self):
+        self.first.dispatch('NEW')
+        self.second.dispatch('JOIN %s' % self.first.game.id)
+        self.assertEqual(OK, self.second.dispatch('MOVE 1 2 0 3'))
+        self.assertIn('STATUS MOVED 1 2 0 3', self.first.lines)
+        self.assertEqual('ERROR not your piece', self.first.dispatch('MOVE 3 2 4 3'))
+
+    def test_broadcast_encoded_once(self):
+        self.first.dispatch('NEW')
+        self.second.dispatch('JOIN %s' % self.first.game.id)
+        spectators = [RecordingHandler(self.server) for i in xrange(3)]
+        for spectator in spectators:
+            self.assertEqual(OK, spectator.dispatch('SPECTATE %s' % self.first.game.id))
+        self.assertEqual(5, len(self.first.game.recipients))
+        handlers = [self.first, self.second] + spectators
+        for handler in handlers:
+            del handler.sent[:]
+        self.second.dispatch('MOVE 1 2 0 3')
+        data = self.first.sent[0]
+        self.assertEqual('STATUS MOVED 1 2 0 3\r\nSTATUS TURN red\r\n', data)
+        self.assertTrue(all(handler.sent == [data] and handler.sent[0] is data for handler in handlers))
+        spectators[0].dispatch('LEAVE')
+        self.assertEqual(4, len(self.first.game.recipients))
+
+    def test_pipelined(self):
+        self.first.handle_lines(['NEW\r', 'BOARD', 'FLY', 'QUIT', 'TURN'])
+        self.assertEqual(1, self.first.flushes)
+        results = [line for line in self.first.lines if not line.startswith('STATUS')]
+        self.assertEqual([OK, 'STATUS BOARD'], [self.first.lines[4], self.first.lines[5][:12]])
+        self.assertEqual([OK, OK, 'ERROR invalid command', OK], results)
+
+    def test_errors(self):
+        self.assertEqual('ERROR invalid command', self.first.dispatch('FLY'))
+        self.assertEqual('ERROR invalid command', self.first.dispatch(''))
+        self.assertEqual('ERROR not playing a game', self.first.dispatch('BOARD'))
+        self.assertEqual('ERROR game not available', self.first.dispatch('JOIN nothing'))
+
+    def test_quit_and_shutdown(self):
+        self.assertEqual(OK, self.first.dispatch('QUIT'))
+        self.assertFalse(self.first.servicing)
+        self.assertEqual(OK, self.first.dispatch('SHUTDOWN'))
+        self.assertTrue(self.server.stopped)
+
+    def test_lobby_index(self):
+        self.first.dispatch('NEW')
+        game = self.first.game
+        self.assertEqual([game], self.server.get_open_games())
+        self.second.dispatch('JOIN %s' % game.id)
+        self.assertEqual([], self.server.get_open_games())
+        self.assertEqual([game], self.server.get_unfinished_games())
+        self.first.dispatch('LEAVE')
+        self.assertEqual([game], self.server.get_open_games())
+        self.first.dispatch('JOIN %s' % game.id)
+        game.board.load_encoded('********b****r******************')
+        game.snapshot = game.board.snapshot()
+        self.assertEqual(OK, self.second.dispatch('MOVE 1 2 3 4'))
+        self.assertEqual('black', game.winner)
+        self.assertEqual(([], []), (self.server.get_open_games(), self.server.get_unfinished_games()))
+        self.assertIn(game, self.server.get_games())
+
+    def test_idle_games_expire(self):
+        self.first.dispatch('NEW')
+        game = self.first.game
+        self.assertEqual(1, len(self.server.timers))
+        self.server.timers.advance(time() + self.server.prune_inactive + 1)
+        self.assertEqual([game], self.server.get_open_games())
+        self.assertEqual(1, len(self.server.timers))
+        game.last_interaction -= self.server.prune_inactive + 1
+        self.server.timers.advance(time() + 2 * self.server.prune_inactive + 2)
+        self.assertEqual(([], {}), (self.server.get_unfinished_games(), self.server.games))
+        self.assertEqual(0, len(self.server.timers))
+
+    def test_out_of_time(self):
+        self.server.time_control = 60
+        self.first.dispatch('NEW')
+        game = self.first.game
+        self.assertEqual(1, len(self.server.timers))
+        self.second.dispatch('JOIN %s' % game.id)
+        self.assertEqual(2, len(self.server.timers))
+        self.second.dispatch('MOVE 1 2 0 3')
+        self.assertTrue(game.clocks[BLACK] <= 60)
+        self.assertEqual(RED, game.board.turn)
+        self.first.dispatch('LEAVE')
+        self.server.timers.advance(time() + 61)
+        self.assertEqual(None, game.winner)
+        self.first.dispatch('JOIN %s' % game.id)
+        del self.second.lines[:]
+        self.server.timers.advance(time() + 120)
+        self.assertEqual(['STATUS OUT_OF_TIME red', 'STATUS WINNER black'], self.second.lines)
+        self.assertEqual(BLACK, game.winner)
+        self.assertEqual('ERROR game over', self.first.dispatch('MOVE 5 0 4 1'))
+        self.assertEqual([], self.server.get_unfinished_games())
+
+    def test_move_after_running_out_of_time(self):
+        self.server.time_control = 60
+        self.first.dispatch('NEW')
+        game = self.first.game
+        self.second.dispatch('JOIN %s' % game.id)
+        game.clock_started -= 61
+        del self.first.lines[:]
+        self.assertEqual('ERROR out of time', self.second.dispatch('MOVE 1 2 0 3'))
+        self.assertEqual(['STATUS OUT_OF_TIME black', 'STATUS WINNER red'], self.first.lines)
+        self.assertEqual((RED, 0.0, 1), (game.winner, game.clocks[BLACK], len(self.server.timers)))
+        self.server.timers.advance(time() + 120)
+        self.assertEqual(2, len(self.first.lines))
+
+    def test_list_pages(self):
+        handlers = [RecordingHandler(self.server) for i in xrange(5)]
+        for handler in handlers:
+            handler.dispatch('NEW')
+        ids = [handler.game.id for handler in handlers]
+        self.assertEqual(['STATUS LIST %s %s' % tuple(ids[:2]), 'STATUS LIST_NEXT 2'],
+                         self.lines_after(self.first, 'LIST 2'))
+        self.second.dispatch('JOIN %s' % ids[2])
+        self.assertEqual(['STATUS LIST %s %s' % tuple(ids[3:])], self.lines_after(self.first, 'LIST 2 2'))
+        self.second.dispatch('LEAVE')
+        self.assertEqual(['STATUS LIST %s' % ids[2]], self.lines_after(self.first, 'LIST 2 5'))
+        self.assertEqual(['STATUS LIST SPECTATE %s' % ids[4]], self.lines_after(self.first, 'LIST SPECTATE 10 4'))
+        self.assertEqual('ERROR invalid list page', self.first.dispatch('LIST 0'))
+        self.assertEqual('ERROR invalid list page', self.first.dispatch('LIST SPECTATE 1 next'))
+
+    def test_list_pages_exclude_own_game(self):
+        handlers = [RecordingHandler(self.server) for i in xrange(3)]
+        for handler in handlers:
+            handler.dispatch('NEW')
+        ids = [handler.game.id for handler in handlers]
+        self.assertEqual(['STATUS LIST %s' % ids[1], 'STATUS LIST_NEXT 2'], self.lines_after(handlers[0], 'LIST 1'))
+        self.assertEqual(['STATUS LIST %s' % ids[2]], self.lines_after(handlers[0], 'LIST 1 2'))
+        self.assertEqual(['STATUS LIST %s' % ids[2]], self.lines_after(handlers[1], 'LIST 1 1'))
+
+    def test_list_without_numeric_limit(self):
+        handlers = [RecordingHandler(self.server) for i in xrange(2)]
+        for handler in handlers:
+            handler.dispatch('NEW')
+        self.assertEqual(['STATUS LIST %s' % handlers[1].game.id], self.lines_after(handlers[0], 'LIST all'))
+
+    def lines_after(self, handler, line):
+        del handler.lines[:]
+        self.assertEqual(OK, handler.dispatch(line))
+        return handler.lines
+
+
+class FakeGame(object):
+
+    def __init__(self, game_id):
+        self.id = game_id
+
+
+class TestGameIndex(TestCase):
+
+    def setUp(self):
+        self.index = GameIndex()
+        self.games = [FakeGame(i) for i in xrange(10)]
+        for game in self.games:
+            self.index.add(game)
+
+    def test_pages(self):
+        self.assertEqual((self.games[:4], 4), self.index.page(4))
+        self.assertEqual((self.games[4:8], 8), self.index.page(4, 4))
+        self.assertEqual((self.games[8:], None), self.index.page(4, 8))
+
+    def test_pages_exclude(self):
+        self.assertEqual((self.games[:1] + self.games[2:4], 4), self.index.page(3, exclude=self.games[1]))
+        self.assertEqual((self.games[8:9], None), self.index.page(1, 8, exclude=self.games[9]))
+
+    def test_games_with_the_same_id(self):
+        same = FakeGame(3)
+        self.index.add(same)
+        self.index.remove(self.games[3])
+        self.assertEqual(self.games[:3] + self.games[4:] + [same], self.index.values())
+
+    def test_pages_stay_in_place(self):
+        self.index.remove(self.games[1])
+        self.index.remove(self.games[5])
+        self.index.add(self.games[1])
+        self.assertEqual((self.games[2:5] + self.games[6:7], 7), self.index.page(4, 1))
+        self.assertEqual((self.games[7:] + self.games[1:2], None), self.index.page(4, 7))
+        self.assertEqual(9, len(self.index))
+
+    def test_compacts_removed_numbers(self):
+        games = [FakeGame(i) for i in xrange(10, 200)]
+        for game in games:
+            self.index.add(game)
+        for game in games:
+            self.index.remove(game)
+        self.assertTrue(len(self.index.order) <= 2 * len(self.index) + 64)
+        self.assertEqual(self.games, self.index.values())
+
+
+class ServerTestCase(object):
+
+    def start(self, server):
+        self.server = server
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        socket.create_connection(self.address(), 5).close()  # Wakes a server waiting for events
+        self.thread.join()
+
+    def test_pipelined(self):
+        sock = self.connect()
+        sock.sendall('NEW\r\nBOARD\r\nFLY\r\nTURN\r\n')
+        lines = self.read_results(sock, 4)
+        results = [line for line in lines if not line.startswith('STATUS')]
+        self.assertEqual([OK, OK, 'ERROR invalid command', OK], results)
+        self.assertEqual('STATUS TURN waiting', lines[-2])
+        sock.close()
+
+    def test_last_line_without_terminator(self):
+        sock = self.connect()
+        sock.sendall('NEW\r\nTURN')
+        sock.shutdown(socket.SHUT_WR)
+        self.assertEqual('STATUS TURN waiting', self.read_results(sock, 2)[-2])
+        sock.close()
+
+    def address(self):
+        return self.server.server_address[:2]
+
+    def connect(self):
+        return socket.create_connection(self.address(), 5)
+
+    def request(self, sock, line):
+        """Sends a request and returns the lines received up to its result."""
+        sock.sendall(line + '\r\n')
+        return self.read_until(sock, lambda line: line == OK or line.startswith(ERROR))
+
+    def read_results(self, sock, count):
+        """Returns the lines received up to the given number of results."""
+        lines, data = [], ''
+        while sum(1 for line in lines if line == OK or line.startswith(ERROR)) < count:
+            data += sock.recv(4096)
+            lines = data.split('\r\n')[:-1]
+        return lines
+
+    def read_until(self, sock, last):
+        lines, data = [], ''
+        while not lines or not last(lines[-1]):
+            data += sock.recv(4096)
+            lines = data.split('\r\n')[:-1]
+        return lines
+
+
+@skipIf(AsyncServer is None, 'neither asyncio nor trollius is installed')
+class TestAsyncServer(ServerTestCase, TestCase):
+
+    def setUp(self):
+        self.start(AsyncServer(ip='127.0.0.1', port=0, loop=new_event_loop('asyncio')))
+
+    def test_game(self):
+        first, second = self.connect(), self.connect()
+        lines = self.request(first, 'NEW')
+        game_id = lines[0].split()[-1]
+        self.assertEqual('STATUS GAME_ID', lines[0].rsplit(' ', 1)[0])
+        self.assertIn('STATUS YOU_ARE red', lines)
+        self.assertIn('STATUS YOU_ARE black', self.request(second, 'JOIN %s' % game_id))
+        self.assertEqual(['STATUS MOVED 1 2 0 3', 'STATUS TURN red', OK], self.request(second, 'MOVE 1 2 0 3'))
+        self.assertIn('STATUS MOVED 1 2 0 3', self.request(first, 'QUIT'))
+        self.assertEqual('', first.recv(1))
+        self.assertIn('STATUS LEFT red', self.read_until(second, lambda line: line == 'STATUS TURN waiting'))
+        for sock in [first, second]:
+            sock.close()
+
+
+@skipIf(ThreadedServer is None, 'zeroconf is not installed')
+class TestThreadedServer(ServerTestCase, TestCase):
+
+    def setUp(self):
+        self.start(ThreadedServer(ip='127.0.0.1', port=0))
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.server.server_close()
+
+
+@skipIf(UnthreadedServer is None, 'zeroconf is not installed')
+class TestUnthreadedServer(ServerTestCase, TestCase):
+
+    def setUp(self):
+        self.start(UnthreadedServer(ip='127.0.0.1', port=0))
+
+    def test_many_connections(self):
+        try:
+            import resource
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(max(soft, 2600), hard), hard))
+        except (ImportError, ValueError):
+            pass
+        clients = [self.connect() for i in xrange(1100)]
+        self.assertEqual('ERROR not playing a game', self.request(clients[-1], 'BOARD')[-1])
+        self.assertEqual(OK, self.request(clients[0], 'NEW')[-1])
+        for sock in clients:
+            sock.close()
+
+
+@skipIf(UnthreadedServer is None, 'zeroconf is not installed')
+class TestOutboundQueue(TestCase):
+
+    def setUp(self):
+        self.server = UnthreadedServer(ip='127.0.0.1', port=0)
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+        self.server.new_handler(self.sock)
+        self.handler = self.server.handlers[self.sock]
+        self.handler.high_watermark, self.handler.low_watermark = 4096, 1024
+
+    def tearDown(self):
+        self.server.cleanup()
+        self.server.socket.close()
+        self.peer.close()
+
+    def fill(self):
+        """Writes until the socket stops taking data and some is queued."""
+        while not self.handler.outbound:
+            self.handler.send_line('STATUS ' + 'x' * 1000)
+
+    def test_backpressure(self):
+        self.fill()
+        self.assertTrue(self.handler.events & selectors.EVENT_WRITE)
+        while not self.handler.paused:
+            self.handler.send_line('STATUS ' + 'x' * 1000)
+        self.assertFalse(self.handler.events & selectors.EVENT_READ)
+        self.peer.setblocking(False)
+        while self.handler.outbound:
+            try:
+                while self.peer.recv(65536):
+                    pass
+            except socket.error:
+                pass
+            self.handler.flush()
+        self.assertFalse(self.handler.paused)
+        self.assertEqual(selectors.EVENT_READ, self.handler.events)
+        self.assertEqual(0, self.handler.outbound_size)
+
+    def test_disconnect_slow_client(self):
+        self.handler.outbound_limit = 8192
+        self.fill()
+        while not self.handler.closing:
+            self.handler.send_line('STATUS ' + 'x' * 1000)
+        self.assertEqual(0, self.handler.outbound_size)
+        self.assertIn(self.sock, self.server.sockets_to_close)
+        self.server.cleanup()
+        self.assertEqual({}, self.server.handlers)
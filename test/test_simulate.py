@@ -0,0 +1,34 @@
+from unittest import TestCase
+from checkers.internals import RED, BLACK
+from checkers.engine import Engine
+from checkers.simulate import Simulator, RandomPolicy, ScriptedPolicy, EnginePolicy, length_distribution
+
+
+class TestSimulator(TestCase):
+
+    def test_random_games(self):
+        results = Simulator({BLACK: RandomPolicy(1), RED: RandomPolicy(2)}).run(10)
+        self.assertEqual(10, results['games'])
+        self.assertEqual(10, results['wins'][BLACK] + results['wins'][RED] + results['draws'])
+        self.assertTrue(results['moves'] >= 10 * results['lengths']['min'])
+        repeated = Simulator({BLACK: RandomPolicy(1), RED: RandomPolicy(2)}).run(10)
+        self.assertEqual((results['moves'], results['wins']), (repeated['moves'], repeated['wins']))
+
+    def test_scripted_game(self):
+        simulator = Simulator({BLACK: ScriptedPolicy.load(BLACK), RED: ScriptedPolicy.load(RED)})
+        for game in xrange(2):
+            self.assertEqual(BLACK, simulator.play()[0])
+
+    def test_max_moves(self):
+        winner, moves = Simulator({BLACK: RandomPolicy(3), RED: RandomPolicy(4)}, max_moves=5).play()
+        self.assertEqual((None, 5), (winner, moves))
+
+    def test_engine_policy(self):
+        simulator = Simulator({BLACK: EnginePolicy(Engine(time_budget_ms=10, max_depth=2)), RED: RandomPolicy(5)})
+        winner, moves = simulator.play()
+        self.assertEqual(BLACK, winner)
+
+    def test_length_distribution(self):
+        self.assertEqual({}, length_distribution([]))
+        lengths = length_distribution(range(1, 101))
+        self.assertEqual({'min': 1, 'max': 100, 'mean': 50.5, 'p50': 51, 'p90': 91, 'p99': 100}, lengths)
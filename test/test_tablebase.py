@@ -0,0 +1,165 @@
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from checkers.internals import Board, Piece, RED
+from checkers.engine import Engine, TABLEBASE_WIN
+from checkers.tablebase import Tablebase, Indexer, generate, signatures, rank, unrank, WIN, LOSS, DRAW, INVALID
+from checkers.tablebase import _generate_table
+
+
+class TestIndexer(TestCase):
+
+    def test_rank_round_trip(self):
+        for r in xrange(200):
+            combination = unrank(r, 3)
+            self.assertEqual(sorted(set(combination)), combination)
+            self.assertEqual(r, rank(combination))
+
+    def test_signature_order(self):
+        sigs = signatures(3)
+        self.assertEqual((0, 1, 0, 1), sigs[0])
+        self.assertTrue(sigs.index((0, 2, 0, 1)) < sigs.index((1, 1, 0, 1)))
+        self.assertFalse((0, 0, 1, 1) in sigs)
+
+    def test_index_round_trip(self):
+        indexer = Indexer((1, 1, 1, 0))
+        self.assertEqual(2 * 28 * 28 * 30, indexer.size)
+        invalid = 0
+        for index in xrange(0, indexer.size, 7):
+            position = indexer.position(index)
+            if position is None:
+                invalid += 1
+            else:
+                self.assertEqual(index, indexer.index(*position))
+        self.assertTrue(invalid > 0)
+
+
+class TestTablebase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = mkdtemp()
+        generate(cls.directory, 2, distance=True)
+        cls.tablebase = Tablebase(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tablebase.close()
+        rmtree(cls.directory)
+
+    def test_max_pieces(self):
+        self.assertEqual(2, self.tablebase.max_pieces)
+
+    def test_probe(self):
+        board = Board.from_str("********\n********\n********\n********\n***B****\n**R*****\n********\n********")
+        self.assertEqual(WIN, self.tablebase.probe(board))
+        self.assertEqual(1, self.tablebase.distance(board))
+        board.turn = RED
+        self.assertEqual(WIN, self.tablebase.probe(board))
+        board = Board.from_str("********\n********\n********\n********\n***B****\n********\n********\n********")
+        self.assertIsNone(self.tablebase.probe(board))
+
+    def test_results_consistent(self):
+        """Every stored result must follow from the results of the positions one move away."""
+        counts = {WIN: 0, LOSS: 0, DRAW: 0}
+        board = Board()
+        for signature in signatures(2):
+            indexer = self.tablebase.indexer(signature)
+            for index in xrange(indexer.size):
+                stored = self.tablebase.probe_index(signature, index)
+                position = indexer.position(index)
+                if position is None:
+                    self.assertEqual(INVALID, stored)
+                    continue
+                board.clear()
+                for squares, letter in zip(position[:4], 'bBrR'):
+                    for square in squares:
+                        board.add_piece(Piece.from_repr(letter), indexer.squares[square])
+                board.turn = turn = position[4]
+                outcomes = []
+                for move in board.legal_moves():
+                    board.push(move)
+                    if board.winner():
+                        outcomes.append(WIN)
+                    else:
+                        result = self.tablebase.probe(board)
+                        if result != DRAW and board.turn != turn:
+                            result = WIN if result == LOSS else LOSS
+                        outcomes.append(result)
+                    board.pop()
+                if WIN in outcomes:
+                    expected = WIN
+                elif outcomes and all(outcome == LOSS for outcome in outcomes):
+                    expected = LOSS
+                else:
+                    expected = DRAW
+                if expected != stored:
+                    self.fail('stored %s, expected %s for %s to move on\n%s' % (stored, expected, turn, board))
+                counts[stored] += 1
+        self.assertTrue(all(counts.values()))
+
+    def test_engine_uses_tablebase(self):
+        board = Board.from_str("********\n********\n********\n********\n***B****\n********\n*****r**\n********")
+        engine = Engine(time_budget_ms=1000, max_depth=3, tablebase=self.tablebase)
+        engine.search(board)
+        self.assertTrue(abs(engine.score) <= TABLEBASE_WIN)
+        self.assertTrue(engine.nodes < 100)
+
+
+class TestDistances(TestCase):
+
+    """A king and a man against a king on a 6x6 board, where the man promoting leaves the signature and the other
+    moves stay in it."""
+
+    signature = (1, 1, 0, 1)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = mkdtemp()
+        generate(cls.directory, 2, dim=6, distance=True)
+        for signature in [(0, 2, 0, 1), cls.signature]:
+            tablebase = Tablebase(cls.directory, 6)
+            _generate_table(tablebase, signature, True)
+            tablebase.close()
+        cls.tablebase = Tablebase(cls.directory, 6)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tablebase.close()
+        rmtree(cls.directory)
+
+    def test_shortest_wins(self):
+        """Every stored distance must be the shortest win, or longest loss, over the positions one move away, also
+        where a win leaving the signature is slower than one within it."""
+        tablebase, board = self.tablebase, Board(6)
+        indexer = tablebase.indexer(self.signature)
+        slower_cross_wins = 0
+        for index in xrange(indexer.size):
+            stored = tablebase.probe_index(self.signature, index)
+            if stored not in (WIN, LOSS):
+                continue
+            position = indexer.position(index)
+            board.clear()
+            for squares, letter in zip(position[:4], 'bBrR'):
+                for square in squares:
+                    board.add_piece(Piece.from_repr(letter), indexer.squares[square])
+            board.turn = turn = position[4]
+            wins, losses = [], []
+            for move in board.legal_moves():
+                board.push(move)
+                if board.winner():
+                    wins.append((1, False))
+                else:
+                    result, plies = tablebase.probe(board), tablebase.distance(board) + 1
+                    inside = tablebase.locate(board)[0] == self.signature
+                    if result != DRAW:
+                        (wins if (result == LOSS) == (board.turn != turn) else losses).append((plies, inside))
+                board.pop()
+            distance = tablebase.distance_index(self.signature, index)
+            if stored == WIN:
+                self.assertEqual(min(wins)[0], distance)
+                if min(wins)[1] and any(not inside for plies, inside in wins):
+                    slower_cross_wins += 1
+            else:
+                self.assertEqual(max(losses)[0], distance)
+        self.assertTrue(slower_cross_wins > 0)
@@ -0,0 +1,116 @@
+from unittest import TestCase
+from checkers.timers import TimerWheel, TimerThread
+from threading import Event
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimerWheel(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wheel = TimerWheel(tick=0.1, slots=16, clock=self.clock)
+        self.fired = []
+
+    def schedule(self, delay, name):
+        return self.wheel.schedule(delay, self.fired.append, name)
+
+    def advance_to(self, now):
+        self.clock.now = now
+        return self.wheel.advance()
+
+    def test_fires_in_deadline_order(self):
+        self.schedule(0.35, 'b')
+        self.schedule(0.15, 'a')
+        self.schedule(0.5, 'c')
+        self.assertEqual(0, self.advance_to(1000.1))
+        self.assertEqual(2, self.advance_to(1000.4))
+        self.assertEqual(['a', 'b'], self.fired)
+        self.assertEqual(1, len(self.wheel))
+
+    def test_later_turns_of_the_wheel(self):
+        self.schedule(5.0, 'late')
+        self.schedule(1.6, 'one turn')
+        for i in xrange(1, 50):
+            self.advance_to(1000.0 + i * 0.1)
+        self.assertEqual(['one turn'], self.fired)
+        self.advance_to(1005.0)
+        self.assertEqual(['one turn', 'late'], self.fired)
+        self.assertEqual(0, len(self.wheel))
+
+    def test_advance_past_many_turns(self):
+        self.schedule(3.0, 'a')
+        self.schedule(30.0, 'b')
+        self.advance_to(1100.0)
+        self.assertEqual(['a', 'b'], self.fired)
+
+    def test_cancel(self):
+        timer = self.schedule(0.2, 'cancelled')
+        self.schedule(0.2, 'kept')
+        timer.cancel()
+        self.assertFalse(timer.active)
+        self.advance_to(1001.0)
+        self.assertEqual(['kept'], self.fired)
+
+    def test_next_timeout(self):
+        self.assertEqual(None, self.wheel.next_timeout())
+        self.schedule(1.05, 'a')
+        self.assertAlmostEqual(1.1, self.wheel.next_timeout())
+        self.schedule(0.25, 'b')
+        self.assertAlmostEqual(0.3, self.wheel.next_timeout())
+        self.advance_to(1000.3)
+        self.assertAlmostEqual(0.8, self.wheel.next_timeout())
+
+    def test_next_timeout_beyond_one_turn(self):
+        self.schedule(0.5, 'a')
+        self.schedule(10.0, 'b')
+        self.assertAlmostEqual(0.5, self.wheel.next_timeout())
+        self.advance_to(1000.5)
+        self.assertAlmostEqual(9.5, self.wheel.next_timeout())
+
+    def test_next_timeout_after_cancel(self):
+        timer = self.schedule(0.25, 'a')
+        self.schedule(1.05, 'b')
+        self.assertAlmostEqual(0.3, self.wheel.next_timeout())
+        timer.cancel()
+        self.assertAlmostEqual(1.1, self.wheel.next_timeout())
+        for i in xrange(200):
+            self.schedule(2.0 + i, 'c').cancel()
+        self.assertAlmostEqual(1.1, self.wheel.next_timeout())
+        self.assertTrue(len(self.wheel.heap) <= 2 * len(self.wheel.ticks) + 64)
+
+    def test_wakeup_when_due_earlier(self):
+        wakeups = []
+        self.wheel.wakeup = lambda: wakeups.append(True)
+        self.schedule(1.0, 'a')
+        self.wheel.next_timeout()
+        self.schedule(2.0, 'b')
+        self.assertEqual(1, len(wakeups))
+        self.schedule(0.5, 'c')
+        self.assertEqual(2, len(wakeups))
+
+    def test_callback_errors_are_contained(self):
+        self.wheel.schedule(0.1, lambda: 1 / 0)
+        self.schedule(0.1, 'after')
+        self.assertEqual(2, self.advance_to(1000.2))
+        self.assertEqual(['after'], self.fired)
+
+
+class TestTimerThread(TestCase):
+
+    def test_fires(self):
+        wheel = TimerWheel(tick=0.01)
+        thread = TimerThread(wheel)
+        thread.start()
+        fired = Event()
+        wheel.schedule(0.05, fired.set)
+        self.assertTrue(fired.wait(5))
+        thread.stop()
+        self.assertFalse(thread.is_alive())
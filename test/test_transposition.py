@@ -0,0 +1,35 @@
+from unittest import TestCase
+from checkers.transposition import TranspositionTable, EXACT, LOWER
+
+
+class TestTranspositionTable(TestCase):
+
+    def setUp(self):
+        self.table = TranspositionTable(100)
+
+    def test_size_rounded_to_power_of_two(self):
+        self.assertEqual(127, self.table.mask)
+        self.assertEqual(0, len(self.table))
+
+    def test_put_and_get(self):
+        self.assertTrue(self.table.put(12345, 3, 50, EXACT, ((1, 2), (0, 3))))
+        self.assertTrue(12345 in self.table)
+        self.assertEqual((3, 50, EXACT, ((1, 2), (0, 3))), self.table.get(12345))
+        self.assertIsNone(self.table.get(12345 + 128))
+
+    def test_depth_preferred_replacement(self):
+        self.table.put(1, 5, 10)
+        self.assertFalse(self.table.put(1 + 128, 2, 20))
+        self.assertEqual((5, 10, EXACT, None), self.table.get(1))
+        self.assertTrue(self.table.put(1 + 128, 6, 20, LOWER))
+        self.assertIsNone(self.table.get(1))
+        self.assertTrue(self.table.put(1 + 128, 1, 30))
+        self.assertEqual((1, 30, EXACT, None), self.table.get(1 + 128))
+
+    def test_stale_entries_replaced(self):
+        self.table.put(1, 5, 10)
+        self.table.new_search()
+        self.assertTrue(self.table.put(1 + 128, 2, 20))
+        self.assertEqual(1, len(self.table))
+        self.table.clear()
+        self.assertEqual(0, len(self.table))